@@ -0,0 +1,16 @@
+from __future__ import print_function  # better print function
+import sys                             # for command line arguments
+import backup_engine                   # shared backup engine
+
+# ----------------------------------------------------------------------
+# OVERVIEW: This program backs up config files and the Storage directory
+# (jobs config and storage of backup_jobs.ini) of several environments
+# at once, for example during upgrade rehearsals:
+#   python backup_all.py --env test --env live --workers 16
+# All machines are handled from one asyncio event loop (Python 3.7 or
+# newer, see backup_async.py); each job writes its usual run directory
+# (Configs_<timestamp>, Storage_<timestamp>), log and report.
+# Run with --help to see the other options.
+# ----------------------------------------------------------------------
+
+backup_engine.main(["config", "storage", "--async"] + sys.argv[1:])
@@ -0,0 +1,130 @@
+from __future__ import print_function  # better print function
+import os                              # file/directory functions
+import tarfile                         # for tar archives
+import zipfile                         # for zip archives
+try:
+    import lzma                        # for tar.xz (Python 3 only)
+except ImportError:
+    lzma = None
+try:
+    import zstandard                   # for tar.zst (pip install zstandard)
+except ImportError:
+    zstandard = None
+
+# ----------------------------------------------------------------------
+# OVERVIEW: Archive writer used by backup_engine.py. A directory tree is
+# streamed file by file straight into one compressed archive, so no
+# uncompressed copy is ever written to the destination.
+#
+# Supported formats:
+#   zip      - deflate, works everywhere
+#   tar.gz   - gzip
+#   tar.bz2  - bzip2
+#   tar.xz   - xz/lzma, needs Python 3
+#   tar.zst  - zstandard, needs the zstandard package (pip install zstandard)
+#
+# Compression level is 1 (fastest) to 9 (smallest) for all formats except
+# tar.zst, which accepts 1 to 22.
+# ----------------------------------------------------------------------
+
+archive_formats = ("zip", "tar.gz", "tar.bz2", "tar.xz", "tar.zst")
+
+
+def check_format(archive_format):
+    '''
+    Raises ValueError if the given archive format can't be written
+    with this Python installation.
+    '''
+    if archive_format not in archive_formats:
+        raise ValueError("Unknown archive format: '{0}'".format(archive_format))
+    if archive_format == "tar.xz" and lzma is None:
+        raise ValueError("Archive format tar.xz needs Python 3")
+    if archive_format == "tar.zst" and zstandard is None:
+        raise ValueError("Archive format tar.zst needs the zstandard package")
+
+
+def archive_tree(src, archive_path, archive_format, level=6, arcname="Storage", bandwidth=None):
+    '''
+    Writes all files under directory src into a compressed archive and
+    returns the number of files archived. Paths inside the archive start
+    with arcname. If bandwidth is given (see backup_throttle.py), the
+    size of each file is taken from it after the file is archived.
+
+    The archive is written under a temporary name (.part) and renamed
+    when complete, so an interrupted run never leaves a truncated archive
+    that looks finished.
+    '''
+    check_format(archive_format)
+    part_path = archive_path + ".part"
+    try:
+        if archive_format == "zip":
+            count = _write_zip(src, part_path, level, arcname, bandwidth)
+        else:
+            count = _write_tar(src, part_path, archive_format, level, arcname, bandwidth)
+    except:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    if os.path.exists(archive_path):
+        os.remove(archive_path)
+    os.rename(part_path, archive_path)
+    return count
+
+
+def _walk_files(src, arcname, bandwidth=None):
+    '''
+    Yields (file path, name inside archive) for all files under src.
+    Each file's size is taken from bandwidth once it has been archived.
+    '''
+    for root, dirs, files in os.walk(src):
+        dirs.sort()
+        rel_root = os.path.relpath(root, src).replace("\\", "/")
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if rel_root == ".":
+                yield path, "{0}/{1}".format(arcname, name)
+            else:
+                yield path, "{0}/{1}/{2}".format(arcname, rel_root, name)
+            if bandwidth:
+                bandwidth.consume(os.path.getsize(path))
+
+
+def _write_zip(src, part_path, level, arcname, bandwidth=None):
+    try:
+        archive = zipfile.ZipFile(part_path, "w", zipfile.ZIP_DEFLATED,
+                                  allowZip64=True, compresslevel=level)
+    except TypeError:
+        # Python older than 3.7: compression level is not configurable
+        archive = zipfile.ZipFile(part_path, "w", zipfile.ZIP_DEFLATED,
+                                  allowZip64=True)
+    count = 0
+    with archive:
+        for path, name in _walk_files(src, arcname, bandwidth):
+            archive.write(path, name)
+            count = count + 1
+    return count
+
+
+def _write_tar(src, part_path, archive_format, level, arcname, bandwidth=None):
+    count = 0
+    if archive_format == "tar.zst":
+        compressor = zstandard.ZstdCompressor(level=level)
+        with open(part_path, "wb") as raw:
+            with compressor.stream_writer(raw) as writer:
+                # stream mode ("w|"): the tar module never seeks back
+                tar = tarfile.open(fileobj=writer, mode="w|")
+                for path, name in _walk_files(src, arcname, bandwidth):
+                    tar.add(path, name)
+                    count = count + 1
+                tar.close()
+        return count
+
+    if archive_format == "tar.xz":
+        tar = tarfile.open(part_path, "w:xz", preset=level)
+    else:
+        tar = tarfile.open(part_path, "w:" + archive_format[4:], compresslevel=level)
+    with tar:
+        for path, name in _walk_files(src, arcname, bandwidth):
+            tar.add(path, name)
+            count = count + 1
+    return count
@@ -0,0 +1,46 @@
+import asyncio                         # event loop for the fan-out
+from concurrent.futures import ThreadPoolExecutor  # for blocking file work
+import backup_engine                   # jobs and per-machine backup steps
+
+# ----------------------------------------------------------------------
+# OVERVIEW: Orchestrator behind the --async option of backup_engine.py
+# (Python 3.7 or newer). All machines of all environments given are
+# started from one asyncio event loop, so a rehearsal backs up config and
+# Storage of TEST and LIVE in one program run instead of four.
+#
+# Everything that touches the file system (probes, listings, copies)
+# blocks, so it runs in a thread pool of --workers threads; the event
+# loop only hands out the steps and prints results as machines finish.
+# For every machine the reachability check runs once, and all jobs
+# share it and the directory listings made on that machine (see
+# backup_hosts.py). Run directories, logs and reports are the usual ones
+# of each job. Example:
+#   python backup_engine.py config storage --env test --env live --async --workers 16
+# ----------------------------------------------------------------------
+
+
+async def _backup_machine(loop, executor, jobs, target, hosts):
+    env, machine = target
+    # one check, shared by all jobs of this machine
+    await loop.run_in_executor(executor, hosts.is_reachable, machine)
+    results = []
+    for job in jobs:
+        result = await loop.run_in_executor(
+            executor, backup_engine.backup_machine_job, job, env, machine, hosts)
+        results.append(result)
+    backup_engine.print_results(jobs, env, machine, results)
+
+
+async def _run_jobs(jobs, targets, hosts, workers):
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        await asyncio.gather(*[_backup_machine(loop, executor, jobs, target, hosts)
+                               for target in targets])
+
+
+def run_jobs(jobs, targets, hosts, workers=1):
+    '''
+    Same as backup_engine.run_jobs(), but machines are started from one
+    event loop and their lines are printed in the order they finish.
+    '''
+    asyncio.run(_run_jobs(jobs, targets, hosts, workers))
@@ -0,0 +1,242 @@
+from __future__ import print_function  # better print function
+import os                              # file/directory functions
+import glob                            # for finding the previous run
+import zlib                            # for the weak (Adler-32) block checksum
+import shutil                          # for copying metadata
+import hashlib                         # for the strong block checksum
+import backup_throttle                 # for plain copies where files can't be cloned
+try:
+    import fcntl                       # for cloning files (not on Windows)
+except ImportError:
+    fcntl = None
+
+# ----------------------------------------------------------------------
+# OVERVIEW: Delta copies used by backup_engine.py for large files that
+# were already copied by the previous run (rsync algorithm). Storage
+# trees hold large log files that are appended to, or changed in a few
+# places, between runs; copied in full, every such file is written to
+# the backup share again.
+#
+# How a file is copied:
+#   1. The previous run's copy (the basis) is cut into blocks, and a weak
+#      rolling checksum and a strong MD5 checksum of each block is kept.
+#   2. The new copy starts as a clone of the basis: a file that shares
+#      the basis' blocks on disk, made without writing any data (reflink,
+#      on Btrfs, XFS and other file systems that support it).
+#   3. The source is read once. A window of one block slides over it: if
+#      its weak checksum, and then its strong checksum, matches a basis
+#      block, that block is reused and the window jumps a whole block;
+#      otherwise the window rolls on by one byte. Bytes that match no
+#      block are literal data.
+#   4. Only literal data, and basis blocks that moved to another offset,
+#      are written into the new copy; blocks still at their old offset are
+#      already there. The new copy is then cut to the size of the source.
+#
+# Where the backup share can't clone files, the new copy would have to be
+# written in full anyway, so the file is copied plainly instead.
+#
+# Rolling byte by byte runs in Python and is slow, so it is limited:
+# data past the end of the basis (appended data) is taken as literal at
+# once, and once roll_limit of the basis size has been rolled over, the
+# window only jumps block by block (changes in place are still found).
+#
+# To compare delta copies with plain copies on synthetic trees, run
+# backup_delta_benchmark.py.
+# ----------------------------------------------------------------------
+
+# Size of chunks read from the source:
+chunk_size = 1024 * 1024
+
+# Largest part of the basis size scanned byte by byte, per file:
+roll_limit = 0.25
+
+# Modulus of the Adler-32 checksum:
+_adler_base = 65521
+
+# ioctl that clones a file (FICLONE, from Linux's fs.h; fcntl has it by
+# name only from Python 3.12 on):
+_ficlone = getattr(fcntl, "FICLONE", 0x40049409)
+
+
+def find_previous_run(dest_dir, run_prefix, run_name):
+    '''
+    Returns the directory of the latest run of a job other than run
+    run_name, or None if there is none.
+    '''
+    paths = sorted(glob.glob("{0}/{1}_*".format(dest_dir, run_prefix)))
+    paths = [path for path in paths
+             if os.path.isdir(path) and os.path.basename(path) != run_name]
+    if not paths:
+        return None
+    return paths[-1]
+
+
+def clone_file(basis, dest):
+    '''
+    Makes dest a clone of file basis, without writing any data. Returns
+    False, and leaves no dest, if the file system can't clone files.
+    '''
+    if fcntl is None:
+        return False
+    with open(basis, "rb") as old:
+        with open(dest, "wb") as new:
+            try:
+                fcntl.ioctl(new.fileno(), _ficlone, old.fileno())
+                return True
+            except (IOError, OSError):
+                pass
+    os.remove(dest)
+    return False
+
+
+def _weak(block):
+    return zlib.adler32(bytes(block)) & 0xffffffff
+
+
+def _strong(block):
+    return hashlib.md5(bytes(block)).digest()
+
+
+def signature(basis, block_size):
+    '''
+    Returns a dictionary of weak checksum -> list of (strong checksum,
+    offset) for all whole blocks of the basis file.
+    '''
+    table = {}
+    offset = 0
+    with open(basis, "rb") as old:
+        while True:
+            block = old.read(block_size)
+            if len(block) < block_size:
+                break
+            table.setdefault(_weak(block), []).append((_strong(block), offset))
+            offset = offset + block_size
+    return table
+
+
+def _match(table, buffer, start, block_size, weak):
+    candidates = table.get(weak)
+    if not candidates:
+        return None
+    strong = _strong(buffer[start:start + block_size])
+    for candidate, offset in candidates:
+        if candidate == strong:
+            return offset
+    return None
+
+
+def delta_ops(source, table, basis_size, block_size, bandwidth=None):
+    '''
+    Reads file object source to the end and yields the operations that
+    rebuild it from the basis: ("copy", basis offset, length) for reused
+    blocks and ("data", bytes) for literal data, in source order.
+    '''
+    buffer = bytearray()
+    eof = False
+    position = 0          # window start in buffer
+    literal_start = 0     # start of literal data not yet yielded
+    buffer_offset = 0     # source offset of buffer[0]
+    shift = 0             # source offset - basis offset of the last match
+    rolled = 0
+    max_rolled = int(basis_size * roll_limit)
+    weak = None
+
+    while True:
+        # keep at least a block and the byte after it in the buffer
+        while not eof and len(buffer) - position <= block_size:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                eof = True
+                break
+            if bandwidth:
+                bandwidth.consume(len(chunk))
+            buffer.extend(chunk)
+        if len(buffer) - position < block_size:
+            break
+
+        if buffer_offset + position - shift >= basis_size:
+            # past the end of the basis: the rest is appended data
+            position = position + block_size
+            weak = None
+        else:
+            if weak is None:
+                weak = _weak(buffer[position:position + block_size])
+            offset = _match(table, buffer, position, block_size, weak)
+            if offset is not None:
+                if position > literal_start:
+                    yield ("data", bytes(buffer[literal_start:position]))
+                yield ("copy", offset, block_size)
+                shift = buffer_offset + position - offset
+                position = position + block_size
+                literal_start = position
+                weak = None
+            elif rolled < max_rolled and len(buffer) - position > block_size:
+                # roll the window on by one byte
+                out_byte = buffer[position]
+                in_byte = buffer[position + block_size]
+                a = weak & 0xffff
+                b = weak >> 16
+                a = (a - out_byte + in_byte) % _adler_base
+                b = (b - block_size * out_byte + a - 1) % _adler_base
+                weak = (b << 16) | a
+                position = position + 1
+                rolled = rolled + 1
+            else:
+                position = position + block_size
+                weak = None
+
+        if position - literal_start >= chunk_size:
+            yield ("data", bytes(buffer[literal_start:position]))
+            literal_start = position
+        if literal_start >= chunk_size:
+            # drop data already yielded
+            del buffer[:literal_start]
+            buffer_offset = buffer_offset + literal_start
+            position = position - literal_start
+            literal_start = 0
+
+    if len(buffer) > literal_start:
+        yield ("data", bytes(buffer[literal_start:]))
+
+
+def delta_copy(src, basis, dest, block_size=64 * 1024, bandwidth=None):
+    '''
+    Copies file src to dest, reusing the blocks of file basis (the copy
+    of the same file from the previous run). Source reads are paced by
+    bandwidth (see backup_throttle.py) if given. Returns a dictionary of
+    byte counts: size (of the source), literal (written from the source),
+    moved (basis blocks written at another offset), unchanged (basis
+    blocks left where they were) and written (all bytes written to dest).
+    If dest can't be cloned from the basis, src is copied plainly and
+    all of it counts as literal.
+    '''
+    if not clone_file(basis, dest):
+        backup_throttle.copy_file(src, dest, bandwidth)
+        size = os.path.getsize(dest)
+        return {"size": size, "literal": size, "moved": 0, "unchanged": 0, "written": size}
+    table = signature(basis, block_size)
+    basis_size = os.path.getsize(basis)
+    stats = {"size": 0, "literal": 0, "moved": 0, "unchanged": 0}
+    position = 0
+    with open(src, "rb") as source, open(basis, "rb") as old, open(dest, "r+b") as target:
+        for op in delta_ops(source, table, basis_size, block_size, bandwidth):
+            if op[0] == "copy":
+                offset, length = op[1], op[2]
+                if offset == position:
+                    stats["unchanged"] = stats["unchanged"] + length
+                else:
+                    old.seek(offset)
+                    target.seek(position)
+                    target.write(old.read(length))
+                    stats["moved"] = stats["moved"] + length
+            else:
+                length = len(op[1])
+                target.seek(position)
+                target.write(op[1])
+                stats["literal"] = stats["literal"] + length
+            position = position + length
+        target.truncate(position)
+    stats["size"] = position
+    stats["written"] = stats["literal"] + stats["moved"]
+    shutil.copystat(src, dest)
+    return stats
@@ -0,0 +1,154 @@
+from __future__ import print_function  # better print function
+import os                              # file/directory functions
+import sys                             # for command line arguments
+import time                            # for timing the copies
+import random                          # for synthetic changes
+import shutil                          # for plain copies and cleanup
+import argparse                        # for command line options
+import tempfile                        # for the benchmark directory
+import backup_delta                    # delta copies of large changed files
+
+# ----------------------------------------------------------------------
+# OVERVIEW: Benchmark of delta copies (backup_delta.py) against plain
+# copies on a synthetic Storage tree. The previous run's copy of every
+# file is random data; the current source of each file has data appended
+# to it, like a log file, and some files also have a few blocks changed
+# in place. Both ways of copying are timed, the bytes each one writes are
+# counted (all writes of the process, from /proc/self/io, where there is
+# one), and every delta copy is checked against its source. Delta copies
+# only write less where the file system can clone files (see
+# backup_delta.py); run the benchmark there with --dir. On a local disk
+# plain copies are faster; delta copies pay off when writes to the backup
+# share are the bottleneck, so the time at a given link speed to the
+# share is estimated too. Example:
+#   python backup_delta_benchmark.py --files 20 --size-mb 8 --append-kb 256
+# ----------------------------------------------------------------------
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="backup_delta_benchmark.py",
+        description="Compares delta copies with plain copies on a synthetic append-heavy tree.")
+    parser.add_argument("--files", type=int, default=20, help="number of files (default 20)")
+    parser.add_argument("--size-mb", type=float, default=8, help="size of each file in the "
+                        "previous run, in MB (default 8)")
+    parser.add_argument("--append-kb", type=int, default=256, help="data appended to each "
+                        "file, in KB (default 256)")
+    parser.add_argument("--changed-blocks", type=int, default=4, help="blocks changed in place "
+                        "in every other file (default 4)")
+    parser.add_argument("--block-kb", type=int, default=64, help="delta block size in KB "
+                        "(default 64)")
+    parser.add_argument("--link-mb", type=float, default=10, help="link speed to the backup "
+                        "share for the estimate, in MB/s (default 10)")
+    parser.add_argument("--dir", help="directory for the synthetic tree (default: a "
+                        "temporary directory, removed afterwards)")
+    return parser.parse_args(argv)
+
+
+def make_tree(base, args):
+    '''
+    Writes the previous and current version of each file under base and
+    returns the list of file names.
+    '''
+    random.seed(1)
+    size = int(args.size_mb * 1024 * 1024)
+    for name in ("previous", "source", "plain", "delta"):
+        os.makedirs(os.path.join(base, name))
+    names = []
+    for index in range(args.files):
+        name = "file{0:03d}.log".format(index)
+        data = bytearray(os.urandom(size))
+        with open(os.path.join(base, "previous", name), "wb") as previous:
+            previous.write(data)
+        if index % 2 and size > 100:
+            for change in range(args.changed_blocks):
+                offset = random.randint(0, size - 100)
+                data[offset:offset + 100] = os.urandom(100)
+        data.extend(os.urandom(args.append_kb * 1024))
+        with open(os.path.join(base, "source", name), "wb") as source:
+            source.write(data)
+        names.append(name)
+    return names
+
+
+def bytes_written():
+    '''
+    Returns the number of bytes this process has written so far, or None
+    where the system doesn't tell (anything but Linux).
+    '''
+    try:
+        with open("/proc/self/io") as io:
+            for line in io:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def main(argv):
+    args = parse_args(argv)
+    base = args.dir or tempfile.mkdtemp(prefix="delta_benchmark_")
+    block_size = args.block_kb * 1024
+    try:
+        names = make_tree(base, args)
+        source_bytes = sum([os.path.getsize(os.path.join(base, "source", name)) for name in names])
+        probe = os.path.join(base, "delta", "clone.probe")
+        can_clone = names and backup_delta.clone_file(os.path.join(base, "previous", names[0]), probe)
+        if can_clone:
+            os.remove(probe)
+
+        started = time.time()
+        counter = bytes_written()
+        for name in names:
+            shutil.copy2(os.path.join(base, "source", name), os.path.join(base, "plain", name))
+        plain_seconds = time.time() - started
+        plain_written = source_bytes if counter is None else bytes_written() - counter
+
+        started = time.time()
+        counter = bytes_written()
+        written = 0
+        unchanged = 0
+        for name in names:
+            stats = backup_delta.delta_copy(os.path.join(base, "source", name),
+                                            os.path.join(base, "previous", name),
+                                            os.path.join(base, "delta", name), block_size)
+            written = written + stats["written"]
+            unchanged = unchanged + stats["unchanged"]
+        delta_seconds = time.time() - started
+        if counter is not None:
+            written = bytes_written() - counter
+
+        mismatches = 0
+        for name in names:
+            with open(os.path.join(base, "source", name), "rb") as source:
+                with open(os.path.join(base, "delta", name), "rb") as copy:
+                    if source.read() != copy.read():
+                        mismatches = mismatches + 1
+    finally:
+        if not args.dir:
+            shutil.rmtree(base)
+
+    megabytes = 1024.0 * 1024.0
+    print("{0} files, {1:.1f} MB in total, {2} KB blocks".format(
+        len(names), source_bytes / megabytes, args.block_kb))
+    print("{0:<8} {1:>9} {2:>14} {3:>18}".format(
+        "Copy", "Seconds", "MB written", "s at {0:g} MB/s".format(args.link_mb)))
+    for label, seconds, size in (("plain", plain_seconds, plain_written),
+                                 ("delta", delta_seconds, written)):
+        print("{0:<8} {1:>9.2f} {2:>14.1f} {3:>18.1f}".format(
+            label, seconds, size / megabytes, seconds + size / megabytes / args.link_mb))
+    print("Delta copies left {0:.1f} MB ({1:.0f}%) of the previous run in place.".format(
+        unchanged / megabytes, 100.0 * unchanged / max(source_bytes, 1)))
+    if names and not can_clone:
+        print("The file system of {0} can't clone files: delta copies were plain copies.".format(base))
+    if mismatches:
+        print("{0} delta copies DIFFER from their source.".format(mismatches))
+        return 1
+    print("All delta copies match their source.")
+    return 0
+
+
+if __name__ == "__main__":
+
+    sys.exit(main(sys.argv[1:]))
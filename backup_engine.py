@@ -0,0 +1,936 @@
+from __future__ import print_function  # better print function
+import os                              # file/directory functions
+import sys                             # for command line arguments
+import shutil                          # for copying files and directories
+import time                            # for waiting until a scheduled start
+import fnmatch                         # for matching file names to globs
+import argparse                        # for command line options
+import threading                       # for running environments concurrently
+from datetime import datetime, timedelta  # for datetime functions
+from multiprocessing.pool import ThreadPool  # for backing up machines in parallel
+try:
+    from configparser import RawConfigParser   # Python 3
+except ImportError:
+    from ConfigParser import RawConfigParser   # Python 2
+import backup_store                    # content-addressed store
+import backup_archive                  # compressed archive output
+import backup_journal                  # checkpoint journal for resuming runs
+import backup_hosts                    # reachability checks with timeouts
+import backup_verify                   # verification of copied files
+import backup_report                   # structured run report
+import backup_throttle                 # bandwidth cap and machine priority
+import backup_delta                    # delta copies of large changed files
+import backup_plan                     # size and duration estimates
+import backup_transport                # how machines are reached
+
+try:
+    input = raw_input                  # Python 2
+except NameError:
+    pass
+
+# ----------------------------------------------------------------------
+# OVERVIEW: Shared engine behind backup_config.py and backup_storage.py.
+# What to copy is described by jobs in backup_jobs.ini, and which machines
+# to copy from by backup_inventory.ini. Several jobs can run in one pass
+# over the machines, so each machine is checked for reachability once and
+# then visited by every job in turn:
+#   python backup_engine.py config storage
+#
+# Without --env the program asks for the execution mode and a confirmation.
+# With --env it runs unattended and exits with a status code: 0 if every
+# machine was backed up, 1 if some machines failed or were unreachable,
+# 2 for invalid settings or options. Examples:
+#   python backup_config.py --env live
+#   python backup_engine.py config storage --env test --env live --at 18:30
+#   python backup_engine.py storage --env all --concurrent --workers 4
+#   python backup_storage.py --env live --dry-run
+#   python backup_storage.py --env live --workers 8 --bandwidth 40
+#
+# Machines start in priority order (see priority in backup_jobs.ini), and
+# all copies of a program run share the bandwidth cap (backup_throttle.py).
+#
+# With --plan the program only scans the machines and estimates the size
+# and duration of the backup for the given workers and bandwidth cap, from
+# the throughput of earlier runs (see backup_plan.py):
+#   python backup_storage.py --env live --plan --workers 8 --bandwidth 40
+#
+# backup_all.py runs the config and storage jobs for several environments
+# at once from one asyncio event loop (--async, see backup_async.py):
+#   python backup_all.py --env all --workers 16
+#
+# With --fleet <dir> the machines are fake ones in a local directory made
+# by backup_fleet.py, for testing and measuring (see backup_transport.py).
+#
+# Every run also writes <dest dir>/<run name>.report.jsonl with timings,
+# probe counts, bytes, throughput and failures per machine; compare two
+# runs with backup_report.py.
+# ----------------------------------------------------------------------
+
+jobs_file = "backup_jobs.ini"
+
+# Lock around console and log output of machines backed up in parallel:
+output_lock = threading.Lock()
+
+
+def _lines(value):
+    '''
+    Splits a multi-line ini value into a list of non-empty lines,
+    leaving out comment lines.
+    '''
+    lines = []
+    for line in value.splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            lines.append(line)
+    return lines
+
+
+def _read_ini(path):
+    parser = RawConfigParser()
+    parser.optionxform = str  # keep key case
+    if not parser.read(path):
+        raise IOError("Can't read file: {0}".format(path))
+    return parser
+
+
+def load_inventory(path):
+    '''
+    Reads the inventory file and returns a list of (environment, list of
+    machines) tuples, in the order the environments appear in the file.
+    '''
+    parser = _read_ini(path)
+    return [(env, _lines(parser.get(env, "machines"))) for env in parser.sections()]
+
+
+def load_jobs(path, job_names):
+    '''
+    Reads the jobs file and returns a tuple of the [settings] section as
+    a dictionary and a list of Job objects for the given job names.
+    '''
+    parser = _read_ini(path)
+    settings = dict(parser.items("settings"))
+    jobs = []
+    for name in job_names:
+        if name == "settings" or not parser.has_section(name):
+            raise ValueError("No such job in {0}: '{1}'".format(path, name))
+        jobs.append(Job(name, dict(parser.items(name)), settings))
+    return settings, jobs
+
+
+class Job(object):
+    '''
+    One backup job from the jobs file, plus the state of its current run.
+    '''
+
+    def __init__(self, name, spec, settings):
+        self.name = name
+        self.title = spec.get("title", name)
+        self.label = spec.get("label", name)
+        self.mode = spec.get("mode", "files")
+        self.dir_templates = _lines(spec["dirs"])
+        self.files = _lines(spec.get("files", ""))
+        self.tree_name = spec.get("tree_name", "Storage")
+        self.dest_dir = spec["dest_dir"]
+        self.run_prefix = spec.get("run_prefix", name)
+        self.log_file = spec.get("log_file", "backup_{0}.log".format(name))
+        self.output = spec.get("output", "copy")
+        self.archive_format = spec.get("archive_format", "tar.gz")
+        self.archive_level = int(spec.get("archive_level", 6))
+        self.use_journal = spec.get("journal", "no").lower() in ("yes", "true", "1")
+        self.copy_retries = int(spec.get("copy_retries", 2))
+        self.resume_hours = float(spec.get("resume_hours", 12))
+        self.verify_mode = spec.get("verify", "no")
+        self.store_dir = settings.get("store_dir")
+        self.history_dir = spec.get("history_dir", self.dest_dir + "/History")
+        self.keep_last = int(spec.get("keep_last", 5))
+        self.keep_daily = int(spec.get("keep_daily", 7))
+        self.keep_weekly = int(spec.get("keep_weekly", 4))
+        self.min_age_days = float(spec.get("min_age_days", 2))
+        self.discovery_cache = settings.get("discovery_cache", "no").lower() in ("yes", "true", "1")
+        self.transport = backup_transport.SmbTransport()   # set by main()
+        self.host_streams = int(settings.get("host_streams", 1))
+        self.delta_min_size = int(float(spec.get("delta_min_mb", 0)) * 1024 * 1024)
+        self.delta_block_size = int(spec.get("delta_block_kb", 64)) * 1024
+        self.bandwidth = None   # shared backup_throttle.Bandwidth, set by main()
+
+        if self.mode not in ("files", "tree"):
+            raise ValueError("Job {0}: unknown mode '{1}'".format(name, self.mode))
+        if self.mode == "files" and not self.files:
+            raise ValueError("Job {0}: mode files needs a list of files".format(name))
+        if self.output not in ("copy", "store", "archive"):
+            raise ValueError("Job {0}: unknown output '{1}'".format(name, self.output))
+        if self.output == "archive":
+            if self.mode != "tree":
+                raise ValueError("Job {0}: output archive needs mode tree".format(name))
+            backup_archive.check_format(self.archive_format)
+        if self.verify_mode not in ("no", "fast", "full"):
+            raise ValueError("Job {0}: unknown verify '{1}'".format(name, self.verify_mode))
+        if self.output == "store" and not self.store_dir:
+            raise ValueError("Job {0}: output store needs store_dir in [settings]".format(name))
+        if self.delta_min_size and self.output != "copy":
+            raise ValueError("Job {0}: delta_min_mb needs output copy".format(name))
+        if self.delta_block_size < 1:
+            raise ValueError("Job {0}: delta_block_kb must be at least 1".format(name))
+        if self.keep_last < 1:
+            raise ValueError("Job {0}: keep_last must be at least 1".format(name))
+        if self.host_streams < 1:
+            raise ValueError("host_streams in [settings] must be at least 1")
+
+        self.log = None
+        self.journal = None
+        self.store_entries = []
+        self.problems = []  # machines not backed up (failed or unreachable)
+        self.backed_up = [] # (machine, source, path in backup, is whole tree)
+        self.host_stats = {}  # machine -> statistics for the run report
+        self.stats_lock = threading.Lock()
+        self.report = None
+        self.previous_run_dir = None  # basis of delta copies
+        self.known_dirs = {}  # machine -> directories found by the previous run
+        self.found_dirs = {}  # machine -> directories found by this run
+        self.dry_run = False
+
+    def dirs_for(self, env):
+        '''
+        Returns the candidate directories for the given environment.
+        '''
+        return [template.replace("{env}", env.capitalize())
+                for template in self.dir_templates]
+
+    def start(self, started, dry_run=False):
+        '''
+        Prepares a run of this job: opens the log, and creates (or, with
+        a journal, resumes) the destination directory of this run. A dry
+        run only looks for files, so nothing is created or logged.
+        '''
+        self.dry_run = dry_run
+        self.started = started
+        self.started_time = time.time()
+        self.store_entries = []
+        self.problems = []
+        self.backed_up = []
+        self.host_stats = {}
+        self.run_name = "{0}_{1}".format(self.run_prefix, started.strftime("%Y%m%d-%H%M"))
+        if dry_run:
+            self.log = open(os.devnull, "w")
+            return
+        self.log = open(self.log_file, "a")
+        self.found_dirs = {}
+        if self.discovery_cache:
+            self.known_dirs = load_discovery_cache(self.discovery_cache_path())
+
+        print ("-" * 67, file=self.log)
+        print ("Program started ", started.strftime("%Y-%m-%d %H:%M"), file=self.log)
+        print ("-" * 67, file=self.log)
+
+        # If destination directory does not exist, create it:
+        if not os.path.exists(self.dest_dir):
+            os.makedirs(self.dest_dir)
+
+        # Construct a destination directory for this program run
+        resuming = False
+        if self.use_journal:
+            unfinished_run = backup_journal.find_unfinished_run(
+                self.dest_dir, self.run_prefix, self.resume_hours)
+            if unfinished_run:
+                self.run_name = unfinished_run
+                resuming = True
+                self.print_line("Resuming interrupted run: " + self.run_name)
+            elif os.path.exists(backup_journal.journal_path(self.dest_dir, self.run_name)):
+                # a finished run from a minute ago - start over like its directory
+                os.remove(backup_journal.journal_path(self.dest_dir, self.run_name))
+            self.journal = backup_journal.Journal(
+                backup_journal.journal_path(self.dest_dir, self.run_name))
+        self.dest_dir_thisrun = "{0}/{1}".format(self.dest_dir, self.run_name)
+        if self.delta_min_size:
+            self.previous_run_dir = backup_delta.find_previous_run(
+                self.dest_dir, self.run_prefix, self.run_name)
+        # a rerun within the same minute starts its report over, like its
+        # directory and journal; a resumed run adds to the report
+        self.report = backup_report.RunReport(
+            "{0}/{1}.report.jsonl".format(self.dest_dir, self.run_name), append=resuming)
+
+        if self.output == "store" or resuming:
+            # nothing to create: files go into the store, or the directory
+            # already holds what the interrupted run copied
+            return
+        if os.path.exists(self.dest_dir_thisrun):
+            # if exists, it was created a minute ago, so safe to delete
+            shutil.rmtree(self.dest_dir_thisrun)
+        os.mkdir(self.dest_dir_thisrun)
+
+    def print_line(self, text, to_console=True):
+        if to_console:
+            print (text)
+        print (text, file=self.log)
+
+    def verify(self, full=False, workers=8):
+        '''
+        Compares every file backed up in this run with its source (see
+        backup_verify.py), writes <run name>.verify.txt next to the run
+        directory and prints a summary with throughput. Archives are not
+        verified.
+        '''
+        if self.output == "archive" or self.dry_run:
+            return
+        digests = dict([(entry[3], entry[0]) for entry in self.store_entries])
+        items = []
+        for machine, src, path, is_tree in self.backed_up:
+            if is_tree:
+                pairs = [(file_src, file_path) for file_src, file_path in _walk_tree(src, path)]
+            else:
+                pairs = [(src, path)]
+            for file_src, file_path in pairs:
+                if self.output == "store":
+                    if file_path not in digests:
+                        continue  # failed to copy, already reported
+                    dest = backup_store.blob_path(self.store_dir, digests[file_path])
+                    items.append((machine, file_src, dest, file_path, False))
+                else:
+                    dest = self.dest_dir_thisrun + "/" + file_path
+                    items.append((machine, file_src, dest, file_path, True))
+
+        results, stats = backup_verify.verify_files(items, full, workers)
+        backup_verify.write_manifest("{0}/{1}.verify.txt".format(self.dest_dir, self.run_name), results)
+        for machine, file_path, size, digest, status, read_bytes in results:
+            if status != "OK":
+                print("    VERIFY {0}: {1}".format(status, file_path), file=self.log)
+                if machine not in self.problems:
+                    self.problems.append(machine)
+        self.print_line("{0}: {1}".format(self.name, backup_verify.describe(stats, full)))
+
+    def finish(self):
+        '''
+        Writes the manifest (store output), closes the journal and
+        the log of this run. Returns True if every machine was backed up.
+        '''
+        finished = not self.problems
+        if self.output == "store" and not self.dry_run:
+            self.store_entries.sort(key=lambda entry: entry[3])
+            manifest = backup_store.write_manifest(self.store_dir, self.run_name, self.store_entries)
+            self.print_line("Manifest written: " + manifest)
+        if self.journal:
+            if finished:
+                self.journal.record_finished()
+            else:
+                self.print_line("Some {0} machines are not finished. "
+                                "Run again to resume this run.".format(self.name))
+            self.journal.close()
+            self.journal = None
+        if self.discovery_cache and not self.dry_run:
+            # machines not visited this time keep what was found before
+            known_dirs = dict(self.known_dirs)
+            known_dirs.update(self.found_dirs)
+            save_discovery_cache(self.discovery_cache_path(), known_dirs)
+        if self.report:
+            stats = self.host_stats.values()
+            self.report.write({
+                "type": "run", "job": self.name, "run": self.run_name,
+                "started": self.started.strftime("%Y-%m-%d %H:%M:%S"),
+                "wall_seconds": round(time.time() - self.started_time, 3),
+                "machines": len(self.host_stats),
+                "files": sum([host["files"] for host in stats]),
+                "bytes": sum([host["bytes"] for host in stats]),
+                "problems": sorted(self.problems)})
+            self.report.close()
+            self.report = None
+        print ("-" * 67, file=self.log)
+        print ("Finished.", file=self.log)
+        print ("-" * 67, file=self.log)
+        self.log.close()
+        return finished
+
+    def discovery_cache_path(self):
+        return "{0}/{1}.discovery.txt".format(self.dest_dir, self.run_prefix)
+
+    def new_stats(self, machine):
+        '''
+        Returns a fresh statistics dictionary for the given machine.
+        '''
+        stats = {"discovery_seconds": 0.0, "files": 0, "skipped": 0, "bytes": 0,
+                 "copy_seconds": 0.0, "failures": [], "delta_files": 0, "delta_unchanged_bytes": 0}
+        self.host_stats[machine] = stats
+        return stats
+
+    def record_host(self, env, machine, message, seconds, probes):
+        '''
+        Writes the run report line of one machine.
+        '''
+        stats = self.host_stats.get(machine) or self.new_stats(machine)
+        if not self.report:
+            return
+        record = {"type": "host", "job": self.name, "env": env, "machine": machine,
+                  "status": message, "ok": machine not in self.problems,
+                  "seconds": round(seconds, 3), "probes": probes,
+                  "mb_per_s": backup_report.megabytes_per_second(stats["bytes"], stats["copy_seconds"])}
+        record.update(stats)
+        record["discovery_seconds"] = round(stats["discovery_seconds"], 3)
+        record["copy_seconds"] = round(stats["copy_seconds"], 3)
+        self.report.write(record)
+
+    def previous_sizes(self):
+        '''
+        Returns a dictionary of bytes copied per machine by the previous
+        run of this job, from its report (empty if there is none).
+        '''
+        path = backup_report.find_previous(self.dest_dir, self.run_prefix, self.run_name)
+        if not path:
+            return {}
+        hosts, run = backup_report.load(path)
+        return dict([(machine, host.get("bytes", 0)) for machine, host in hosts.items()])
+
+    def resumed_result(self, machine):
+        '''
+        Returns the result recorded for a machine in the interrupted run
+        being resumed, or None if the machine still needs a backup.
+        '''
+        if not self.journal or machine not in self.journal.machines:
+            return None
+        if self.output == "store":
+            self.store_entries.extend(
+                [(digest, size, mtime, path)
+                 for (file_machine, path), (size, mtime, digest) in self.journal.files.items()
+                 if file_machine == machine])
+        return self.journal.machines[machine] + " (resumed)", []
+
+    def finish_machine(self, machine, message, log_lines=None, done=True):
+        if not done:
+            self.problems.append(machine)
+        elif self.journal:
+            self.journal.record_machine(machine, message)
+        return message, log_lines or []
+
+    def copy_file(self, file_src, path):
+        '''
+        Copies one file to <run dir>/<path>, or into the store.
+        Returns the hash of the file ("" for a plain copy).
+        '''
+        self.transport.before_copy(path.split("/")[0])
+        if self.output == "store":
+            digest, size = backup_store.store_file(self.store_dir, file_src, self.bandwidth)
+            return digest
+        dest = self.dest_dir_thisrun + "/" + path
+        # if destination dir doesn't exist, create it:
+        if not os.path.exists(os.path.dirname(dest)):
+            try:
+                os.makedirs(os.path.dirname(dest))
+            except OSError:
+                # created meanwhile by another thread
+                pass
+        basis = self.delta_basis(file_src, path)
+        if basis:
+            delta = backup_delta.delta_copy(file_src, basis, dest, self.delta_block_size, self.bandwidth)
+            with self.stats_lock:
+                stats = self.host_stats[path.split("/")[0]]
+                stats["delta_files"] = stats["delta_files"] + 1
+                stats["delta_unchanged_bytes"] = stats["delta_unchanged_bytes"] + delta["unchanged"]
+        else:
+            backup_throttle.copy_file(file_src, dest, self.bandwidth)
+        return ""
+
+    def delta_basis(self, file_src, path):
+        '''
+        Returns the previous run's copy of a file if the file is to be
+        copied as a delta (see backup_delta.py), otherwise None.
+        '''
+        if not self.previous_run_dir or os.path.getsize(file_src) < self.delta_min_size:
+            return None
+        basis = self.previous_run_dir + "/" + path
+        if not os.path.isfile(basis):
+            return None
+        return basis
+
+    def backup_machine(self, machine, env, hosts):
+        '''
+        Finds and backs up this job's files on the given machine of the
+        given environment. Returns a tuple of the status message and a
+        list of extra log lines.
+        '''
+        if self.mode == "files":
+            return self.backup_files(machine, self.dirs_for(env), hosts)
+        return self.backup_tree(machine, self.dirs_for(env), hosts)
+
+    def find_files(self, machine, dirs, hosts):
+        '''
+        Returns a list of (file path, path in backup) for the files of this
+        job found in the given candidate directories of a machine. With
+        the discovery cache, only the directories that had files in the
+        previous run are listed, unless none of them exists any more.
+        '''
+        known_dirs = [dir for dir in self.known_dirs.get(machine, []) if dir in dirs]
+        if known_dirs:
+            found, found_dirs = self._list_dirs(machine, known_dirs, hosts)
+            if found_dirs or hosts.is_dead(machine):
+                self.found_dirs[machine] = found_dirs
+                return found
+        found, found_dirs = self._list_dirs(machine, dirs, hosts)
+        self.found_dirs[machine] = found_dirs
+        return found
+
+    def _list_dirs(self, machine, dirs, hosts):
+        found = []
+        found_dirs = []
+        for dir in dirs:
+            src_dir = hosts.path(machine, dir)
+            # one listing per directory instead of one probe per file name:
+            try:
+                names = hosts.listdir(machine, src_dir)
+            except OSError:
+                continue
+            if names is None:
+                break
+            for name in sorted(names):
+                for pattern in self.files:
+                    if fnmatch.fnmatch(name, pattern):
+                        found.append((src_dir + "/" + name, machine + "/" + name))
+                        if dir not in found_dirs:
+                            found_dirs.append(dir)
+                        break
+        return found, found_dirs
+
+    def find_tree(self, machine, dirs, hosts):
+        '''
+        Returns the first of the given candidate directories that exists
+        on a machine, or None. With the discovery cache, the directory found
+        by the previous run is tried first.
+        '''
+        known_dirs = [dir for dir in self.known_dirs.get(machine, []) if dir in dirs]
+        for dir in known_dirs + [dir for dir in dirs if dir not in known_dirs]:
+            if hosts.exists(machine, hosts.path(machine, dir)):
+                self.found_dirs[machine] = [dir]
+                return dir
+        return None
+
+    def backup_files(self, machine, dirs, hosts):
+        stats = self.new_stats(machine)
+        discovery_started = time.time()
+        found = self.find_files(machine, dirs, hosts)
+        stats["discovery_seconds"] = time.time() - discovery_started
+
+        if hosts.is_dead(machine):
+            message = "Machine unreachable ({0}).".format(hosts.dead[machine])
+            if found:
+                message = "{0} files were found. {1}".format(len(found), message)
+            return self.finish_machine(machine, message, done=False)
+        if not found:
+            return self.finish_machine(machine, "No {0} found on this machine.".format(self.label))
+        if self.dry_run:
+            return "{0} files were found (dry run, nothing copied).".format(len(found)), []
+
+        copy_started = time.time()
+        entries, skipped, failed, copied_bytes = backup_journal.copy_files_journaled(
+            found, machine, self.journal, self.copy_file, self.copy_retries, self.host_streams)
+        self.count_copied(stats, copy_started, entries, skipped, failed, copied_bytes)
+        if self.output == "store":
+            self.store_entries.extend(entries)
+        failed_paths = set([path for path, error in failed])
+        self.backed_up.extend([(machine, src, path, False)
+                               for src, path in found if path not in failed_paths])
+        if failed:
+            message = "{0} files were found: {1} failed to copy, {2} copied OK.".format(
+                len(found), len(failed), len(entries))
+            log_lines = ["    FAILED: {0} ({1})".format(path, error) for path, error in failed]
+            return self.finish_machine(machine, message, log_lines, done=False)
+        return self.finish_machine(machine, "{0} files were found: all copied OK.".format(len(found)))
+
+    def count_copied(self, stats, copy_started, entries, skipped, failed, copied_bytes):
+        stats["copy_seconds"] = time.time() - copy_started
+        stats["files"] = len(entries) - skipped
+        stats["skipped"] = skipped
+        stats["bytes"] = copied_bytes
+        stats["failures"] = [{"path": path, "error": error} for path, error in failed]
+
+    def backup_tree(self, machine, dirs, hosts):
+        stats = self.new_stats(machine)
+        discovery_started = time.time()
+        dir = self.find_tree(machine, dirs, hosts)
+        stats["discovery_seconds"] = time.time() - discovery_started
+        if dir is None:
+            if hosts.is_dead(machine):
+                message = "Machine unreachable ({0}).".format(hosts.dead[machine])
+                return self.finish_machine(machine, message, done=False)
+            return self.finish_machine(machine, "{0} NOT found on this machine.".format(self.label))
+        # construct a full path to the directory:
+        src = hosts.path(machine, dir)
+        if self.dry_run:
+            return "{0} found in {1} (dry run, nothing copied).".format(self.label, dir), []
+
+        # Directory found. Copy it into target directory.
+        prefix = machine + "/" + self.tree_name
+        copy_started = time.time()
+        if self.output == "archive":
+            try:
+                dest = self.dest_dir_thisrun + "/" + machine
+                if not os.path.exists(dest):
+                    os.makedirs(dest)
+                archive_path = "{0}/{1}.{2}".format(dest, self.tree_name, self.archive_format)
+                stats["files"] = backup_archive.archive_tree(src, archive_path, self.archive_format,
+                                                             self.archive_level, self.tree_name,
+                                                             self.bandwidth)
+                stats["bytes"] = os.path.getsize(archive_path)
+                stats["copy_seconds"] = time.time() - copy_started
+            except Exception as exception:
+                stats["failures"] = [{"path": src, "error": str(exception)}]
+                message = "{0} copying FAILED. Try copying manually.".format(self.label)
+                return self.finish_machine(machine, message, ["    FAILED: {0} ({1})".format(src, exception)],
+                                           done=False)
+            return self.finish_machine(machine, "{0} archived successfully.".format(self.label))
+
+        # file by file, skipping what the journal (if any) already has
+        entries, skipped, failed, copied_bytes = backup_journal.copy_tree_journaled(
+            src, machine, prefix, self.journal, self.copy_file, self.copy_retries, self.host_streams)
+        self.count_copied(stats, copy_started, entries, skipped, failed, copied_bytes)
+        if self.output == "store":
+            self.store_entries.extend(entries)
+        self.backed_up.append((machine, src, prefix, True))
+        if failed:
+            message = "{0} files FAILED to copy, {1} copied OK.".format(len(failed), len(entries))
+            if self.journal:
+                message = message + " Run again to retry."
+            log_lines = ["    FAILED: {0} ({1})".format(path, error) for path, error in failed]
+            return self.finish_machine(machine, message, log_lines, done=False)
+        copied_message = "{0} copied successfully.".format(self.label)
+        self.finish_machine(machine, copied_message)
+        if skipped:
+            copied_message = copied_message + " {0} files were already copied.".format(skipped)
+        return copied_message, []
+
+
+def _walk_tree(src, prefix):
+    '''
+    Yields (file path, path in backup) for all files under directory src.
+    '''
+    for root, dirs, files in os.walk(src):
+        rel_root = os.path.relpath(root, src).replace("\\", "/")
+        for name in files:
+            if rel_root == ".":
+                yield os.path.join(root, name), "{0}/{1}".format(prefix, name)
+            else:
+                yield os.path.join(root, name), "{0}/{1}/{2}".format(prefix, rel_root, name)
+
+
+def load_discovery_cache(path):
+    '''
+    Reads a discovery cache file (machine|directory lines) and returns a
+    dictionary of machine -> list of directories.
+    '''
+    known_dirs = {}
+    if os.path.exists(path):
+        with open(path) as cache:
+            for line in cache:
+                fields = line.rstrip("\n").split("|")
+                if len(fields) == 2:
+                    known_dirs.setdefault(fields[0], []).append(fields[1])
+    return known_dirs
+
+
+def save_discovery_cache(path, known_dirs):
+    with open(path, "w") as cache:
+        for machine in sorted(known_dirs):
+            for dir in known_dirs[machine]:
+                cache.write("{0}|{1}\n".format(machine, dir))
+
+
+def make_hosts(settings, fleet_dir=None):
+    '''
+    Returns a HostChecker for the transport and timeouts in [settings];
+    fleet_dir selects a fake fleet (see backup_transport.py).
+    '''
+    transport = backup_transport.from_settings(settings, fleet_dir)
+    host_port = settings.get("host_port", "445")
+    if transport.port is None or host_port.lower() == "none":
+        port = None
+    else:
+        port = int(host_port)
+    share_discovery = settings.get("share_discovery", "yes").lower() in ("yes", "true", "1")
+    return backup_hosts.HostChecker(float(settings.get("host_timeout", 5)), port, transport,
+                                    share_discovery)
+
+
+def backup_machine(jobs, target, hosts):
+    '''
+    Backs up one (environment, machine) target with every job in turn;
+    the machine is checked for reachability once. Returns a tuple of the
+    environment, the machine and a list with, per job, a tuple of its
+    result (see Job.backup_machine()), seconds spent and probes sent.
+    '''
+    env, machine = target
+    results = [backup_machine_job(job, env, machine, hosts) for job in jobs]
+    return env, machine, results
+
+
+def backup_machine_job(job, env, machine, hosts):
+    '''
+    Backs up one machine with one job. Returns a tuple of the result (see
+    Job.backup_machine()), seconds spent and probes sent.
+    '''
+    started = time.time()
+    probes = hosts.probe_count(machine)
+    result = job.resumed_result(machine)
+    if result is None:
+        if not hosts.is_reachable(machine):
+            result = job.finish_machine(
+                machine, "Machine unreachable ({0}).".format(hosts.dead[machine]), done=False)
+        else:
+            result = job.backup_machine(machine, env, hosts)
+    return result, time.time() - started, hosts.probe_count(machine) - probes
+
+
+def print_results(jobs, env, machine, job_results):
+    '''
+    Prints the status lines of one machine, one per job, and writes them
+    to the logs and reports of the jobs.
+    '''
+    machine_name_length = len(machine)
+    extra_space = 20 - machine_name_length
+    with output_lock:
+        for job, ((message, log_lines), seconds, probes) in zip(jobs, job_results):
+            job.record_host(env, machine, message, seconds, probes)
+            print("{0}...".format(machine), " " * extra_space, message, file=job.log)
+            for log_line in log_lines:
+                print(log_line, file=job.log)
+            if len(jobs) > 1:
+                message = "{0}: {1}".format(job.name, message)
+            print("{0}...".format(machine), " " * extra_space, message)
+
+
+def run_jobs(jobs, targets, hosts, workers=1):
+    '''
+    Runs the given (started) jobs for all (environment, machine) targets
+    in one pass: each machine is checked for reachability once, then every
+    job backs it up in turn. Prints one status line per machine and job,
+    in machine order, and writes it to the job's log.
+    '''
+    pool = None
+    if workers > 1:
+        # several machines at once; results still come back in order
+        pool = ThreadPool(workers)
+        results = pool.imap(lambda target: backup_machine(jobs, target, hosts), targets)
+    else:
+        results = (backup_machine(jobs, target, hosts) for target in targets)
+
+    for env, machine, job_results in results:
+        print_results(jobs, env, machine, job_results)
+
+    if pool:
+        pool.close()
+        pool.join()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="backup_engine.py",
+        description="Backs up files from API servers as described in {0}.".format(jobs_file))
+    parser.add_argument("jobs", nargs="+", metavar="job",
+                        help="job (section of {0}) to run, e.g. config storage".format(jobs_file))
+    parser.add_argument("--env", action="append",
+                        help="environment to back up (test, live or all); can be given more "
+                             "than once. Without --env the program asks interactively.")
+    parser.add_argument("--concurrent", action="store_true",
+                        help="back up several environments at the same time, "
+                             "instead of one after another")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="back up all machines of all environments from one asyncio event "
+                             "loop, --workers at a time (Python 3 only, see backup_async.py)")
+    parser.add_argument("--dest-dir",
+                        help="base destination directory; each job writes into its usual "
+                             "subdirectory of it (e.g. Configs, Storage)")
+    parser.add_argument("--workers", type=int,
+                        help="number of machines backed up at the same time per environment")
+    parser.add_argument("--bandwidth", type=float, metavar="MB",
+                        help="cap on the total transfer rate of all copies, in MB/s "
+                             "(0 for no cap)")
+    parser.add_argument("--verify", choices=("no", "fast", "full"),
+                        help="after the backup, compare copies with their sources by size "
+                             "and mtime (fast) or by content hash (full)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only look for files on the machines; copy nothing")
+    parser.add_argument("--plan", action="store_true",
+                        help="only scan the machines and estimate the size and duration "
+                             "of the backup; copy nothing")
+    parser.add_argument("--fleet", metavar="DIR",
+                        help="back up a fake fleet in this directory instead of the servers "
+                             "(see backup_fleet.py)")
+    parser.add_argument("--at", metavar="HH:MM",
+                        help="wait until this time of day before starting")
+    return parser.parse_args(argv)
+
+
+def wait_until(time_of_day):
+    '''
+    Sleeps until the next occurrence of the given HH:MM time of day.
+    '''
+    now = datetime.now()
+    at = datetime.strptime(time_of_day, "%H:%M")
+    start = now.replace(hour=at.hour, minute=at.minute, second=0, microsecond=0)
+    if start <= now:
+        start = start + timedelta(days=1)
+    print ("Waiting until {0} to start...".format(start.strftime("%Y-%m-%d %H:%M")))
+    time.sleep((start - now).total_seconds())
+
+
+def main(argv):
+    '''
+    Runs the jobs named in argv. Asks for the execution mode and a
+    confirmation unless --env is given; see OVERVIEW for the options.
+    '''
+    args = parse_args(argv)
+    interactive = not args.env
+
+    def leave(status):
+        if interactive:
+            input("Press Enter to exit...")
+        sys.exit(status)
+
+    try:
+        settings, jobs = load_jobs(jobs_file, args.jobs)
+        inventory_list = load_inventory(settings.get("inventory", "backup_inventory.ini"))
+    except (IOError, ValueError) as exception:
+        print(exception)
+        leave(2)
+    env_names = [env for env, machines in inventory_list]
+    inventory = dict(inventory_list)
+
+    if args.use_async:
+        try:
+            import backup_async        # asyncio orchestrator, Python 3 only
+        except (ImportError, SyntaxError):
+            print("--async needs Python 3.7 or newer")
+            leave(2)
+
+    if args.dest_dir:
+        for job in jobs:
+            job.dest_dir = "{0}/{1}".format(args.dest_dir, os.path.basename(job.dest_dir))
+    workers = args.workers or int(settings.get("workers", 1))
+    if args.bandwidth is not None:
+        bandwidth_mb = args.bandwidth
+    else:
+        bandwidth_mb = float(settings.get("bandwidth_mb", 0))
+    if bandwidth_mb < 0:
+        print ("Invalid bandwidth cap: {0:g} MB/s".format(bandwidth_mb))
+        leave(2)
+    bandwidth = backup_throttle.Bandwidth(bandwidth_mb)
+    for job in jobs:
+        job.bandwidth = bandwidth
+    priority = _lines(settings.get("priority", ""))
+
+    print("-" * 67)
+    for job in jobs:
+        print("This program will backup {0} found on API servers".format(job.title))
+        print("to directory: {}".format(job.dest_dir))
+    print("To check exact settings, open {0} in edit mode.".format(jobs_file))
+    print("-" * 67)
+
+    if interactive:
+        # Get run mode from user:
+        run_mode_raw = input("Enter the execution mode [{0}]: ".format(", ".join(env_names)))
+        run_mode = run_mode_raw.lower().strip()
+
+        if run_mode not in inventory:
+            print ("You entered an invalid value for execution mode: '{}'".format(run_mode))
+            print ("Re-launch this program and try again.")
+            leave(2)
+
+        print ("Thank you. The program will run for all {} machines.".format(run_mode.upper()))
+        user_input = input("Are you ready to proceed? [y/n]: ")
+        if user_input.lower() != "y":
+            print ("Cancelled.")
+            return
+        envs = [run_mode]
+    else:
+        envs = []
+        for env in args.env:
+            env = env.lower().strip()
+            if env == "all":
+                envs.extend(env_names)
+            elif env in inventory:
+                envs.append(env)
+            else:
+                print ("Invalid value for --env: '{0}' (use {1} or all)".format(env, ", ".join(env_names)))
+                sys.exit(2)
+        print ("The program will run for all {0} machines.".format(
+            " and ".join([env.upper() for env in envs])))
+
+    try:
+        hosts = make_hosts(settings, args.fleet)
+    except ValueError as exception:
+        print(exception)
+        leave(2)
+    for job in jobs:
+        job.transport = hosts.transport
+
+    if args.plan:
+        print ("-" * 67)
+        targets = [(env, machine) for env in envs for machine in inventory[env]]
+        for line in backup_plan.plan(jobs, targets, hosts, workers, bandwidth_mb, priority):
+            print (line)
+        print ("-" * 67)
+        leave(0)
+
+    if args.at:
+        wait_until(args.at)
+
+    # All environments go into the same run directory of each job;
+    # machine names are unique across environments.
+    started = datetime.now()
+    for job in jobs:
+        try:
+            job.start(started, args.dry_run)
+        except (IOError, OSError):
+            job.print_line("Failed to create a destination directory: {0}".format(job.dest_dir))
+            leave(1)
+
+    print ("-" * 67)
+    print ("Program started ", started.strftime("%Y-%m-%d %H:%M"))
+    if bandwidth_mb:
+        print ("Transfer rate capped at {0:g} MB/s".format(bandwidth_mb))
+    print ("-" * 67)
+
+    # bytes per machine in the previous runs, to start the largest first
+    sizes = {}
+    for job in jobs:
+        for machine, size in job.previous_sizes().items():
+            sizes[machine] = sizes.get(machine, 0) + size
+
+    if args.use_async:
+        targets = []
+        for env in envs:
+            targets.extend(backup_throttle.priority_order(
+                [(env, machine) for machine in inventory[env]], priority, sizes))
+        backup_async.run_jobs(jobs, targets, hosts, workers)
+    elif args.concurrent and len(envs) > 1:
+        threads = []
+        for env in envs:
+            targets = backup_throttle.priority_order(
+                [(env, machine) for machine in inventory[env]], priority, sizes)
+            thread = threading.Thread(target=run_jobs, args=(jobs, targets, hosts, workers))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+    else:
+        targets = []
+        for env in envs:
+            targets.extend(backup_throttle.priority_order(
+                [(env, machine) for machine in inventory[env]], priority, sizes))
+        run_jobs(jobs, targets, hosts, workers)
+
+    for job in jobs:
+        verify_mode = args.verify or job.verify_mode
+        if verify_mode != "no":
+            job.verify(verify_mode == "full", int(settings.get("verify_workers", 8)))
+
+    status = 0
+    for job in jobs:
+        if not job.finish():
+            status = 1
+
+    print ("-" * 67)
+    print ("Finished.")
+    print ("-" * 67)
+
+    leave(status)
+
+
+if __name__ == "__main__":
+
+    main(sys.argv[1:])
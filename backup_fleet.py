@@ -0,0 +1,139 @@
+from __future__ import print_function  # better print function
+import os                              # file/directory functions
+import sys                             # for command line arguments
+import random                          # for layouts and file sizes
+import argparse                        # for command line options
+import backup_engine                   # jobs and inventory
+
+# ----------------------------------------------------------------------
+# OVERVIEW: Generator of a fake fleet for backup_transport.LocalTransport.
+# For every machine of the inventory it creates <root>/<machine>/c$ with
+# the layout a server of its role has:
+#   LBX-PRI-...             Primary application server
+#   LBX-AGT-...             Agent
+#   LBX-SQLRS/SQLCL-...     SQL Replication
+#   LBX-TC-...              Telephony (Storage next to its bin directory)
+#   LBX-RPT-...             Calc Me Now
+#   LBX-WPS-...             web server (inetpub/wwwroot, no Storage)
+# Config files go into one of the directories the config job looks in
+# (chosen at random between the "API Healthcare" and "API" variants), and
+# application servers get a Storage tree of log files under one of the
+# directories the storage job looks in. Some machines can be left out to
+# stand for machines that are offline. Example:
+#   python backup_fleet.py /tmp/fleet --env all --files 200 --offline 3
+# ----------------------------------------------------------------------
+
+# machine name part -> (component in directory names, config files)
+roles = [("-PRI-", "Primary", ["ApplicationServer.exe.config", "AppServer.config"]),
+         ("-AGT-", "Agent", ["ApplicationServer.exe.config", "AppServer.config"]),
+         ("-SQLRS-", "SQL", ["SQLReplicationConfiguration.exe.config"]),
+         ("-SQLCL-", "SQL", ["SQLReplicationConfiguration.exe.config"]),
+         ("-TC-", "Telephony", ["ApplicationServer.exe.config"]),
+         ("-RPT-", "Calc Me Now", ["ApplicationServer.exe.config"]),
+         ("-WPS-", "inetpub", ["Web.config", "Web.Host.config"])]
+
+
+def role_of(machine):
+    for name_part, component, config_files in roles:
+        if name_part in machine:
+            return component, config_files
+    return "Agent", ["ApplicationServer.exe.config"]
+
+
+def write_log_file(path, size, rand):
+    '''
+    Writes a log-like text file of about size bytes.
+    '''
+    lines = []
+    written = 0
+    number = 0
+    while written < size:
+        line = "{0:08d} {1} Worker {2} processed request {3} in {4} ms\n".format(
+            number, rand.choice(("INFO", "INFO", "INFO", "WARN", "DEBUG")),
+            rand.randint(1, 16), rand.randint(100000, 999999), rand.randint(1, 5000))
+        lines.append(line)
+        written = written + len(line)
+        number = number + 1
+    with open(path, "w") as log:
+        log.write("".join(lines))
+
+
+def make_machine(root, env, machine, config_job, storage_job, args, rand):
+    '''
+    Creates the fake drive c$ of one machine and returns the number of
+    files written.
+    '''
+    component, config_files = role_of(machine)
+    share = "{0}/{1}/c$".format(root, machine)
+    count = 0
+
+    config_dirs = [dir for dir in config_job.dirs_for(env) if component in dir]
+    config_dir = share + rand.choice(config_dirs)
+    if not os.path.exists(config_dir):
+        os.makedirs(config_dir)
+    for name in config_files:
+        with open(config_dir + "/" + name, "w") as config:
+            config.write('<?xml version="1.0"?>\n<configuration machine="{0}" />\n'.format(machine))
+        count = count + 1
+
+    if component == "inetpub":
+        return count
+    if component == "Telephony":
+        storage_dirs = [dir for dir in storage_job.dirs_for(env) if "Telephony" in dir]
+    else:
+        storage_dirs = [dir for dir in storage_job.dirs_for(env) if dir.startswith("/Log Files")]
+    storage_dir = share + rand.choice(storage_dirs)
+    for index in range(args.files):
+        sub_dir = "{0}/2017-{1:02d}".format(storage_dir, index % 12 + 1)
+        if not os.path.exists(sub_dir):
+            os.makedirs(sub_dir)
+        size = int(rand.uniform(0.1, 1.9) * args.file_kb * 1024)
+        write_log_file("{0}/server_{1:05d}.log".format(sub_dir, index), size, rand)
+        count = count + 1
+    return count
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="backup_fleet.py",
+        description="Creates a fake fleet of API servers in a local directory.")
+    parser.add_argument("root", help="directory for the fake fleet")
+    parser.add_argument("--env", action="append",
+                        help="environment to create (test, live or all; default all)")
+    parser.add_argument("--files", type=int, default=100,
+                        help="log files in the Storage tree of each application server (default 100)")
+    parser.add_argument("--file-kb", type=int, default=64,
+                        help="average size of a log file in KB (default 64)")
+    parser.add_argument("--offline", type=int, default=0,
+                        help="number of machines left out, as if offline (default 0)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed (default 1)")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    settings, jobs = backup_engine.load_jobs(backup_engine.jobs_file, ["config", "storage"])
+    config_job, storage_job = jobs
+    inventory_list = backup_engine.load_inventory(settings.get("inventory", "backup_inventory.ini"))
+    envs = [env.lower() for env in (args.env or ["all"])]
+    if "all" in envs:
+        envs = [env for env, machines in inventory_list]
+    targets = [(env, machine) for env, machines in inventory_list if env in envs for machine in machines]
+
+    rand = random.Random(args.seed)
+    offline = set(rand.sample([machine for env, machine in targets], min(args.offline, len(targets))))
+    total = 0
+    for env, machine in targets:
+        if machine in offline:
+            print("{0}... offline".format(machine))
+            continue
+        count = make_machine(args.root, env, machine, config_job, storage_job, args, rand)
+        print("{0}... {1} files".format(machine, count))
+        total = total + count
+    print("{0} machines ({1} offline), {2} files in {3}".format(
+        len(targets), len(offline), total, args.root))
+
+
+if __name__ == "__main__":
+
+    main(sys.argv[1:])
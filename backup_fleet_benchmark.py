@@ -0,0 +1,127 @@
+from __future__ import print_function  # better print function
+import os                              # file/directory functions
+import sys                             # for command line arguments
+import time                            # for timing the runs
+import shutil                          # for cleanup
+import argparse                        # for command line options
+import tempfile                        # for the benchmark directory
+from datetime import datetime          # for run names
+import backup_engine                   # jobs, inventory and run_jobs()
+import backup_hosts                    # reachability checks with timeouts
+import backup_fleet                    # fake fleet generator
+import backup_transport                # fake fleet transport
+
+# ----------------------------------------------------------------------
+# OVERVIEW: Benchmark of backup_engine.py on a fake fleet (see
+# backup_fleet.py and backup_transport.py). The same jobs are run in
+# three modes against the machines of one environment:
+#   sequential - one machine at a time, as the original scripts did
+#   threaded   - several machines at the same time (--workers)
+#   cached     - threaded, with the discovery cache filled by a previous
+#                run, so machines are probed only where files were found
+#   shared     - threaded, with path checks answered from directory
+#                listings already made on the machine by any job
+# Every probe and file copy waits the given latency, to stand for the
+# network round trip to a server. For each mode the wall time, the number
+# of probes sent and the amount copied are printed. Example:
+#   python backup_fleet_benchmark.py --env live --workers 8 --latency-ms 20
+# ----------------------------------------------------------------------
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="backup_fleet_benchmark.py",
+        description="Times backup runs on a fake fleet in sequential, threaded and cached modes.")
+    parser.add_argument("jobs", nargs="*", default=["config", "storage"], metavar="job",
+                        help="jobs to run (default config storage)")
+    parser.add_argument("--env", default="test", help="environment to back up (default test)")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="machines at the same time in threaded modes (default 8)")
+    parser.add_argument("--latency-ms", type=float, default=20,
+                        help="latency of every probe and copy in ms (default 20)")
+    parser.add_argument("--failure-rate", type=float, default=0,
+                        help="part of copies that fail, e.g. 0.01 (default 0)")
+    parser.add_argument("--files", type=int, default=50,
+                        help="log files per Storage tree of a new fleet (default 50)")
+    parser.add_argument("--offline", type=int, default=2,
+                        help="offline machines in a new fleet (default 2)")
+    parser.add_argument("--fleet", metavar="DIR",
+                        help="use this existing fleet instead of creating one")
+    return parser.parse_args(argv)
+
+
+def run_mode(args, targets, fleet_dir, dest_base, workers, cache, share=False):
+    '''
+    Runs the jobs once and returns a tuple of wall seconds, probes sent,
+    files copied and bytes copied.
+    '''
+    settings, jobs = backup_engine.load_jobs(backup_engine.jobs_file, args.jobs)
+    transport = backup_transport.LocalTransport(fleet_dir, args.latency_ms, args.failure_rate, seed=1)
+    hosts = backup_hosts.HostChecker(float(settings.get("host_timeout", 5)), None, transport, share)
+    for job in jobs:
+        job.dest_dir = "{0}/{1}".format(dest_base, os.path.basename(job.dest_dir))
+        job.log_file = "{0}/{1}".format(dest_base, os.path.basename(job.log_file))
+        job.transport = transport
+        job.discovery_cache = cache
+    if not os.path.exists(dest_base):
+        os.makedirs(dest_base)
+
+    console = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    started = time.time()
+    try:
+        for job in jobs:
+            job.start(datetime.now())
+        backup_engine.run_jobs(jobs, targets, hosts, workers)
+        for job in jobs:
+            job.finish()
+    finally:
+        sys.stdout.close()
+        sys.stdout = console
+    seconds = time.time() - started
+
+    files = sum([stats["files"] for job in jobs for stats in job.host_stats.values()])
+    size = sum([stats["bytes"] for job in jobs for stats in job.host_stats.values()])
+    return seconds, sum(hosts.probes.values()), files, size
+
+
+def main(argv):
+    args = parse_args(argv)
+    base = tempfile.mkdtemp(prefix="fleet_benchmark_")
+    try:
+        fleet_dir = args.fleet
+        if not fleet_dir:
+            fleet_dir = base + "/fleet"
+            console = sys.stdout
+            sys.stdout = open(os.devnull, "w")
+            try:
+                backup_fleet.main([fleet_dir, "--env", args.env, "--files", str(args.files),
+                                   "--offline", str(args.offline)])
+            finally:
+                sys.stdout.close()
+                sys.stdout = console
+        settings, jobs = backup_engine.load_jobs(backup_engine.jobs_file, args.jobs)
+        inventory = dict(backup_engine.load_inventory(settings.get("inventory", "backup_inventory.ini")))
+        targets = [(args.env, machine) for machine in inventory[args.env]]
+
+        print("{0} machines, jobs {1}, {2:g} ms latency, {3:g} failure rate".format(
+            len(targets), " ".join(args.jobs), args.latency_ms, args.failure_rate))
+        print("{0:<12} {1:>8} {2:>8} {3:>8} {4:>8} {5:>8}".format(
+            "Mode", "Workers", "Seconds", "Probes", "Files", "MB"))
+        # fill the discovery cache of the cached mode first
+        run_mode(args, targets, fleet_dir, base + "/cached", args.workers, True)
+        for mode, workers, cache, share in (("sequential", 1, False, False),
+                                            ("threaded", args.workers, False, False),
+                                            ("cached", args.workers, True, False),
+                                            ("shared", args.workers, False, True)):
+            seconds, probes, files, size = run_mode(args, targets, fleet_dir, base + "/" + mode,
+                                                    workers, cache, share)
+            print("{0:<12} {1:>8} {2:>8.2f} {3:>8} {4:>8} {5:>8.1f}".format(
+                mode, workers, seconds, probes, files, size / (1024.0 * 1024.0)))
+    finally:
+        shutil.rmtree(base)
+
+
+if __name__ == "__main__":
+
+    main(sys.argv[1:])
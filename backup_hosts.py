@@ -0,0 +1,191 @@
+from __future__ import print_function  # better print function
+import os                              # file/directory functions
+import errno                           # for "no such directory" errors
+import socket                          # for the SMB port check
+import threading                       # for running probes with a timeout
+import backup_transport                # how machines are reached
+
+# ----------------------------------------------------------------------
+# OVERVIEW: Reachability checks used by backup_engine.py. A path check
+# on the share of an offline or slow host blocks for the Windows SMB
+# timeout, and the programs probe many paths per host. HostChecker
+# bounds that cost:
+#   - is_reachable() checks the SMB port and the c$ share of a machine,
+#     waiting at most the given timeout
+#   - exists() and call() run a probe with the same timeout; a machine
+#     that times out once is marked dead (circuit breaker), and all its
+#     remaining probes return immediately without touching the network
+#   - with shared discovery, exists() and listdir() answer from directory
+#     listings already made in this run, by any job: a path is looked up
+#     in the listing of its parent directory, so once a directory like
+#     "/Program Files/API Healthcare" is known to be missing, no candidate
+#     directory below it is probed again
+# Paths on a machine are built by the transport (see backup_transport.py).
+# ----------------------------------------------------------------------
+
+
+class HostChecker(object):
+    '''
+    Runs filesystem probes against machines with a timeout, and
+    remembers machines that did not answer.
+    '''
+
+    def __init__(self, timeout=5, port=445, transport=None, share_discovery=False):
+        self.timeout = timeout
+        self.port = port    # None to skip the port check
+        self.transport = transport or backup_transport.SmbTransport()
+        self.share_discovery = share_discovery
+        self.listings = {}  # lower case directory path -> (names, lower case names) or None if missing
+        self.dead = {}      # machine -> reason it is considered unreachable
+        self.probes = {}    # machine -> number of probes sent to it
+        self.reachable = set()  # machines that passed is_reachable()
+        self.lock = threading.Lock()
+
+    def mark_dead(self, machine, reason):
+        with self.lock:
+            if machine not in self.dead:
+                self.dead[machine] = reason
+
+    def is_dead(self, machine):
+        return machine in self.dead
+
+    def count_probe(self, machine):
+        with self.lock:
+            self.probes[machine] = self.probes.get(machine, 0) + 1
+
+    def probe_count(self, machine):
+        return self.probes.get(machine, 0)
+
+    def path(self, machine, dir):
+        return self.transport.path(machine, dir)
+
+    def is_reachable(self, machine):
+        '''
+        Returns True if the machine accepts connections on the SMB port
+        and its c$ share can be listed within the timeout. The answer is
+        kept, so all jobs of a run share one check per machine.
+        '''
+        if machine in self.dead:
+            return False
+        if machine in self.reachable:
+            return True
+        if self.port:
+            self.count_probe(machine)
+            try:
+                connection = socket.create_connection((machine, self.port), self.timeout)
+                connection.close()
+            except (socket.error, socket.timeout) as exception:
+                self.mark_dead(machine, "port {0}: {1}".format(self.port, exception))
+                return False
+        if not self.call(machine, os.path.isdir, self.transport.share(machine)):
+            self.mark_dead(machine, "c$ share not available")
+            return False
+        self.reachable.add(machine)
+        return True
+
+    def call(self, machine, function, *args):
+        '''
+        Runs function(*args) in a helper thread and returns its result.
+        If it doesn't finish within the timeout, the machine is marked dead
+        and None is returned; the helper thread is left to finish on its
+        own. Returns None at once for machines already marked dead.
+        Exceptions raised by the function are raised again here.
+        '''
+        if machine in self.dead:
+            return None
+        self.count_probe(machine)
+        outcome = []
+
+        def probe():
+            try:
+                self.transport.before_probe(machine)
+                outcome.append((True, function(*args)))
+            except Exception as exception:
+                outcome.append((False, exception))
+
+        thread = threading.Thread(target=probe)
+        thread.daemon = True
+        thread.start()
+        thread.join(self.timeout)
+        if not outcome:
+            self.mark_dead(machine, "no answer in {0} seconds".format(self.timeout))
+            return None
+        succeeded, value = outcome[0]
+        if not succeeded:
+            raise value
+        return value
+
+    def listdir(self, machine, path):
+        '''
+        Same as os.listdir(path) but bounded by the timeout; returns None
+        for machines marked dead. Raises OSError if there is no such
+        directory.
+        '''
+        if not self.share_discovery:
+            return self.call(machine, os.listdir, path)
+        key = path.rstrip("/").lower()
+        if key not in self.listings:
+            known = self._known(machine, path)
+            if known is False:
+                self.listings[key] = None
+            else:
+                try:
+                    names = self.call(machine, os.listdir, path)
+                except OSError:
+                    names = None
+                    self._learn_missing(machine, path)
+                if names is None and machine in self.dead:
+                    return None
+                if names is not None:
+                    names = (names, set([name.lower() for name in names]))
+                with self.lock:
+                    self.listings[key] = names
+        listing = self.listings[key]
+        if listing is None:
+            raise OSError(errno.ENOENT, "No such directory", path)
+        return listing[0]
+
+    def exists(self, machine, path):
+        '''
+        Same as os.path.exists(path) but bounded by the timeout; returns
+        False for machines marked dead.
+        '''
+        share = self.transport.share(machine)
+        if not self.share_discovery or not path.startswith(share + "/"):
+            return bool(self.call(machine, os.path.exists, path))
+        known = self._known(machine, path)
+        if known is not None:
+            return known
+        parent, name = path.rstrip("/").rsplit("/", 1)
+        try:
+            names = self.listdir(machine, parent)
+        except OSError:
+            return False
+        if names is None:
+            return False
+        return name.lower() in self.listings[parent.lower()][1]
+
+    def _known(self, machine, path):
+        '''
+        Returns False if a listing already made shows that path doesn't
+        exist, True if it shows that it does, None if nothing is known.
+        '''
+        share = self.transport.share(machine)
+        parts = path[len(share) + 1:].rstrip("/").split("/")
+        directory = share
+        for part in parts:
+            if directory.lower() not in self.listings:
+                return None
+            listing = self.listings[directory.lower()]
+            if listing is None or part.lower() not in listing[1]:
+                return False
+            directory = directory + "/" + part
+        return True
+
+    def _learn_missing(self, machine, path):
+        # a directory is missing: find out which of its parents are, so
+        # their other subdirectories are not probed either
+        share = self.transport.share(machine)
+        parent = path.rstrip("/").rsplit("/", 1)[0]
+        if parent.startswith(share + "/") and parent.lower() not in self.listings:
+            self.exists(machine, parent)
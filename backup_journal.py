@@ -0,0 +1,199 @@
+from __future__ import print_function  # better print function
+import os                              # file/directory functions
+import glob                            # for finding journal files
+import threading                       # for a lock around journal writes
+from datetime import datetime, timedelta  # for the age of unfinished runs
+from multiprocessing.pool import ThreadPool  # for copying several files at once
+
+# ----------------------------------------------------------------------
+# OVERVIEW: Checkpoint journal used by backup_engine.py. While a run is
+# in progress every copied file and every finished machine is appended
+# to <dest dir>/<run name>.journal. If the program is interrupted, the
+# next run finds the unfinished journal and resumes the same snapshot:
+# finished machines are skipped, files already copied are not copied
+# again, and only files that failed are retried.
+#
+# Journal lines are pipe-delimited:
+#   F|machine|path|size|mtime|hash  - file copied (hash only in store mode)
+#   M|machine|message               - machine finished
+#   D                               - run finished
+# ----------------------------------------------------------------------
+
+
+def journal_path(dest_dir, run_name):
+    '''
+    Returns the path of the journal for the given program run.
+    '''
+    return "{0}/{1}.journal".format(dest_dir, run_name)
+
+
+def find_unfinished_run(dest_dir, prefix, max_age_hours=None):
+    '''
+    Returns the name of the most recent run (e.g. Storage_20170801-1200)
+    if its journal has no "finished" line, or None otherwise. Only the
+    most recent run is resumed: once a run has finished, older unfinished
+    runs are out of date. Runs started more than max_age_hours ago are not
+    resumed either, so a machine that is down for good doesn't keep every
+    later run in the old snapshot.
+    '''
+    paths = sorted(glob.glob("{0}/{1}_*.journal".format(dest_dir, prefix)))
+    if not paths:
+        return None
+    run_name = os.path.basename(paths[-1])[:-len(".journal")]
+    if max_age_hours is not None:
+        started = datetime.strptime(run_name[len(prefix) + 1:], "%Y%m%d-%H%M")
+        if datetime.now() - started > timedelta(hours=max_age_hours):
+            return None
+    if Journal(paths[-1], read_only=True).finished:
+        return None
+    return run_name
+
+
+class Journal(object):
+    '''
+    Append-only checkpoint file of one program run. Lines already in
+    the file are loaded on open; new lines are flushed as soon as they
+    are written, so the journal survives the process being killed.
+    '''
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.files = {}     # (machine, path) -> (size, mtime, hash)
+        self.machines = {}  # machine -> message
+        self.finished = False
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as journal:
+                for line in journal:
+                    self._load_line(line.rstrip("\n"))
+        self.file = None
+        if not read_only:
+            self.file = open(path, "a")
+
+    def _load_line(self, line):
+        fields = line.split("|")
+        if fields[0] == "F" and len(fields) == 6:
+            self.files[(fields[1], fields[2])] = (int(fields[3]), float(fields[4]), fields[5])
+        elif fields[0] == "M" and len(fields) == 3:
+            self.machines[fields[1]] = fields[2]
+        elif fields[0] == "D":
+            self.finished = True
+        # anything else is a line cut short by an interruption - ignore it
+
+    def _write(self, line):
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def file_done(self, machine, path, size, mtime):
+        '''
+        Returns the journal entry (size, mtime, hash) of a file if it was
+        already copied and hasn't changed since, otherwise None.
+        '''
+        entry = self.files.get((machine, path))
+        if entry and entry[0] == size and abs(entry[1] - mtime) < 0.001:
+            return entry
+        return None
+
+    def record_file(self, machine, path, size, mtime, digest=""):
+        self.files[(machine, path)] = (size, mtime, digest)
+        self._write("F|{0}|{1}|{2}|{3:.6f}|{4}".format(machine, path, size, mtime, digest))
+
+    def record_machine(self, machine, message):
+        self.machines[machine] = message
+        self._write("M|{0}|{1}".format(machine, message))
+
+    def record_finished(self):
+        self.finished = True
+        self._write("D")
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+def copy_tree_journaled(src, machine, prefix, journal, copy_file, retries=2, streams=1):
+    '''
+    Copies all files under directory src one by one with
+    copy_files_journaled(). Paths start with prefix and use forward
+    slashes. Returns the same tuple as copy_files_journaled().
+    '''
+    pending = []
+    for root, dirs, files in os.walk(src):
+        dirs.sort()
+        rel_root = os.path.relpath(root, src).replace("\\", "/")
+        for name in sorted(files):
+            if rel_root == ".":
+                path = "{0}/{1}".format(prefix, name)
+            else:
+                path = "{0}/{1}/{2}".format(prefix, rel_root, name)
+            pending.append((os.path.join(root, name), path))
+    return copy_files_journaled(pending, machine, journal, copy_file, retries, streams)
+
+
+def copy_files_journaled(pending, machine, journal, copy_file, retries=2, streams=1):
+    '''
+    Copies the given (file path, path in backup) pairs, skipping files
+    the journal already has, and records each copied file in the journal.
+    journal may be None to copy everything unrecorded. Up to streams
+    files are copied at the same time.
+
+    copy_file(file_src, path) does the actual copying of one file and
+    returns its hash ("" if not known). Files that fail are retried up to
+    the given number of times after all other files are done.
+
+    Returns a tuple of:
+      - list of (hash, size, mtime, path) for all files, copied or skipped
+      - number of files skipped because the journal already had them
+      - list of (path, exception text) for files that failed every retry
+      - number of bytes copied (skipped files not included)
+    '''
+    def copy_one(item):
+        # returns (entry, skipped, error)
+        file_src, path = item
+        try:
+            size = os.path.getsize(file_src)
+            mtime = os.path.getmtime(file_src)
+            entry = journal and journal.file_done(machine, path, size, mtime)
+            if entry:
+                return (entry[2], size, mtime, path), True, None
+            digest = copy_file(file_src, path)
+            if journal:
+                journal.record_file(machine, path, size, mtime, digest)
+            return (digest, size, mtime, path), False, None
+        except Exception as exception:
+            return None, False, str(exception)
+
+    pool = None
+    if streams > 1:
+        pool = ThreadPool(streams)
+    entries = []
+    skipped = 0
+    copied_bytes = 0
+    failed = []
+    try:
+        for attempt in range(retries + 1):
+            failed = []
+            if pool:
+                results = pool.map(copy_one, pending, chunksize=1)
+            else:
+                results = [copy_one(item) for item in pending]
+            for (file_src, path), (entry, was_skipped, error) in zip(pending, results):
+                if error is not None:
+                    failed.append((file_src, path, error))
+                    continue
+                entries.append(entry)
+                if was_skipped:
+                    skipped = skipped + 1
+                else:
+                    copied_bytes = copied_bytes + entry[1]
+            if not failed:
+                break
+            pending = [(file_src, path) for file_src, path, error in failed]
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    return entries, skipped, [(path, error) for file_src, path, error in failed], copied_bytes
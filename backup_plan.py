@@ -0,0 +1,213 @@
+from __future__ import print_function  # better print function
+import os                              # file/directory functions
+import heapq                           # for simulating the worker pool
+import backup_report                   # throughput of earlier runs
+import backup_throttle                 # machine priority
+from multiprocessing.pool import ThreadPool  # for scanning machines in parallel
+
+# ----------------------------------------------------------------------
+# OVERVIEW: Planner behind the --plan option of backup_engine.py. It
+# estimates how big a backup will be and how long it will take, without
+# copying anything:
+#   1. each job's files or tree are found on every machine, as in a run
+#   2. the tree is walked with os.scandir, reading file metadata only
+#      (on Windows the directory listing already holds sizes, so no file
+#      is opened)
+#   3. the throughput of each machine is taken from the reports of the
+#      last history_runs runs of the job (see backup_report.py); machines
+#      without history get the average of all machines, or default_mb_per_s
+#   4. the machines are handed to the given number of workers in priority
+#      order, as in a run, and the bandwidth cap (if any) limits both each
+#      machine and all of them together
+# Example:
+#   python backup_engine.py config storage --env live --plan --workers 8 --bandwidth 40
+# ----------------------------------------------------------------------
+
+# Number of earlier runs whose reports give the throughput of a machine:
+history_runs = 5
+
+# Throughput assumed when no run has been recorded yet, in MB/s:
+default_mb_per_s = 10.0
+
+_megabyte = 1024.0 * 1024.0
+
+
+def _entries(path):
+    '''
+    Yields (name, full path, is directory, size) for the entries of a
+    directory; size is 0 for directories.
+    '''
+    if hasattr(os, "scandir"):
+        for entry in os.scandir(path):
+            is_dir = entry.is_dir(follow_symlinks=False)
+            yield entry.name, entry.path, is_dir, 0 if is_dir else entry.stat(follow_symlinks=False).st_size
+    else:
+        # Python 2: no scandir, one stat per entry
+        for name in os.listdir(path):
+            full_path = os.path.join(path, name)
+            is_dir = os.path.isdir(full_path) and not os.path.islink(full_path)
+            yield name, full_path, is_dir, 0 if is_dir else os.lstat(full_path).st_size
+
+
+def scan_tree(path):
+    '''
+    Returns a tuple of the number of files and their total size under
+    directory path.
+    '''
+    files = 0
+    size = 0
+    pending = [path]
+    while pending:
+        for name, full_path, is_dir, entry_size in _entries(pending.pop()):
+            if is_dir:
+                pending.append(full_path)
+            else:
+                files = files + 1
+                size = size + entry_size
+    return files, size
+
+
+def load_history(dest_dir, run_prefix, runs=history_runs):
+    '''
+    Returns a dictionary of machine -> (bytes, copy seconds, discovery
+    seconds, number of runs) summed over the last reports of a job.
+    '''
+    history = {}
+    for path in backup_report.find_reports(dest_dir, run_prefix)[-runs:]:
+        hosts, run = backup_report.load(path)
+        for machine, host in hosts.items():
+            if not host.get("bytes") or not host.get("copy_seconds"):
+                continue  # nothing copied, no throughput to learn from
+            size, seconds, discovery, count = history.get(machine, (0, 0.0, 0.0, 0))
+            history[machine] = (size + host["bytes"], seconds + host["copy_seconds"],
+                                discovery + host.get("discovery_seconds", 0.0), count + 1)
+    return history
+
+
+def throughput(history, machine):
+    '''
+    Returns the expected throughput of a machine in bytes per second,
+    and whether it comes from the machine's own history.
+    '''
+    if machine in history:
+        size, seconds, discovery, count = history[machine]
+        return size / seconds, True
+    size = sum([entry[0] for entry in history.values()])
+    seconds = sum([entry[1] for entry in history.values()])
+    if seconds:
+        return size / seconds, False
+    return default_mb_per_s * _megabyte, False
+
+
+def estimate_seconds(size, rate, discovery, bandwidth_mb=0):
+    '''
+    Returns the expected seconds to copy size bytes at rate bytes per
+    second, capped at bandwidth_mb MB/s, plus discovery seconds.
+    '''
+    if bandwidth_mb:
+        rate = min(rate, bandwidth_mb * _megabyte)
+    return discovery + size / max(rate, 1.0)
+
+
+def makespan(seconds, workers):
+    '''
+    Returns the time until the last of the given task durations is done
+    when they are started in the given order on a pool of workers.
+    '''
+    finish_times = [0.0] * max(1, workers)
+    for task in seconds:
+        heapq.heappush(finish_times, heapq.heappop(finish_times) + task)
+    return max(finish_times)
+
+
+def scan_machine(job, env, machine, hosts):
+    '''
+    Finds a job's files on a machine and returns a tuple of the number of
+    files, their size and a status message.
+    '''
+    dirs = job.dirs_for(env)
+    if job.mode == "files":
+        found = job.find_files(machine, dirs, hosts)
+        if hosts.is_dead(machine):
+            return 0, 0, "Machine unreachable ({0}).".format(hosts.dead[machine])
+        size = sum([os.path.getsize(file_src) for file_src, path in found])
+        return len(found), size, "{0} {1}".format(len(found), job.label)
+    dir = job.find_tree(machine, dirs, hosts)
+    if dir is None:
+        if hosts.is_dead(machine):
+            return 0, 0, "Machine unreachable ({0}).".format(hosts.dead[machine])
+        return 0, 0, "{0} NOT found".format(job.label)
+    files, size = scan_tree(hosts.path(machine, dir))
+    return files, size, "{0} in {1}".format(job.label, dir)
+
+
+def plan(jobs, targets, hosts, workers=1, bandwidth_mb=0, priority=None):
+    '''
+    Scans all (environment, machine) targets for the given jobs and
+    returns the text lines of the plan.
+    '''
+    histories = [load_history(job.dest_dir, job.run_prefix) for job in jobs]
+
+    def scan(target):
+        env, machine = target
+        results = []
+        if not hosts.is_reachable(machine):
+            return machine, None
+        for job in jobs:
+            try:
+                results.append(scan_machine(job, env, machine, hosts))
+            except (IOError, OSError) as exception:
+                results.append((0, 0, "Scan FAILED ({0}).".format(exception)))
+        return machine, results
+
+    pool = ThreadPool(max(1, workers))
+    try:
+        scanned = pool.map(scan, targets, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    lines = ["{0:<20} {1:<10} {2:>8} {3:>10} {4:>8} {5:>9}  {6}".format(
+        "Machine", "Job", "Files", "MB", "MB/s", "Est. s", "Found")]
+    machine_seconds = {}
+    sizes = {}
+    total_files = 0
+    total_size = 0
+    guessed = False
+    for machine, results in scanned:
+        if results is None:
+            lines.append("{0:<20} {1}".format(machine, "Machine unreachable ({0}).".format(hosts.dead[machine])))
+            continue
+        for job, history, (files, size, message) in zip(jobs, histories, results):
+            rate, known = throughput(history, machine)
+            if bandwidth_mb:
+                rate = min(rate, bandwidth_mb * _megabyte)
+            guessed = guessed or not known
+            discovery = 0.0
+            if known:
+                discovery = history[machine][2] / history[machine][3]
+            seconds = estimate_seconds(size, rate, discovery, bandwidth_mb)
+            machine_seconds[machine] = machine_seconds.get(machine, 0.0) + seconds
+            sizes[machine] = sizes.get(machine, 0) + size
+            total_files = total_files + files
+            total_size = total_size + size
+            lines.append("{0:<20} {1:<10} {2:>8} {3:>10.1f} {4:>7.1f}{5} {6:>9.1f}  {7}".format(
+                machine, job.name, files, size / _megabyte, rate / _megabyte,
+                " " if known else "*", seconds, message))
+
+    ordered = backup_throttle.priority_order(
+        [target for target in targets if target[1] in machine_seconds], priority or [], sizes)
+    total_seconds = makespan([machine_seconds[machine] for env, machine in ordered], workers)
+    if bandwidth_mb:
+        total_seconds = max(total_seconds, total_size / (bandwidth_mb * _megabyte))
+    lines.append("")
+    if guessed:
+        lines.append("* no earlier run of this machine: average throughput of the other machines")
+    lines.append("Total: {0} machines, {1} files, {2:.1f} MB".format(
+        len(machine_seconds), total_files, total_size / _megabyte))
+    cap = "no bandwidth cap"
+    if bandwidth_mb:
+        cap = "bandwidth cap {0:g} MB/s".format(bandwidth_mb)
+    lines.append("Estimated duration with {0} workers and {1}: {2:.0f} s ({3:.1f} min)".format(
+        workers, cap, total_seconds, total_seconds / 60.0))
+    return lines
@@ -0,0 +1,294 @@
+from __future__ import print_function  # better print function
+import os                              # file/directory functions
+import sys                             # for command line arguments
+import time                            # for the age of blobs
+import shutil                          # for removing directory trees
+import argparse                        # for command line options
+from datetime import datetime, timedelta  # for the age of runs
+from multiprocessing.pool import ThreadPool  # for deleting in parallel
+import backup_engine                   # jobs
+import backup_store                    # content-addressed store layout
+import backup_journal                  # unfinished runs
+
+# ----------------------------------------------------------------------
+# OVERVIEW: Retention of old runs. Every run of a job leaves a directory
+# <run_prefix>_<YYYYMMDD-HHMM> in its dest_dir (with .journal,
+# .report.jsonl and .verify.txt files next to it), or a manifest in the
+# store; nothing is ever removed by the backup programs. This program
+# keeps, per job (keys in backup_jobs.ini):
+#   - the last keep_last runs
+#   - the newest run of each of the last keep_daily days with a run
+#   - the newest run of each of the last keep_weekly weeks with a run
+#   - every run younger than min_age_days
+#   - the newest run, if it is an unfinished journaled run that the next
+#     run may resume
+# and deletes the others. Run directories are deleted machine by machine
+# by a pool of threads. Files with other hard links free no space until
+# their last link goes, so only files without other links are counted as
+# freed.
+#
+# Blobs of the content-addressed store are shared by all runs and jobs,
+# so they are deleted only when no manifest left (of any job) and no
+# unfinished journal lists them, and they haven't been stored or reused
+# for gc_grace_hours (a run in progress writes its manifest at the end).
+#
+# Examples:
+#   python backup_prune.py --dry-run      (show what would be deleted)
+#   python backup_prune.py config storage --workers 8
+# ----------------------------------------------------------------------
+
+# Files next to a run directory that belong to the run:
+run_suffixes = (".journal", ".report.jsonl", ".verify.txt")
+
+# Blobs stored or reused more recently than this are never deleted:
+gc_grace_hours = 24
+
+
+def list_runs(job):
+    '''
+    Returns a list of (start time, run name) of all runs of a job found
+    in its dest_dir or in the store, newest first.
+    '''
+    names = set()
+    if os.path.isdir(job.dest_dir):
+        for name in os.listdir(job.dest_dir):
+            for suffix in run_suffixes:
+                if name.endswith(suffix):
+                    name = name[:-len(suffix)]
+                    break
+            names.add(name)
+    if job.store_dir and os.path.isdir(job.store_dir + "/manifests"):
+        for name in os.listdir(job.store_dir + "/manifests"):
+            if name.endswith(".txt"):
+                names.add(name[:-len(".txt")])
+
+    runs = []
+    for name in names:
+        if not name.startswith(job.run_prefix + "_"):
+            continue
+        try:
+            started = datetime.strptime(name[len(job.run_prefix) + 1:], "%Y%m%d-%H%M")
+        except ValueError:
+            continue  # not a run of this job
+        runs.append((started, name))
+    runs.sort(reverse=True)
+    return runs
+
+
+def select_runs(runs, keep_last, keep_daily, keep_weekly, min_age_days, now=None):
+    '''
+    Applies the retention policy to runs (newest first) and returns a
+    tuple of a dictionary of kept run name -> reason, and the list of
+    names of runs to delete.
+    '''
+    now = now or datetime.now()
+    keep = {}
+    days = set()
+    weeks = set()
+    for index, (started, name) in enumerate(runs):
+        day = started.date()
+        week = started.isocalendar()[0:2]
+        if index < keep_last:
+            keep.setdefault(name, "last {0}".format(keep_last))
+        if day not in days and len(days) < keep_daily:
+            days.add(day)
+            keep.setdefault(name, "daily")
+        if week not in weeks and len(weeks) < keep_weekly:
+            weeks.add(week)
+            keep.setdefault(name, "weekly")
+        if now - started < timedelta(days=min_age_days):
+            keep.setdefault(name, "younger than {0:g} days".format(min_age_days))
+    return keep, [name for started, name in runs if name not in keep]
+
+
+def run_paths(job, run_name):
+    '''
+    Returns the paths that belong to a run: its directory, the files
+    next to it and its manifest in the store, as far as they exist.
+    '''
+    paths = ["{0}/{1}".format(job.dest_dir, run_name)]
+    paths.extend(["{0}/{1}{2}".format(job.dest_dir, run_name, suffix) for suffix in run_suffixes])
+    if job.store_dir:
+        paths.append(backup_store.manifest_path(job.store_dir, run_name))
+    return [path for path in paths if os.path.exists(path)]
+
+
+def _freed_size(path):
+    '''
+    Returns the bytes freed by deleting a file or tree: files with other
+    hard links are not counted.
+    '''
+    if not os.path.isdir(path):
+        stat = os.lstat(path)
+        return stat.st_size if stat.st_nlink <= 1 else 0
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            stat = os.lstat(os.path.join(root, name))
+            if stat.st_nlink <= 1:
+                size = size + stat.st_size
+    return size
+
+
+def _remove(item):
+    path, dry_run = item
+    try:
+        size = _freed_size(path)
+        if not dry_run:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        return size, None
+    except (IOError, OSError) as exception:
+        return 0, "{0} ({1})".format(path, exception)
+
+
+def delete_paths(paths, workers=8, dry_run=False):
+    '''
+    Deletes the given files and directory trees with a pool of threads;
+    directories are split into their entries, so one large run is deleted
+    in parallel too. Returns a tuple of bytes freed and a list of errors.
+    '''
+    items = []
+    dirs = []
+    for path in paths:
+        if os.path.isdir(path):
+            items.extend([(os.path.join(path, name), dry_run) for name in os.listdir(path)])
+            dirs.append(path)
+        else:
+            items.append((path, dry_run))
+    pool = ThreadPool(max(1, workers))
+    try:
+        results = pool.map(_remove, items, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    freed = sum([size for size, error in results])
+    errors = [error for size, error in results if error]
+    if not dry_run:
+        for path in dirs:
+            try:
+                os.rmdir(path)
+            except OSError as exception:
+                errors.append("{0} ({1})".format(path, exception))
+    return freed, errors
+
+
+def referenced_blobs(store_dir, jobs, deleted_runs=()):
+    '''
+    Returns the set of hashes listed by any manifest in the store (except
+    those of deleted_runs) or by any unfinished journal of the given jobs.
+    '''
+    hashes = set()
+    manifest_dir = store_dir + "/manifests"
+    if os.path.isdir(manifest_dir):
+        for name in os.listdir(manifest_dir):
+            if name.endswith(".txt") and name[:-len(".txt")] not in deleted_runs:
+                for entry in backup_store.read_manifest(store_dir, name[:-len(".txt")]):
+                    hashes.add(entry[0])
+    for job in jobs:
+        for started, run_name in list_runs(job):
+            path = backup_journal.journal_path(job.dest_dir, run_name)
+            if os.path.exists(path):
+                journal = backup_journal.Journal(path, read_only=True)
+                if not journal.finished:
+                    hashes.update([entry[2] for entry in journal.files.values() if entry[2]])
+    return hashes
+
+
+def collect_garbage(store_dir, jobs, workers=8, dry_run=False, deleted_runs=()):
+    '''
+    Deletes blobs (and leftover temporary files) of the store that are no
+    longer referenced and older than gc_grace_hours. deleted_runs are runs
+    whose manifests are (or in a dry run, would have been) deleted. Returns
+    a tuple of the number of files deleted, bytes freed and a list of errors.
+    '''
+    hashes = referenced_blobs(store_dir, jobs, deleted_runs)
+    oldest = time.time() - gc_grace_hours * 3600
+    garbage = []
+    for sub_dir in ("objects", "tmp"):
+        for root, dirs, files in os.walk("{0}/{1}".format(store_dir, sub_dir)):
+            for name in files:
+                path = os.path.join(root, name)
+                if (sub_dir == "tmp" or name not in hashes) and os.path.getmtime(path) < oldest:
+                    garbage.append(path)
+    freed, errors = delete_paths(garbage, workers, dry_run)
+    return len(garbage), freed, errors
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="backup_prune.py",
+        description="Deletes old backup runs as set by the retention keys in {0}.".format(
+            backup_engine.jobs_file))
+    parser.add_argument("jobs", nargs="*", default=["config", "storage"], metavar="job",
+                        help="jobs whose runs are pruned (default config storage)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only show what would be deleted")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="number of files and directories deleted at the same time (default 8)")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    try:
+        settings, jobs = backup_engine.load_jobs(backup_engine.jobs_file, args.jobs)
+    except (IOError, ValueError) as exception:
+        print(exception)
+        sys.exit(2)
+
+    megabytes = 1024.0 * 1024.0
+    action = "Would delete" if args.dry_run else "Deleted"
+    all_errors = []
+    store_dirs = []
+    deleted_runs = set()
+    for job in jobs:
+        runs = list_runs(job)
+        keep, delete = select_runs(runs, job.keep_last, job.keep_daily, job.keep_weekly,
+                                   job.min_age_days)
+        unfinished_run = backup_journal.find_unfinished_run(job.dest_dir, job.run_prefix, job.resume_hours)
+        if unfinished_run in delete:
+            keep[unfinished_run] = "unfinished"
+        delete = [run_name for run_name in delete if run_name not in keep]
+        deleted_runs.update(delete)
+
+        print("-" * 67)
+        print("{0}: {1} runs, keeping {2}".format(job.name, len(runs), len(keep)))
+        for started, run_name in runs:
+            if run_name in keep:
+                print("    keep    {0}  ({1})".format(run_name, keep[run_name]))
+            else:
+                print("    delete  {0}".format(run_name))
+        paths = []
+        for run_name in delete:
+            paths.extend(run_paths(job, run_name))
+        freed, errors = delete_paths(paths, args.workers, args.dry_run)
+        all_errors.extend(errors)
+        print("{0} {1} runs, {2:.1f} MB freed".format(action, len(delete), freed / megabytes))
+        if job.output == "store" and job.store_dir not in store_dirs:
+            store_dirs.append(job.store_dir)
+
+    if store_dirs:
+        # blobs may be shared by all jobs using the store, not just these
+        names = [name for name in backup_engine._read_ini(backup_engine.jobs_file).sections()
+                 if name != "settings"]
+        all_jobs = backup_engine.load_jobs(backup_engine.jobs_file, names)[1]
+    for store_dir in store_dirs:
+        count, freed, errors = collect_garbage(store_dir, all_jobs, args.workers, args.dry_run,
+                                               deleted_runs)
+        all_errors.extend(errors)
+        print("-" * 67)
+        print("Store {0}: {1} {2} unreferenced blobs, {3:.1f} MB freed".format(
+            store_dir, action.lower(), count, freed / megabytes))
+
+    print("-" * 67)
+    for error in all_errors:
+        print("FAILED:", error)
+    sys.exit(1 if all_errors else 0)
+
+
+if __name__ == "__main__":
+
+    main(sys.argv[1:])
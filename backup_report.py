@@ -0,0 +1,166 @@
+from __future__ import print_function  # better print function
+import os                              # file/directory functions
+import sys                             # for command line arguments
+import glob                            # for finding earlier reports
+import json                            # for JSON lines
+import threading                       # for a lock around report writes
+
+# ----------------------------------------------------------------------
+# OVERVIEW: Structured run report written by backup_engine.py next to
+# each run directory, as <run name>.report.jsonl. One JSON object per
+# line:
+#   {"type": "host", ...} - one per machine: status, seconds spent,
+#                           discovery seconds, probe count, files and
+#                           bytes copied, copy seconds, MB/s, failures
+#                           with their exception text
+#   {"type": "run", ...}  - last line: wall time and totals of the run
+#
+# To see which machines got slower between two runs, execute:
+#   python backup_report.py compare <older report> <newer report>
+# To print the totals of one run:
+#   python backup_report.py summary <report>
+# ----------------------------------------------------------------------
+
+# A machine is listed as slower only if it took this many times longer...
+slower_ratio = 1.2
+# ...and at least this many seconds longer:
+slower_seconds = 1.0
+
+
+class RunReport(object):
+    '''
+    JSON lines report of one job run. Lines are flushed as they are
+    written, so the report of an interrupted run is still readable. An
+    existing report is appended to only when append is set (a resumed
+    run); otherwise it is started over.
+    '''
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "a" if append else "w")
+
+    def write(self, record):
+        with self.lock:
+            self.file.write(json.dumps(record, sort_keys=True) + "\n")
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def megabytes_per_second(size, seconds):
+    if seconds <= 0:
+        return 0.0
+    return round(size / (1024.0 * 1024.0) / seconds, 2)
+
+
+def load(path):
+    '''
+    Reads a report and returns a tuple of a dictionary of host records
+    by machine and the run record (None if the run didn't finish).
+    '''
+    hosts = {}
+    run = None
+    with open(path) as report:
+        for line in report:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if record.get("type") == "host":
+                hosts[record["machine"]] = record
+            elif record.get("type") == "run":
+                run = record
+    return hosts, run
+
+
+def find_reports(dest_dir, run_prefix):
+    '''
+    Returns the paths of all reports of a job, oldest first.
+    '''
+    return sorted(glob.glob("{0}/{1}_*.report.jsonl".format(dest_dir, run_prefix)))
+
+
+def find_previous(dest_dir, run_prefix, run_name):
+    '''
+    Returns the path of the latest report of a job other than the one of
+    run run_name, or None if there is none.
+    '''
+    paths = [path for path in find_reports(dest_dir, run_prefix)
+             if os.path.basename(path) != run_name + ".report.jsonl"]
+    if not paths:
+        return None
+    return paths[-1]
+
+
+def compare(old_path, new_path):
+    '''
+    Returns a list of text lines comparing two reports: wall time of both
+    runs, then the machines that got slower, slowest change first.
+    '''
+    old_hosts, old_run = load(old_path)
+    new_hosts, new_run = load(new_path)
+    lines = []
+    if old_run and new_run:
+        lines.append("Wall time: {0:.1f} s -> {1:.1f} s".format(
+            old_run["wall_seconds"], new_run["wall_seconds"]))
+
+    slower = []
+    for machine, new in new_hosts.items():
+        old = old_hosts.get(machine)
+        if not old:
+            continue
+        if (new["seconds"] > old["seconds"] * slower_ratio and
+                new["seconds"] - old["seconds"] >= slower_seconds):
+            slower.append((new["seconds"] - old["seconds"], machine, old, new))
+    slower.sort(reverse=True)
+
+    if not slower:
+        lines.append("No machine got slower.")
+        return lines
+    lines.append("{0:<20} {1:>9} {2:>9} {3:>8} {4:>9} {5:>9} {6:>7}".format(
+        "Machine", "Old s", "New s", "Change", "Old MB/s", "New MB/s", "Probes"))
+    for delta, machine, old, new in slower:
+        if old["seconds"]:
+            change = "{0:+.0f}%".format(100.0 * delta / old["seconds"])
+        else:
+            change = "new"
+        lines.append("{0:<20} {1:>9.1f} {2:>9.1f} {3:>8} {4:>9.2f} {5:>9.2f} {6:>7}".format(
+            machine, old["seconds"], new["seconds"], change,
+            old.get("mb_per_s", 0), new.get("mb_per_s", 0),
+            "{0}->{1}".format(old.get("probes", 0), new.get("probes", 0))))
+    return lines
+
+
+def summary(path):
+    '''
+    Returns a list of text lines with the totals of one report.
+    '''
+    hosts, run = load(path)
+    lines = []
+    if run:
+        lines.append("Run {0} ({1}): {2:.1f} s wall time".format(run["run"], run["job"], run["wall_seconds"]))
+    files = sum([host.get("files", 0) for host in hosts.values()])
+    size = sum([host.get("bytes", 0) for host in hosts.values()])
+    copy_seconds = sum([host.get("copy_seconds", 0) for host in hosts.values()])
+    failed = [machine for machine, host in hosts.items() if not host.get("ok")]
+    lines.append("{0} machines, {1} files, {2:.1f} MB, {3:.2f} MB/s while copying".format(
+        len(hosts), files, size / (1024.0 * 1024.0), megabytes_per_second(size, copy_seconds)))
+    if failed:
+        lines.append("Not backed up: " + ", ".join(sorted(failed)))
+    return lines
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) == 4 and sys.argv[1] == "compare":
+        lines = compare(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) == 3 and sys.argv[1] == "summary":
+        lines = summary(sys.argv[2])
+    else:
+        print("Usage: python backup_report.py compare <older report> <newer report>")
+        print("       python backup_report.py summary <report>")
+        sys.exit(2)
+    for line in lines:
+        print(line)
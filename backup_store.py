@@ -0,0 +1,169 @@
+from __future__ import print_function  # better print function
+import os                              # file/directory functions
+import sys                             # for command line arguments
+import shutil                          # for copying file objects
+import hashlib                         # for content hashes
+import tempfile                        # for temporary blob files
+
+# ----------------------------------------------------------------------
+# OVERVIEW: Content-addressed store used by backup_engine.py. Every file
+# is saved once as a blob named after the SHA-256 hash of its content,
+# and each program run writes a manifest that maps machine/path to a hash.
+# Identical files across machines and across runs therefore take up disk
+# space only once.
+#
+# Layout of the store directory:
+#   objects/ab/abcdef...      - blobs (first 2 hash chars as subfolder)
+#   manifests/<run name>.txt  - one manifest per program run
+#
+# Manifest lines are pipe-delimited: hash|size|mtime|machine/path
+#
+# The modification time of a blob is the last time a run stored it or
+# found it already stored, so backup_prune.py never frees a blob that a
+# run in progress is about to list in its manifest.
+#
+# To restore a run into a normal directory tree, execute:
+#   python backup_store.py restore <store dir> <run name> <target dir>
+# for example:
+#   python backup_store.py restore /Shared/API_preupgrade_backups/Store
+#       Configs_20170801-1200 /Shared/restored
+# ----------------------------------------------------------------------
+
+# Size of chunks read from source files while hashing and copying:
+chunk_size = 1024 * 1024
+
+
+def blob_path(store_dir, digest):
+    '''
+    Returns the path of the blob with the given hash.
+    '''
+    return "{0}/objects/{1}/{2}".format(store_dir, digest[0:2], digest)
+
+
+def manifest_path(store_dir, run_name):
+    '''
+    Returns the path of the manifest for the given program run.
+    '''
+    return "{0}/manifests/{1}.txt".format(store_dir, run_name)
+
+
+def store_file(store_dir, src, bandwidth=None):
+    '''
+    Copies a file into the store and returns a tuple of its hash and size.
+    Reads are paced by bandwidth (see backup_throttle.py) if given.
+
+    The source is read only once: it is hashed while being copied into
+    a temporary file, which is then renamed to its blob name. If a blob
+    with the same hash already exists, the temporary file is discarded.
+    '''
+    tmp_dir = store_dir + "/tmp"
+    if not os.path.exists(tmp_dir):
+        try:
+            os.makedirs(tmp_dir)
+        except OSError:
+            # created meanwhile by another thread
+            pass
+    sha = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as tmp, open(src, "rb") as source:
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                if bandwidth:
+                    bandwidth.consume(len(chunk))
+                sha.update(chunk)
+                tmp.write(chunk)
+                size = size + len(chunk)
+        digest = sha.hexdigest()
+        blob = blob_path(store_dir, digest)
+        if os.path.exists(blob):
+            os.remove(tmp_path)
+            os.utime(blob, None)
+        else:
+            blob_dir = os.path.dirname(blob)
+            if not os.path.exists(blob_dir):
+                try:
+                    os.makedirs(blob_dir)
+                except OSError:
+                    pass
+            try:
+                os.rename(tmp_path, blob)
+            except OSError:
+                # same content stored meanwhile by another thread
+                if not os.path.exists(blob):
+                    raise
+                os.remove(tmp_path)
+                os.utime(blob, None)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest, size
+
+
+def write_manifest(store_dir, run_name, entries):
+    '''
+    Writes the manifest of a program run. The file is written under a
+    temporary name first so a partial manifest is never left behind.
+    '''
+    path = manifest_path(store_dir, run_name)
+    manifest_dir = os.path.dirname(path)
+    if not os.path.exists(manifest_dir):
+        os.makedirs(manifest_dir)
+    with open(path + ".part", "w") as manifest:
+        for digest, size, mtime, entry_path in entries:
+            manifest.write("{0}|{1}|{2:.6f}|{3}\n".format(digest, size, mtime, entry_path))
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(path + ".part", path)
+    return path
+
+
+def read_manifest(store_dir, run_name):
+    '''
+    Reads the manifest of a program run and returns a list of
+    (hash, size, mtime, path) tuples.
+    '''
+    entries = []
+    with open(manifest_path(store_dir, run_name)) as manifest:
+        for line in manifest:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            digest, size, mtime, path = line.split("|", 3)
+            entries.append((digest, int(size), float(mtime), path))
+    return entries
+
+
+def restore(store_dir, run_name, target_dir):
+    '''
+    Materialises the directory tree of a program run under target_dir
+    and returns the number of files restored.
+    '''
+    count = 0
+    for digest, size, mtime, path in read_manifest(store_dir, run_name):
+        dest = "{0}/{1}".format(target_dir, path)
+        dest_dir = os.path.dirname(dest)
+        if not os.path.exists(dest_dir):
+            os.makedirs(dest_dir)
+        shutil.copyfile(blob_path(store_dir, digest), dest)
+        os.utime(dest, (mtime, mtime))
+        count = count + 1
+    return count
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) != 5 or sys.argv[1] != "restore":
+        print("Usage: python backup_store.py restore <store dir> <run name> <target dir>")
+        sys.exit(2)
+
+    store_dir, run_name, target_dir = sys.argv[2:5]
+    if not os.path.exists(manifest_path(store_dir, run_name)):
+        print("No manifest found for run:", run_name)
+        sys.exit(1)
+    count = restore(store_dir, run_name, target_dir)
+    print("{0} files restored to: {1}".format(count, target_dir))
@@ -0,0 +1,88 @@
+from __future__ import print_function  # better print function
+import time                            # for pacing transfers
+import shutil                          # for copying file metadata
+import fnmatch                         # for matching machine names to globs
+import threading                       # for a lock around the bandwidth budget
+
+# ----------------------------------------------------------------------
+# OVERVIEW: Transfer scheduling used by backup_engine.py, so that LIVE
+# backups can run in parallel without saturating the links to the file
+# server:
+#   - Bandwidth is one budget shared by every copy of every job and
+#     environment in the program run; each chunk read from a source
+#     waits for its share of the budget, so all copies together stay at
+#     or below the cap
+#   - priority_order() sorts machines so that the important ones (e.g.
+#     LBX-PRI and SQL replication hosts) start first, and among equally
+#     important machines the ones with the most data in the previous run
+#     start earliest, so no large tree is left to run alone at the end
+# The number of files copied at the same time from one machine is set
+# with host_streams in backup_jobs.ini (see backup_journal.py).
+# ----------------------------------------------------------------------
+
+# Size of chunks read from source files; also the unit of pacing:
+chunk_size = 1024 * 1024
+
+
+class Bandwidth(object):
+    '''
+    Shared transfer budget in megabytes per second; 0 means unlimited.
+    '''
+
+    def __init__(self, megabytes_per_second=0):
+        self.rate = megabytes_per_second * 1024.0 * 1024.0   # bytes per second
+        self.lock = threading.Lock()
+        self.next_free = time.time()   # when the budget used so far is paid off
+
+    def consume(self, size):
+        '''
+        Takes size bytes from the budget, sleeping until they fit in it.
+        '''
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.time()
+            # an idle budget doesn't accumulate: no bursts after a pause
+            self.next_free = max(self.next_free, now) + size / self.rate
+            delay = self.next_free - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def copy_file(src, dest, bandwidth=None):
+    '''
+    Same as shutil.copy2(src, dest), but paced by the given Bandwidth.
+    '''
+    if not bandwidth or not bandwidth.rate:
+        shutil.copy2(src, dest)
+        return
+    with open(src, "rb") as source, open(dest, "wb") as target:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            bandwidth.consume(len(chunk))
+            target.write(chunk)
+    shutil.copystat(src, dest)
+
+
+def priority_order(targets, patterns, sizes=None):
+    '''
+    Returns the (environment, machine) targets sorted for starting: first
+    by the first of the machine name globs in patterns that matches
+    (machines matching none come last), then by size from the previous
+    run (dictionary machine -> bytes, largest first), then in inventory
+    order.
+    '''
+    sizes = sizes or {}
+
+    def key(indexed_target):
+        index, (env, machine) = indexed_target
+        rank = len(patterns)
+        for pattern_index, pattern in enumerate(patterns):
+            if fnmatch.fnmatchcase(machine.upper(), pattern.upper()):
+                rank = pattern_index
+                break
+        return rank, -sizes.get(machine, 0), index
+
+    return [target for index, target in sorted(enumerate(targets), key=key)]
@@ -0,0 +1,86 @@
+from __future__ import print_function  # better print function
+import time                            # for injected latency
+import random                          # for injected failures
+
+# ----------------------------------------------------------------------
+# OVERVIEW: Transports used by backup_engine.py to reach the drive c$ of
+# a machine:
+#   SmbTransport   - the real servers, through the c$ admin share
+#                    (//<machine>/c$/...)
+#   LocalTransport - a fake fleet in a local directory, one subdirectory
+#                    per machine (<root>/<machine>/c$/...), with optional
+#                    latency added to every probe and file copy, and
+#                    copies that fail at random at a given rate
+# A fake fleet is created with backup_fleet.py, and used with
+#   python backup_engine.py storage --env test --fleet <root>
+# or with transport = local and fleet_dir in [settings] of
+# backup_jobs.ini. backup_fleet_benchmark.py times the engine on it.
+# ----------------------------------------------------------------------
+
+
+class SmbTransport(object):
+    '''
+    Machines reached over SMB through their c$ admin share.
+    '''
+
+    port = 445   # port checked by backup_hosts.HostChecker
+
+    def share(self, machine):
+        return "//{0}/c$".format(machine)
+
+    def path(self, machine, dir):
+        '''
+        Returns the path of directory dir (starting with a slash) on
+        drive c$ of the given machine.
+        '''
+        return self.share(machine) + dir
+
+    def before_probe(self, machine):
+        pass
+
+    def before_copy(self, machine):
+        pass
+
+
+class LocalTransport(SmbTransport):
+    '''
+    Fake machines in local directories, for measuring and testing the
+    programs without the servers.
+    '''
+
+    port = None  # nothing listens on the fake machines
+
+    def __init__(self, root, latency_ms=0, failure_rate=0.0, seed=None):
+        self.root = root.rstrip("/")
+        self.latency = latency_ms / 1000.0
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+
+    def share(self, machine):
+        return "{0}/{1}/c$".format(self.root, machine)
+
+    def before_probe(self, machine):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def before_copy(self, machine):
+        self.before_probe(machine)
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            raise IOError("Injected copy failure on {0}".format(machine))
+
+
+def from_settings(settings, fleet_dir=None):
+    '''
+    Returns the transport described by [settings] of backup_jobs.ini;
+    fleet_dir (from the command line) selects a fake fleet instead.
+    '''
+    transport = settings.get("transport", "smb")
+    if transport not in ("smb", "local"):
+        raise ValueError("Unknown transport: '{0}' (use smb or local)".format(transport))
+    if not fleet_dir and transport == "smb":
+        return SmbTransport()
+    fleet_dir = fleet_dir or settings.get("fleet_dir")
+    if not fleet_dir:
+        raise ValueError("transport = local needs fleet_dir in [settings]")
+    return LocalTransport(fleet_dir, float(settings.get("fake_latency_ms", 0)),
+                          float(settings.get("fake_failure_rate", 0)))
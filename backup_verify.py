@@ -0,0 +1,117 @@
+from __future__ import print_function  # better print function
+import os                              # file/directory functions
+import time                            # for measuring throughput
+import hashlib                         # for content hashes
+from multiprocessing.pool import ThreadPool  # for checking files in parallel
+
+# ----------------------------------------------------------------------
+# OVERVIEW: Verification pass used by backup_engine.py after a run. Each
+# backed-up file is compared with its source:
+#   fast - size and modification time only (copies keep the source mtime;
+#          blobs in the content-addressed store are checked by size only)
+#   full - size and SHA-256 hash of the contents of both files
+# Files are checked by a pool of threads across all files and machines;
+# hashing and file reads release the GIL, so reads from several machines
+# and from the destination overlap. The result is written as a manifest,
+# one pipe-delimited line per file, grouped by machine:
+#   machine|path|size|hash|status
+# where status is OK, or MISMATCH/MISSING/ERROR with a short reason.
+# ----------------------------------------------------------------------
+
+# Size of chunks read while hashing; large reads keep SMB round trips low:
+buffer_size = 4 * 1024 * 1024
+
+# Largest mtime difference still considered equal, in seconds (some file
+# systems keep modification times with 2 second precision):
+mtime_tolerance = 2
+
+
+def file_hash(path):
+    '''
+    Returns the SHA-256 hex digest of a file, reading it in large chunks.
+    '''
+    sha = hashlib.sha256()
+    with open(path, "rb") as source:
+        while True:
+            chunk = source.read(buffer_size)
+            if not chunk:
+                break
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def verify_file(item, full=False):
+    '''
+    Compares one backed-up file with its source. item is a tuple of
+    (machine, source path, destination path, path in backup, check mtime).
+    Returns a tuple of (machine, path, size, hash, status, bytes read).
+    '''
+    machine, src, dest, path, check_mtime = item
+    try:
+        if not os.path.exists(dest):
+            return machine, path, 0, "", "MISSING", 0
+        src_stat = os.stat(src)
+        dest_stat = os.stat(dest)
+        size = src_stat.st_size
+        if dest_stat.st_size != size:
+            return machine, path, size, "", "MISMATCH size {0} != {1}".format(dest_stat.st_size, size), 0
+        if not full:
+            if check_mtime and abs(dest_stat.st_mtime - src_stat.st_mtime) > mtime_tolerance:
+                return machine, path, size, "", "MISMATCH mtime", 0
+            return machine, path, size, "", "OK", 0
+        src_hash = file_hash(src)
+        dest_hash = file_hash(dest)
+        if src_hash != dest_hash:
+            return machine, path, size, dest_hash, "MISMATCH hash", 2 * size
+        return machine, path, size, src_hash, "OK", 2 * size
+    except (IOError, OSError) as exception:
+        return machine, path, 0, "", "ERROR {0}".format(exception), 0
+
+
+def verify_files(items, full=False, workers=8):
+    '''
+    Verifies all given items (see verify_file()) with a pool of threads.
+    Returns a tuple of the list of results, sorted by machine and path,
+    and a dictionary of statistics: files, bytes (total size), read_bytes
+    (bytes hashed), failed and seconds.
+    '''
+    started = time.time()
+    pool = ThreadPool(max(1, workers))
+    try:
+        results = pool.map(lambda item: verify_file(item, full), items, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    results.sort(key=lambda result: (result[0], result[1]))
+    stats = {"files": len(results),
+             "bytes": sum([result[2] for result in results]),
+             "read_bytes": sum([result[5] for result in results]),
+             "failed": len([result for result in results if result[4] != "OK"]),
+             "seconds": time.time() - started}
+    return results, stats
+
+
+def describe(stats, full=False):
+    '''
+    Returns a one-line summary of verification statistics, including
+    throughput, for the console and the log.
+    '''
+    megabytes = stats["bytes"] / (1024.0 * 1024.0)
+    seconds = max(stats["seconds"], 0.001)
+    text = "Verified ({0}) {1} files, {2:.1f} MB in {3:.1f} s ({4:.1f} MB/s, {5:.0f} files/s)".format(
+        "full" if full else "fast", stats["files"], megabytes, stats["seconds"],
+        megabytes / seconds, stats["files"] / seconds)
+    if stats["failed"]:
+        text = text + ": {0} FAILED".format(stats["failed"])
+    else:
+        text = text + ": all OK"
+    return text + "."
+
+
+def write_manifest(path, results):
+    '''
+    Writes verification results as a pipe-delimited manifest.
+    '''
+    with open(path, "w") as manifest:
+        for machine, file_path, size, digest, status, read_bytes in results:
+            manifest.write("{0}|{1}|{2}|{3}|{4}\n".format(machine, file_path, size, digest, status))
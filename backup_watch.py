@@ -0,0 +1,223 @@
+from __future__ import print_function  # better print function
+import os                              # file/directory functions
+import sys                             # for command line arguments
+import time                            # for polling periodically
+import shutil                          # for copying changed files
+import argparse                        # for command line options
+from datetime import datetime          # for timestamps of history entries
+from multiprocessing.pool import ThreadPool  # for polling machines in parallel
+import backup_engine                   # jobs, inventory and file discovery
+import backup_verify                   # for content hashes
+
+# ----------------------------------------------------------------------
+# OVERVIEW: Change watcher for config files. Config files rarely change,
+# but a backup run copies every one of them every time. This program
+# instead keeps the size, mtime and hash of every file last seen, and on
+# each poll:
+#   - files whose size and mtime didn't change are not opened at all
+#   - files with a new size or mtime are hashed; if the content changed
+#     (or the file is new), the file is copied into the history directory
+#     of this poll: <history_dir>/<YYYYMMDD-HHMMSS>/<machine>/<file>
+#   - files that disappeared are reported and dropped from the state
+# Which files are watched, and on which machines, is taken from a job in
+# backup_jobs.ini (config by default; history_dir is a key of the job)
+# and from backup_inventory.ini. The state is kept in
+# <history_dir>/watch_state.txt, one pipe-delimited line per file:
+#   machine|path|size|mtime|hash
+# Examples:
+#   python backup_watch.py --env live                  (one poll)
+#   python backup_watch.py --env all --interval 60     (poll every hour)
+# Exit status of a single poll: 0 if every machine was checked, 1 if some
+# were unreachable, 2 for invalid settings or options.
+# ----------------------------------------------------------------------
+
+state_name = "watch_state.txt"
+log_file = "backup_watch.log"
+
+
+def load_state(path):
+    '''
+    Reads the state file and returns a dictionary of (machine, path)
+    -> (size, mtime, hash). Returns an empty dictionary if there is none.
+    '''
+    state = {}
+    if not os.path.exists(path):
+        return state
+    with open(path) as state_file:
+        for line in state_file:
+            fields = line.rstrip("\n").split("|")
+            if len(fields) == 5:
+                state[(fields[0], fields[1])] = (int(fields[2]), float(fields[3]), fields[4])
+    return state
+
+
+def save_state(path, state):
+    '''
+    Writes the state file under a temporary name, then renames it, so an
+    interrupted poll never leaves half a state behind.
+    '''
+    part_path = path + ".part"
+    with open(part_path, "w") as state_file:
+        for (machine, file_path), (size, mtime, digest) in sorted(state.items()):
+            state_file.write("{0}|{1}|{2}|{3:.6f}|{4}\n".format(machine, file_path, size, mtime, digest))
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(part_path, path)
+
+
+def poll_machine(job, env, machine, hosts, state, history_run_dir):
+    '''
+    Checks the watched files of one machine against the state. Returns a
+    tuple of:
+      - dictionary of state entries to update
+      - list of state keys of files that disappeared
+      - list of (path, "new"/"changed"/"removed") of files copied or gone
+      - number of files checked, or None if the machine is unreachable
+    '''
+    if not hosts.is_reachable(machine):
+        return {}, [], [], None
+    found = job.find_files(machine, job.dirs_for(env), hosts)
+    if hosts.is_dead(machine):
+        return {}, [], [], None
+
+    updates = {}
+    changes = []
+    for file_src, path in found:
+        stat = os.stat(file_src)
+        old = state.get((machine, path))
+        if old and old[0] == stat.st_size and abs(old[1] - stat.st_mtime) < 0.001:
+            continue  # metadata unchanged: don't open the file
+        digest = backup_verify.file_hash(file_src)
+        updates[(machine, path)] = (stat.st_size, stat.st_mtime, digest)
+        if old and old[2] == digest:
+            continue  # touched, but the same content
+        dest = history_run_dir + "/" + path
+        if not os.path.exists(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+        shutil.copy2(file_src, dest)
+        changes.append((path, "changed" if old else "new"))
+
+    found_paths = set([path for file_src, path in found])
+    removed = [key for key in state if key[0] == machine and key[1] not in found_paths]
+    changes.extend([(key[1], "removed") for key in removed])
+    return updates, removed, changes, len(found)
+
+
+def poll(job, targets, hosts, history_dir, workers=1):
+    '''
+    Polls all (environment, machine) targets once, updates the state
+    file and prints one line per machine to the console and the log.
+    Returns True if every machine was checked.
+    '''
+    started = datetime.now()
+    history_run_dir = "{0}/{1}".format(history_dir, started.strftime("%Y%m%d-%H%M%S"))
+    state_path = "{0}/{1}".format(history_dir, state_name)
+    state = load_state(state_path)
+
+    def poll_target(target):
+        env, machine = target
+        try:
+            return machine, poll_machine(job, env, machine, hosts, state, history_run_dir), None
+        except (IOError, OSError) as exception:
+            return machine, None, exception
+
+    pool = ThreadPool(max(1, workers))
+    try:
+        results = pool.map(poll_target, targets, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    all_checked = True
+    with open(log_file, "a") as log:
+        print("-" * 67, file=log)
+        print("Poll started ", started.strftime("%Y-%m-%d %H:%M:%S"), file=log)
+        print("-" * 67, file=log)
+        for machine, result, error in results:
+            if error is not None:
+                message = "Check FAILED ({0}).".format(error)
+                all_checked = False
+            else:
+                updates, removed, changes, checked = result
+                if checked is None:
+                    message = "Machine unreachable ({0}).".format(hosts.dead[machine])
+                    all_checked = False
+                else:
+                    state.update(updates)
+                    for key in removed:
+                        del state[key]
+                    if changes:
+                        message = "{0} files checked: {1}".format(
+                            checked, ", ".join(["{0} {1}".format(path.split("/", 1)[1], kind)
+                                                for path, kind in changes]))
+                    else:
+                        message = "{0} files checked: no changes.".format(checked)
+            line = "{0}...{1} {2}".format(machine, " " * (20 - len(machine)), message)
+            print(line)
+            print(line, file=log)
+    save_state(state_path, state)
+    return all_checked
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="backup_watch.py",
+        description="Copies config files that changed since the last poll into a history.")
+    parser.add_argument("job", nargs="?", default="config",
+                        help="job (section of {0}) whose files are watched; "
+                             "default config".format(backup_engine.jobs_file))
+    parser.add_argument("--env", action="append", required=True,
+                        help="environment to watch (test, live or all); can be given more than once")
+    parser.add_argument("--interval", type=float, metavar="MINUTES",
+                        help="poll again every MINUTES minutes, until interrupted")
+    parser.add_argument("--workers", type=int,
+                        help="number of machines checked at the same time")
+    parser.add_argument("--fleet", metavar="DIR",
+                        help="watch a fake fleet in this directory instead of the servers "
+                             "(see backup_fleet.py)")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    try:
+        settings, jobs = backup_engine.load_jobs(backup_engine.jobs_file, [args.job])
+        inventory_list = backup_engine.load_inventory(settings.get("inventory", "backup_inventory.ini"))
+        backup_engine.make_hosts(settings, args.fleet)
+    except (IOError, ValueError) as exception:
+        print(exception)
+        sys.exit(2)
+    job = jobs[0]
+    if job.mode != "files":
+        print("Job {0}: only jobs with mode files can be watched".format(job.name))
+        sys.exit(2)
+    inventory = dict(inventory_list)
+    envs = []
+    for env in args.env:
+        env = env.lower().strip()
+        if env == "all":
+            envs.extend([name for name, machines in inventory_list])
+        elif env in inventory:
+            envs.append(env)
+        else:
+            print("Invalid value for --env: '{0}'".format(env))
+            sys.exit(2)
+    targets = [(env, machine) for env in envs for machine in inventory[env]]
+    workers = args.workers or int(settings.get("workers", 1))
+    if not os.path.exists(job.history_dir):
+        os.makedirs(job.history_dir)
+
+    print("Watching {0} of {1} machines; history in {2}".format(
+        job.title, " and ".join([env.upper() for env in envs]), job.history_dir))
+    while True:
+        # fresh checker each poll, so a machine that was down is tried again
+        hosts = backup_engine.make_hosts(settings, args.fleet)
+        all_checked = poll(job, targets, hosts, job.history_dir, workers)
+        if not args.interval:
+            sys.exit(0 if all_checked else 1)
+        time.sleep(args.interval * 60)
+
+
+if __name__ == "__main__":
+
+    main(sys.argv[1:])
@@ -19,14 +19,111 @@
 # output_subs_details.txt
 # output_invs.txt
 # output_invs_details.txt
+# output_subs.xlsx - only when input_subs.xlsx is used, see below
+# output_*.parquet or output_*.arrow - only with option --columnar, see below
+# reconciliation.txt - totals per WBSE and category that don't add up, see below
+
+# staging.db - SQLite database the inputs are loaded into, rebuilt every run
+# input_subs.idx, input_invs.idx - indexes of the dumps, only with option --wbse
 
 # OPTIONAL FILES:
 # subs_include.txt - if provided, only the listed subs will be processed
 # subs_exclude.txt - if proviced, all except the listed subs will be processed
+# input_subs.xlsx - if provided, used instead of input_subs.txt, see below
 
-# Before exporting data from OSP database, run these two queries to remove line breaks:
-# UPDATE Subcontracts SET Comm1 = Replace(Replace(Nz([Comm1],""),Chr(10),"; "),Chr(13),"; ");
-# UPDATE Invoices SET Comm1 = Replace(Replace(Nz([Comm1],""),Chr(10),"; "),Chr(13),"; ");
+# Reconciliation of the outputs against the inputs:
+# -------------------------------------------------------
+#    While converting, the script adds up per WBSE and budget category (GL
+#    6935xx) what the inputs say and what goes into the outputs:
+#    - Budget: category amounts of all valid periods, and IDC as direct costs
+#      times the IDC rate plus the IDC adjustment, against the rows of
+#      output_subs_details.txt; budget diff rows (GL 099650) against
+#      the database and SAP amounts in input_budget_diffs.txt; the $1
+#      additions are expected as adjustments: $1 for each category spent
+#      but not budgeted, and minus that many dollars on the F&A GL
+#    - Expense: invoice line items and IDC, against the rows of
+#      output_invs_details.txt, with the 6916xx and 6971xx cost elements of
+#      a category (the G/L break split) added together
+#    The inputs are added up from their own columns, apart from the code
+#    that writes the outputs, and the outputs from the amounts as written.
+#    Totals that differ by a cent or more are listed in 'reconciliation.txt'.
+
+# Budget periods and fiscal year:
+# -------------------------------------------------------
+#    A sub has up to 6 budget periods (budget_periods), with the columns of
+#    each budget field in a block of 6 (BgStart1-6, BgEnd1-6, Salary1-6, ...).
+#    The latest valid period becomes fiscal period 9, the one before it 8,
+#    and so on; all of them in fiscal year 2017 unless option --fiscal-year
+#    says otherwise. The columns of every period, for every possible number
+#    of valid periods, are worked out once before converting (see
+#    period_layout()); invoices use the same order of line items.
+
+# Money amounts:
+# -------------------------------------------------------
+#    Amounts are read into whole cents and IDC rates into whole millionths
+#    (see text_to_units()), so sums, G/L break splits and the running prior
+#    expenses are exact; IDC (direct costs times the rate) is rounded to the
+#    cent half away from zero. Amounts are written the same way as before
+#    (1234.5, 15.0, and 0 for a blank field). Only an IDC that is exactly
+#    half a cent can differ by a cent from older runs, which rounded floats
+#    that were a hair below or above the half.
+
+# Diagnostics in log.txt:
+# -------------------------------------------------------
+#    Unreasonable dates, start dates >= end dates and periods that may have
+#    been ignored are checked on every row by default (--diagnostics row).
+#    With --diagnostics bulk, the checks are collected while converting and
+#    done in one pass at the end: log.txt gets the same entries, after the
+#    other entries. With --diagnostics off, they are skipped. Either way,
+#    every date must be a mm/dd/yyyy date: a malformed one stops the
+#    conversion at the record it is in.
+
+# Columnar copies of the outputs:
+# -------------------------------------------------------
+#    With option --columnar parquet (or arrow), each of the four outputs is
+#    also written as a Parquet (or Arrow IPC) file with typed columns: amounts
+#    and rates as numbers, fiscal periods and years as integers, dates as
+#    dates. Rows stay in WBSE order and row groups are cut only between two
+#    WBSEs, so a query for some WBSEs only reads the row groups that hold them.
+#    Needs the pyarrow package.
+
+# Excel workbooks instead of the Subcontracts text dump:
+# -------------------------------------------------------
+#    This replaces the all_steps macro in vba_code.txt, which read and wrote
+#    the sheets one cell at a time. Needs the openpyxl package.
+# 1. Paste the Subcontracts table (with headers, 96 columns) in sheet Source
+#    of workbook 'input_subs.xlsx', same as step 1 of the macro instructions
+# 2. Run this script; the Source sheet is read row by row in read-only mode,
+#    and goes through the same steps as the text dump
+# 3. Besides the text outputs, the script writes 'output_subs.xlsx' with sheets
+#    Target1 (same rows as output_subs.txt) and Target2 (same rows as
+#    output_subs_details.txt), streamed in write-only mode
+
+# Converting one sub (or a few):
+# -------------------------------------------------------
+#    With option --wbse (e.g. --wbse 3012345 3012346), only the listed subs
+#    are converted, on top of subs_include.txt or subs_exclude.txt. Instead
+#    of reading the whole dumps, the script looks the subs up in
+#    'input_subs.idx' (WBSE -> byte offsets in input_subs.txt) and their
+#    invoices in 'input_invs.idx' (sub id -> byte offsets in input_invs.txt),
+#    and reads just those records. The indexes are built on the first use,
+#    and again whenever the size or modification time of a dump changes.
+#    Only the records read are checked for the number of fields.
+
+# Many small reruns (rehearsals):
+# -------------------------------------------------------
+#    conversion_service.py keeps this script and the reference tables
+#    (zfr1e, countries, budget diffs, include/exclude lists) in memory, and
+#    converts dumps (all subs or a list of WBSEs) on request from localhost.
+#    A table is read again only when its file changes. zfr1e and countries
+#    are also kept loaded and indexed in an SQLite database in memory (see
+#    open_lookups()), which each job's staging.db joins to. See the notes
+#    there.
+
+# Line breaks in text fields (like Comm1) no longer need to be removed before
+# exporting: records are put back together using the known number of fields
+# (96 for subs, 35 for invoices), with each line break replaced by '; '.
+# Large dumps are parsed in parallel, by a pool of processes.
 
 # How to format data when exporting from Access tables:
 # -------------------------------------------------------
@@ -60,61 +157,16 @@
 # 5. Create a list of IDs and Country codes and save in file 'input_subs_countries.txt'
 
 import os
+import sys
+import argparse
 from datetime import datetime, timedelta, date
 from time import sleep
-from operator import itemgetter # used for sorting lists
-
-print('-' * 51)
-print('Program started', ' '*14, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-print('-' * 51)
-
-# clean out any old files
-try: os.remove('log.txt')
-except OSError: pass
-
-try: os.remove('output_subs.txt')
-except OSError: pass
-
-try: os.remove('output_subs_details.txt')
-except OSError: pass
-
-try: os.remove('output_invs.txt')
-except OSError: pass
-
-try: os.remove('output_invs_details.txt')
-except OSError: pass
-
-for input_fname in ['input_subs.txt', 'input_invs.txt', 'input_zfr1e.txt', 'input_subs_countries.txt', 'input_budget_diffs.txt']:
-	if not os.path.exists(input_fname):
-		print('Missing one or more of these input files:')
-		print('input_subs.txt, input_invs.txt, input_zfr1e.txt, input_subs_countries.txt, or input_budget_diffs.txt')
-		print('-' * 51); print('Program terminated early'); print('-' * 51)
-		exit()
-
-sleep(1)
-
-# open needed files
-input_subs = open('input_subs.txt', encoding='utf8')
-input_invs = open('input_invs.txt', encoding='utf8')
-input_zfr1e = open('input_zfr1e.txt', encoding='utf8')
-input_subs_countries = open('input_subs_countries.txt', encoding='utf8')
-input_budget_diffs = open('input_budget_diffs.txt', encoding='utf8')
-
-log_file = open('log.txt', 'a', encoding='utf8')
-log_file.write('----- Start: ' + str(datetime.now()) + ' -----\n')
-
-outfile_subs = open('output_subs.txt', 'a', encoding='utf8')
-outfile_subs_details = open('output_subs_details.txt', 'a', encoding='utf8')
-outfile_invs = open('output_invs.txt', 'a', encoding='utf8')
-outfile_invs_details = open('output_invs_details.txt', 'a', encoding='utf8')
-if os.path.exists('subs_include.txt'):
-	subs_include = open('subs_include.txt', 'r', encoding='utf8')
-else:
-	subs_include = None
-if os.path.exists('subs_exclude.txt'):
-	subs_exclude = open('subs_exclude.txt', 'r', encoding='utf8')
-else:
-	subs_exclude = None
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+import sqlite3 # staging database for filters and joins
+import itertools # for naming the lookups databases
+import importlib.util # for checking that optional packages are installed
+from operator import itemgetter
+import multiprocessing # pool for parsing large dumps
 
 categories_list = [
 	'salary',
@@ -152,6 +204,74 @@ exp_categories = [
 	('691659', '697159')  # misc
 ]
 
+
+# money is kept in whole cents and rates in whole millionths (0.585 ->
+# 585000), so sums and differences are exact; see text_to_units()
+rate_scale = 10 ** 6
+
+# dumps smaller than this are parsed in one piece, without a pool of processes
+parallel_min_bytes = 8 * 1024 * 1024
+
+# types of the columns of the outputs in columnar form (text unless listed)
+columnar_types = {
+	'output_subs': {
+		'G/L Break': 'number',
+		'Received Date': 'date',
+		'Manual Prior Exp': 'number'
+	},
+	'output_subs_details': {
+		'Fiscal Period': 'integer',
+		'Fiscal Year': 'integer',
+		'Budget Period Start': 'date',
+		'Budget Period End': 'date',
+		'Amount': 'number',
+		'IDC Rate': 'number'
+	},
+	'output_invs': {
+		'Received Date': 'date',
+		'Start Date': 'date',
+		'End Date': 'date',
+		'IDC Rate': 'number'
+	},
+	'output_invs_details': {
+		'Amount': 'number'
+	}
+}
+
+# rows in a row group of the columnar outputs (more, to finish the last WBSE)
+rows_per_group = 64 * 1024
+
+# budget fields of a sub, in the order of the dump from column 24 on: a block
+# of one column per budget period for each (BgStart1 to BgStart6, BgEnd1 to
+# BgEnd6, ...); direct costs (salary to odc) are the base of IDC
+budget_periods = 6
+direct_categories = categories_list[0:6]
+other_categories = categories_list[7:]
+budget_fields = ['start', 'end'] + direct_categories + ['idc_rate', 'idc_adj'] + other_categories
+budget_columns = dict([(field, 24 + index * budget_periods) for index, field in enumerate(budget_fields)])
+sub_num_fields = 24 + len(budget_fields) * budget_periods
+
+# line items of an invoice: one column each from column 25 on, same order
+invoice_columns = dict([(field, 25 + index) for index, field in enumerate(budget_fields[2:])])
+
+# the latest valid budget period of a sub is this fiscal period, the one
+# before it is one less, and so on
+last_fiscal_period = 9
+
+direct_gls = [budget_categories[category] for category in direct_categories]
+other_gls = [budget_categories[category] for category in other_categories]
+idc_gl = budget_categories['idc']
+
+# per line item of an invoice (categories_list order): budget category gl,
+# cost elements (6916xx, 6971xx), and whether it counts as spent for the $1
+# additions (all but IDC)
+expense_items = [(budget_categories[category], cost_elems, category != 'idc')
+	for category, cost_elems in zip(categories_list, exp_categories)]
+
+# invoice_gather(inv) returns the texts of the IDC rate, IDC adjustment, and
+# the amounts of the direct costs and the other categories of an invoice
+invoice_gather = itemgetter(*[invoice_columns[field] for field in ['idc_rate', 'idc_adj'] + direct_categories + other_categories])
+
 def padded_text(text, taken, total=50):
 	'''
 	Accepts a string and returns the same string padded with leading
@@ -186,6 +306,93 @@ def text_to_float(text):
 	else:
 		return 0
 
+def text_to_units(text, places=2):
+	'''
+	Accepts a text that represents a dollar amount (cleaned up the same
+	way as in text_to_float()) or a rate, and returns it as a whole
+	number of units of 10**-places: cents by default, millionths for
+	rates (places=6). Extra decimals are rounded half away from zero,
+	like scale_down() does; an empty text is 0.
+	'''
+	text = text.strip().strip('$').replace(',','')
+	if '(' in text:
+		text = text.strip('(').strip(')').strip('$')
+		text = '-' + text
+	if not text:
+		return 0
+	whole, dot, fraction = text.partition('.')
+	if len(fraction) <= places:
+		try:
+			return int(whole + fraction.ljust(places, '0')) # '-12.5' -> -1250
+		except ValueError:
+			pass
+	# exponents, or more decimals than places
+	try:
+		value = Decimal(text).scaleb(places)
+	except InvalidOperation:
+		raise ValueError('could not convert string to a number: ' + repr(text))
+	return int(value.quantize(Decimal(1), ROUND_HALF_UP))
+
+def text_to_cents(text):
+	'''
+	Accepts a text that represents a dollar amount and returns the
+	number of cents (see text_to_units()).
+	'''
+	return text_to_units(text, 2)
+
+def text_to_rate(text):
+	'''
+	Accepts a text that represents a rate and returns it in millionths
+	(see rate_scale).
+	'''
+	return text_to_units(text, 6)
+
+def scale_down(value, divisor):
+	'''
+	Accepts a whole number and returns it divided by divisor, rounded
+	half away from zero, e.g. cents times a rate in millionths divided
+	by rate_scale gives cents.
+	'''
+	quotient, remainder = divmod(abs(value), divisor)
+	if remainder * 2 >= divisor:
+		quotient += 1
+	return quotient if value >= 0 else -quotient
+
+def is_blank(text):
+	'''
+	Accepts the text of an amount or rate field and returns whether it
+	holds no number at all.
+	'''
+	return not text.strip().strip('$').replace(',','')
+
+def cents_to_text(cents, blank=False):
+	'''
+	Accepts a number of cents and returns the amount as text for the
+	outputs, the way str() writes a float rounded to cents: 1234.5,
+	15.0, -0.07. An amount from a blank field (see is_blank()) is
+	written as 0, like before.
+	'''
+	if blank:
+		return '0'
+	return str(cents / 100)
+
+def amount_to_text(text):
+	'''
+	Accepts the text of an amount field that goes to the outputs as it
+	is, not figured from other amounts, and returns it the way str()
+	writes it as a float: 1234.5, 15.0, 0 for a blank field. Unlike
+	cents_to_text(), decimals past the cents are kept (12.345).
+	'''
+	return str(text_to_float(text))
+
+def rate_to_text(rate, blank=False):
+	'''
+	Accepts a rate in millionths and returns it for the outputs as
+	a percent rounded to 2 decimals: 585000 -> 58.5 (0 for a rate from
+	a blank field).
+	'''
+	return cents_to_text(scale_down(rate, 100), blank)
+
 def text_to_date(text):
 	'''
 	Accepts a text that represents a date, cleans it up 
@@ -203,7 +410,7 @@ def is_date_reasonable(date_val):
 		return 0
 	return 1
 
-def check_budget_periods(sub):
+def check_budget_periods(sub, report=None):
 	'''
 	Accepts a sub and returns a three-element tuple where the first
 	value is wbse, the second is the number of valid budget periods found
@@ -213,49 +420,716 @@ def check_budget_periods(sub):
 
 	A budget period is considered valid and included in the count
 	of budget periods only if both start and end dates are available.
+	The periods after the last valid one are passed to report (see
+	diagnose()), unless it is None.
 	'''
 	valid_periods = 0
 	# initial_sub = sub
 	sub = sub.strip()
 	sub = sub.split('|')
 	wbse = sub[1].strip()
-	per1_start = sub[24].strip()
-	per1_end = sub[30].strip()
+	start_col = budget_columns['start']
+	end_col = budget_columns['end']
+	per1_start = sub[start_col].strip()
+	per1_end = sub[end_col].strip()
 	if not per1_start	or not per1_end:
 		return wbse, 0, None
 	else:
 		valid_periods	+= 1
 		# check remaining periods
-		for i in range(0, 5):
-				start = sub[25 + i].strip()
-				end = sub[31 + i].strip()
+		for i in range(0, budget_periods - 1):
+				start = sub[start_col + 1 + i].strip()
+				end = sub[end_col + 1 + i].strip()
 				if start and end:
 					valid_periods	+= 1
 				elif not start and end:
 					# fix the start date using a prior period's end date + 1 day:
-					prior_end = sub[30 + i][0:10]
+					prior_end = sub[end_col + i][0:10]
 					# print('sub:', sub[0])
 					prior_end = datetime.strptime(prior_end, '%m/%d/%Y')
 					new_start = prior_end	+ timedelta(days = 1)
 					new_start	= new_start.strftime('%m/%d/%Y %H:%M:%S')
-					sub[25 + i] = new_start
+					sub[start_col + 1 + i] = new_start
 					valid_periods	+= 1
 				else:
 					# missing an end date (and possibly missing a start date)
 					# I can stop checking further periods but let's do Nate
 					# a favor and check further periods and see if they seem to exist
-					while i < 4:
-						i += 1
-						start = sub[25 + i].strip()
-						end = sub[31 + i].strip()
-						if start or end:
-							# an odd period possibly exists - let Nate know about this sub
-							log_file.write('Sub wbse='+sub[1]+' may have periods ignored by tool\n')
+					if report:
+						report(('periods', sub[1], [(sub[start_col + 1 + k], sub[end_col + 1 + k]) for k in range(i + 1, budget_periods - 1)]))
 					break
 	sub.append(str(valid_periods))
 	sub = '|'.join(sub)
 	return(wbse, valid_periods, sub)
 
+def diagnose(check, to_date=text_to_date):
+	'''
+	Accepts a check collected during conversion and returns the lines
+	for log.txt it calls for (none if everything looks fine). Checks are:
+	  ('periods', wbse, [(start, end), ...]) - periods after the last valid one
+	  ('period', wbse, period number, start, end) - a budget period
+	  ('inv', invoice id, received date, start date, end date) - an invoice
+	to_date turns the date texts into dates.
+	'''
+	lines = []
+	if check[0] == 'periods':
+		kind, wbse, periods = check
+		for start, end in periods:
+			if start.strip() or end.strip():
+				# an odd period possibly exists - let Nate know about this sub
+				lines.append('Sub wbse='+wbse+' may have periods ignored by tool\n')
+	elif check[0] == 'period':
+		kind, wbse, period_num, start, end = check
+		if not is_date_reasonable(to_date(start)):
+			lines.append('Sub wbse=' + wbse + ' has an unreasonable Start date: ' + start + '\n')
+		if not is_date_reasonable(to_date(end)):
+			lines.append('Sub wbse=' + wbse + ' has an unreasonable End date: ' + end + '\n')
+		# check if end date is greater than start date; make a log entry if true
+		dates_diff = to_date(end) - to_date(start)
+		if dates_diff <= timedelta(days = 0):
+			lines.append('Sub wbse=' + wbse + ' has start date >= end date in period ' + str(period_num) + ' but will still be migrated\n')
+	else:
+		kind, inv_id, rec_date, start_date, end_date = check
+		inv_id = str(round(inv_id))
+		if rec_date:
+			if not is_date_reasonable(to_date(rec_date)):
+				lines.append('Inv id=' + inv_id + ' has an unreasonable received date: ' + rec_date + '\n')
+		if not is_date_reasonable(to_date(start_date)):
+			lines.append('Inv id=' + inv_id + ' has an unreasonable start date: ' + start_date + '\n')
+		if not is_date_reasonable(to_date(end_date)):
+			lines.append('Inv id=' + inv_id + ' has an unreasonable end date: ' + end_date + '\n')
+		# check if end date is greater than start date; make a log entry if not true
+		dates_diff = to_date(end_date) - to_date(start_date)
+		if dates_diff <= timedelta(days = 0):
+			lines.append('Inv id=' + inv_id + ' has start date >= end date but will still be migrated\n')
+	return lines
+
+def date_reader():
+	'''
+	Returns a function like text_to_date() that converts every distinct
+	text only once.
+	'''
+	dates = {}
+	def to_date(text):
+		if text not in dates:
+			dates[text] = text_to_date(text)
+		return dates[text]
+	return to_date
+
+def check_dates(check, to_date):
+	'''
+	Accepts a check (see diagnose()) and raises ConversionError if one of
+	its dates can't be read with to_date. Cheap enough to do on every row
+	even when the diagnostics are skipped or put off.
+	'''
+	if check[0] == 'periods':
+		return
+	if check[0] == 'period':
+		kind, wbse, period_num, start, end = check
+		record = 'Sub wbse=' + wbse + ' period ' + str(period_num)
+		texts = [start, end]
+	else:
+		kind, inv_id, rec_date, start_date, end_date = check
+		record = 'Inv id=' + str(round(inv_id))
+		texts = [text for text in (rec_date, start_date, end_date) if text]
+	for text in texts:
+		try:
+			to_date(text)
+		except ValueError:
+			raise ConversionError(record + ' has a date that is not mm/dd/yyyy: ' + repr(text))
+
+def validate(checks, log_file, to_date):
+	'''
+	Bulk validation pass: accepts the checks collected during conversion
+	(their dates already checked, see check_dates()), writes the lines
+	for log.txt they call for, in order, and returns their count.
+	'''
+	count = 0
+	for check in checks:
+		lines = diagnose(check, to_date)
+		log_file.write(''.join(lines))
+		count += len(lines)
+	return count
+
+def cell_to_text(value):
+	'''
+	Accepts the value of an Excel cell and returns it as text the way
+	the Access export writes it: dates as mm/dd/yyyy hh:mm:ss, whole
+	numbers without decimals, and line breaks replaced like the queries
+	at the top of this file do.
+	'''
+	if value is None:
+		return ''
+	if isinstance(value, datetime):
+		return value.strftime('%m/%d/%Y %H:%M:%S')
+	if isinstance(value, float) and value.is_integer():
+		value = int(value)
+	text = str(value)
+	return text.replace('\r\n', '; ').replace('\n', '; ').replace('\r', '; ').replace('|', '/')
+
+def read_source_sheet(workbook, num_cols=sub_num_fields):
+	'''
+	Accepts a workbook opened in read-only mode and yields the rows
+	of its Source sheet as pipe-delimited lines, like the lines of
+	input_subs.txt. Row 1 holds the headers; reading stops at the first
+	row with an empty first cell, like the macro did.
+	'''
+	sheet = workbook['Source']
+	rows = sheet.iter_rows(max_col=num_cols, values_only=True)
+	headers = next(rows, ())
+	if len([header for header in headers if header is not None]) != num_cols:
+		raise ValueError('Sheet Source needs ' + str(num_cols) + ' columns with headers')
+	for row in rows:
+		if row[0] is None:
+			break
+		yield '|'.join([cell_to_text(value) for value in row]) + '\n'
+
+def write_target_sheet(workbook, title, fname, number_cols):
+	'''
+	Copies the given pipe-delimited output file (header line included)
+	into a new sheet of a write-only workbook, one row per line, with
+	the columns in number_cols written as numbers.
+	'''
+	sheet = workbook.create_sheet(title)
+	with open(fname, encoding='utf8') as outfile:
+		for line_num, line in enumerate(outfile):
+			row = line.rstrip('\n').split('|')
+			if line_num:
+				for col in number_cols:
+					if '.' in row[col]:
+						row[col] = float(row[col])
+					elif row[col]:
+						row[col] = int(row[col])
+			sheet.append(row)
+
+def staging_sub(line_num, sub):
+	'''
+	Accepts a line number and a sub record from the dump and returns the
+	values for a row of table subs in the staging database.
+	'''
+	sub = sub.strip()
+	fields = sub.split('|') + ['', '']
+	return (line_num, fields[0], fields[1], fields[2], sub.count('|') + 1, sub)
+
+def staging_inv(line_num, inv):
+	'''
+	Accepts a line number and an invoice record from the dump and returns
+	the values for a row of table invs in the staging database. The end
+	date is kept as yyyy-mm-dd, so the database can sort on it.
+	'''
+	inv = inv.strip()
+	fields = inv.split('|')
+	try:
+		end_date = text_to_date(fields[24]).strftime('%Y-%m-%d')
+	except (IndexError, ValueError):
+		end_date = None # reported later, if the invoice is still needed
+	fields = fields + ['']
+	return (line_num, fields[0], fields[1], end_date, inv.count('|') + 1, inv)
+
+def join_records(text, num_fields, make_row, line_num, pending=None):
+	'''
+	Accepts text from a dump and puts its lines together into records,
+	using the known number of fields: a line with fewer fields than that
+	is the start of a record whose text has line breaks in it, and the
+	following lines are added to it (line breaks replaced with '; ', like
+	the Access queries that used to clean up Comm1) until the fields are
+	all there. A record that still comes out short or long is kept as is,
+	for the field count check to report.
+
+	Returns a tuple of the list of make_row(line_num, record) results,
+	the next line number, and the lines of a record still incomplete at
+	the end of the text (to be continued by the text that follows).
+	'''
+	rows = []
+	pipes_needed = num_fields - 1
+	parts = pending or []
+	pipes = sum([part.count('|') for part in parts])
+	lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+	if not lines[-1]:
+		lines.pop() # text ends with a line break
+	for line in lines:
+		count = line.count('|')
+		if parts and pipes + count > pipes_needed:
+			# the record so far is short and this line starts another one
+			rows.append(make_row(line_num, '; '.join(parts)))
+			line_num += 1
+			parts = []
+			pipes = 0
+		parts.append(line)
+		pipes += count
+		if pipes >= pipes_needed or not line and len(parts) == 1:
+			rows.append(make_row(line_num, '; '.join(parts)))
+			line_num += 1
+			parts = []
+			pipes = 0
+	return rows, line_num, parts
+
+def read_chunk(fname, start, end):
+	'''
+	Returns the text between the given byte offsets of a UTF-8 file.
+	'''
+	with open(fname, 'rb') as dump:
+		dump.seek(start)
+		return dump.read(end - start).decode('utf8')
+
+def parse_chunk(task):
+	'''
+	Worker of read_dump(): parses one chunk of a dump, as if the chunk
+	started with a new record.
+	'''
+	fname, start, end, num_fields, make_row, line_num = task
+	return join_records(read_chunk(fname, start, end), num_fields, make_row, line_num)
+
+def find_chunks(fname, num_chunks):
+	'''
+	Splits a file into about num_chunks byte ranges that start right
+	after a line break, and returns a list of (start, end) offsets.
+	'''
+	size = os.path.getsize(fname)
+	starts = [0]
+	with open(fname, 'rb') as dump:
+		for i in range(1, num_chunks):
+			dump.seek(size * i // num_chunks)
+			dump.readline() # skip to the next line break
+			if dump.tell() > starts[-1] and dump.tell() < size:
+				starts.append(dump.tell())
+	return list(zip(starts, starts[1:] + [size]))
+
+def read_dump(fname, num_fields, make_row, workers=None):
+	'''
+	Reads a pipe-delimited dump and returns a list of make_row(line_num,
+	record) for its records, in the order of the file, with line_num
+	increasing from one record to the next.
+
+	Dumps larger than parallel_min_bytes are split into chunks parsed in
+	a pool of processes. A chunk is parsed as if it started with a new
+	record, which is true unless the chunk before it ended in the middle
+	of a record with line breaks; such a chunk is parsed again here,
+	continuing that record. Line numbers of chunk i start at i * 2**32.
+	'''
+	workers = workers or os.cpu_count() or 1
+	if workers == 1 or os.path.getsize(fname) < parallel_min_bytes:
+		chunks = [(0, os.path.getsize(fname))]
+	else:
+		chunks = find_chunks(fname, workers * 4)
+	tasks = [(fname, start, end, num_fields, make_row, i << 32) for i, (start, end) in enumerate(chunks)]
+	if len(tasks) == 1:
+		results = [parse_chunk(tasks[0])]
+	else:
+		with multiprocessing.Pool(workers) as pool:
+			results = pool.map(parse_chunk, tasks)
+
+	all_rows = []
+	pending = []
+	for task, (rows, line_num, tail) in zip(tasks, results):
+		if pending:
+			fname, start, end, num_fields, make_row, line_num = task
+			rows, line_num, tail = join_records(read_chunk(fname, start, end), num_fields, make_row, line_num, pending)
+		all_rows.extend(rows)
+		pending = tail
+	if pending:
+		all_rows.append(make_row(line_num, '; '.join(pending)))
+	return all_rows
+
+def index_dump(fname, num_fields, key_field):
+	'''
+	Reads a pipe-delimited dump and returns a dictionary of the value of
+	the given field (in the record stripped and split like staging_sub()
+	and staging_inv() do) -> list of (start, end) byte offsets of the
+	records with that value. Lines are put together into records the same
+	way as in join_records().
+	'''
+	index = {}
+	pipes_needed = num_fields - 1
+	def add(parts, start, end):
+		fields = '; '.join(parts).strip().split('|')
+		if len(fields) > key_field:
+			index.setdefault(fields[key_field], []).append((start, end))
+
+	with open(fname, 'rb') as dump:
+		offset = 0
+		start = 0
+		parts = []
+		pipes = 0
+		for raw_line in dump:
+			line = raw_line.decode('utf8').rstrip('\r\n')
+			count = line.count('|')
+			if parts and pipes + count > pipes_needed:
+				# the record so far is short and this line starts another one
+				add(parts, start, offset)
+				parts = []
+				pipes = 0
+			if not parts:
+				start = offset
+			parts.append(line)
+			pipes += count
+			offset += len(raw_line)
+			if pipes >= pipes_needed or not line and len(parts) == 1:
+				add(parts, start, offset)
+				parts = []
+				pipes = 0
+		if parts:
+			add(parts, start, offset)
+	return index
+
+def load_dump_index(fname, num_fields, key_field):
+	'''
+	Returns a tuple of the index of a dump (see index_dump()) and whether
+	it had to be built. The index is kept in a sidecar file next to the
+	dump (input_subs.idx for input_subs.txt), and built again when the
+	size or modification time of the dump changed.
+	'''
+	stat = os.stat(fname)
+	stamp = str(stat.st_size) + '|' + str(stat.st_mtime_ns)
+	index_fname = os.path.splitext(fname)[0] + '.idx'
+	try:
+		with open(index_fname, encoding='utf8') as index_file:
+			if index_file.readline().rstrip('\n') == stamp:
+				index = {}
+				for line in index_file:
+					key, start, end = line.rstrip('\n').rsplit('|', 2)
+					index.setdefault(key, []).append((int(start), int(end)))
+				return index, False
+	except (OSError, ValueError):
+		pass # no index yet, or a broken one
+
+	index = index_dump(fname, num_fields, key_field)
+	try:
+		with open(index_fname, 'w', encoding='utf8') as index_file:
+			index_file.write(stamp + '\n')
+			for key, spans in index.items():
+				for start, end in spans:
+					index_file.write(key + '|' + str(start) + '|' + str(end) + '\n')
+	except OSError:
+		pass # the index is built again next time
+	return index, True
+
+def read_records(fname, num_fields, make_row, spans):
+	'''
+	Reads the records at the given (start, end) byte offsets of a dump
+	(see load_dump_index()) and returns a list of make_row(line_num,
+	record) for them, in the order of the file. The start offset is used
+	as line_num, so the records sort the same as in a full read.
+	'''
+	rows = []
+	with open(fname, 'rb') as dump:
+		for start, end in sorted(set(spans)):
+			dump.seek(start)
+			records, line_num, tail = join_records(dump.read(end - start).decode('utf8'), num_fields, make_row, start)
+			rows.extend(records)
+			if tail:
+				rows.append(make_row(line_num, '; '.join(tail)))
+	return rows
+
+def write_columnar(name, columnar_format):
+	'''
+	Copies the given pipe-delimited output (header line included) into
+	a Parquet or Arrow IPC file with the column types in columnar_types.
+	Empty values become nulls. Rows are written in row groups of about
+	rows_per_group rows, cut only where the WBSE (first column) changes.
+	'''
+	import pyarrow
+	import pyarrow.ipc
+	import pyarrow.parquet
+	arrow_types = {
+		'text': pyarrow.string(),
+		'number': pyarrow.float64(),
+		'integer': pyarrow.int32(),
+		'date': pyarrow.date32()
+	}
+	converters = {
+		'text': str,
+		'number': float,
+		'integer': int,
+		'date': lambda text: datetime.strptime(text, '%m/%d/%Y').date()
+	}
+	with open(name + '.txt', encoding='utf8') as outfile:
+		header = outfile.readline().rstrip('\n').split('|')
+		kinds = [columnar_types[os.path.basename(name)].get(col_name, 'text') for col_name in header]
+		schema = pyarrow.schema([(col_name, arrow_types[kind]) for col_name, kind in zip(header, kinds)])
+		if columnar_format == 'parquet':
+			writer = pyarrow.parquet.ParquetWriter(name + '.parquet', schema)
+		else:
+			writer = pyarrow.ipc.new_file(name + '.arrow', schema)
+		columns = [[] for col_name in header]
+		last_wbse = None
+		for line in outfile:
+			row = line.rstrip('\n').split('|')
+			if len(columns[0]) >= rows_per_group and row[0] != last_wbse:
+				writer.write_table(pyarrow.table(columns, schema=schema), len(columns[0]))
+				columns = [[] for col_name in header]
+			last_wbse = row[0]
+			row.extend([''] * (len(header) - len(row))) # subs have fewer values than headers
+			for column, kind, text in zip(columns, kinds, row):
+				column.append(converters[kind](text) if text else None)
+		if columns[0] or not last_wbse:
+			writer.write_table(pyarrow.table(columns, schema=schema), max(1, len(columns[0])))
+		writer.close()
+
+def period_layout(fiscal_year):
+	'''
+	Precomputes the budget periods of a sub for every possible number of
+	valid periods: item n of the returned list (1 to budget_periods) is a
+	list of tuples for the periods of a sub with n valid periods:
+	  (period number, fiscal period, fiscal year, latest, gather)
+	where fiscal period and year are texts for the outputs, latest tells
+	the latest period (fiscal period last_fiscal_period), and gather(sub)
+	returns the texts of the start date, end date, IDC rate and IDC
+	adjustment of the period, followed by its amounts in the order of
+	direct_gls and other_gls.
+	'''
+	fields = ['start', 'end', 'idc_rate', 'idc_adj'] + direct_categories + other_categories
+	layout = [[]]
+	for num_periods in range(1, budget_periods + 1):
+		first_period = last_fiscal_period + 1 - num_periods
+		periods = []
+		for i in range(num_periods):
+			gather = itemgetter(*[budget_columns[field] + i for field in fields])
+			periods.append((i + 1, str(first_period + i), str(fiscal_year), i == num_periods - 1, gather))
+		layout.append(periods)
+	return layout
+
+def invoice_line_items(inv):
+	'''
+	Accepts an invoice (split into fields) and returns a tuple of the list
+	of its line items in cents, in categories_list order, and its IDC rate
+	(in millionths) with the text it came from. IDC is the direct costs
+	times the IDC rate, rounded to cents, plus the IDC adjustment.
+	'''
+	texts = invoice_gather(inv)
+	idc_rate = text_to_rate(texts[0])
+	amounts = [text_to_cents(text) for text in texts[2:]]
+	idc = scale_down(sum(amounts[0:6]) * idc_rate, rate_scale) + text_to_cents(texts[1])
+	return amounts[0:6] + [idc] + amounts[6:], idc_rate, texts[0]
+
+def source_decimal(text):
+	'''
+	Accepts the text of an amount or rate field of a dump and returns it
+	as an exact Decimal (0 for a blank field). Used for the input side
+	of the reconciliation only, so that it doesn't share its arithmetic
+	with the outputs it checks.
+	'''
+	text = text.strip().strip('$').replace(',','')
+	if '(' in text:
+		text = '-' + text.strip('(').strip(')').strip('$')
+	if not text:
+		return Decimal(0)
+	try:
+		return Decimal(text)
+	except InvalidOperation:
+		raise ValueError('could not convert string to a number: ' + repr(text))
+
+def decimal_to_cents(value):
+	'''
+	Accepts a Decimal dollar amount and returns it in whole cents,
+	rounded half away from zero.
+	'''
+	return int(value.scaleb(2).quantize(Decimal(1), ROUND_HALF_UP))
+
+def source_line_totals(fields, columns, totals):
+	'''
+	Adds the line items of one budget period of a sub, or of an invoice,
+	to totals (budget category gl -> cents); columns maps the line item
+	fields (see budget_fields) to their columns in fields. IDC is the
+	direct costs (rounded to cents each) times the IDC rate, rounded to
+	cents, plus the IDC adjustment.
+	'''
+	direct = Decimal(0)
+	for category in direct_categories + other_categories:
+		cents = decimal_to_cents(source_decimal(fields[columns[category]]))
+		category_gl = budget_categories[category]
+		totals[category_gl] = totals.get(category_gl, 0) + cents
+		if category in direct_categories:
+			direct += Decimal(cents).scaleb(-2)
+	idc_rate = source_decimal(fields[columns['idc_rate']])
+	idc_adj = source_decimal(fields[columns['idc_adj']])
+	idc = decimal_to_cents(direct * idc_rate) + decimal_to_cents(idc_adj)
+	totals[idc_gl] = totals.get(idc_gl, 0) + idc
+
+def source_budget_totals(sub, num_periods):
+	'''
+	Accepts a sub (split into fields) and its number of valid periods,
+	and returns a dictionary of budget category gl -> total cents over
+	the periods, read from the budget columns of the sub itself (see
+	source_line_totals()).
+	'''
+	totals = {}
+	for i in range(num_periods):
+		columns = dict([(field, column + i) for field, column in budget_columns.items()])
+		source_line_totals(sub, columns, totals)
+	return totals
+
+def source_expense_totals(inv):
+	'''
+	Accepts an invoice (split into fields) and returns a dictionary of
+	budget category gl -> cents, read from the line item columns of the
+	invoice itself (see source_line_totals()).
+	'''
+	totals = {}
+	source_line_totals(inv, invoice_columns, totals)
+	return totals
+
+def add_to_reconciliation(totals, wbse, side, category_gl, input_amt=0, output_amt=0, adjustment_amt=0):
+	'''
+	Adds amounts (in cents) to the reconciliation totals, a dictionary
+	of (wbse, side, category gl) -> [input, output, adjustments].
+	'''
+	key = (wbse, side, category_gl)
+	if key not in totals:
+		totals[key] = [0, 0, 0]
+	entry = totals[key]
+	entry[0] += input_amt
+	entry[1] += output_amt
+	entry[2] += adjustment_amt
+
+def write_reconciliation(totals, fname):
+	'''
+	Writes the reconciliation totals that don't add up to the given
+	file, and returns their count. Output must equal input plus
+	adjustments.
+	'''
+	mismatches = 0
+	with open(fname, 'w', encoding='utf8') as report:
+		report.write('WBSE|Side|Category|Input|Output|Adjustments|Difference\n')
+		for (wbse, side, category_gl), (input_amt, output_amt, adjustment_amt) in sorted(totals.items()):
+			difference = output_amt - input_amt - adjustment_amt
+			if difference:
+				values = [input_amt, output_amt, adjustment_amt, difference]
+				report.write('|'.join([wbse, side, category_gl] + [cents_to_text(value) for value in values]) + '\n')
+				mismatches += 1
+	return mismatches
+
+class ConversionError(Exception):
+	'''
+	Raised when the inputs can't be converted; the message says why.
+	'''
+
+def read_zfr1e(fname):
+	'''
+	Returns the list of WBSEs in input_zfr1e.txt, one per line.
+	'''
+	with open(fname, encoding='utf8') as infile:
+		return [rec.strip() for rec in infile]
+
+def read_countries(fname):
+	'''
+	Returns a dictionary of subcontractor id -> SAP country code from
+	input_subs_countries.txt; the last line of an id wins.
+	'''
+	countries = {}
+	with open(fname, encoding='utf8') as infile:
+		for line in infile:
+			line = line.strip()
+			line = line.split()
+			countries[int(line[0])] = line[1]
+	return countries
+
+def read_budget_diffs(fname):
+	'''
+	Returns a dictionary of wbse -> (budget diff, database amount, SAP
+	amount) from input_budget_diffs.txt, all as text; the diff is the SAP
+	amount minus the database amount.
+	'''
+	budget_diffs = {}
+	with open(fname, encoding='utf8') as infile:
+		for line in infile:
+			line = line.strip()
+			line = line.split()
+			wbse_data = line[0].strip()
+			db_amt = text_to_cents(line[1])
+			sap_amt = text_to_cents(line[2])
+			diff_amt = cents_to_text(sap_amt - db_amt)
+			budget_diffs[wbse_data] = (diff_amt, line[1], line[2])
+	return budget_diffs
+
+def read_subs_list(fname):
+	'''
+	Returns the list of WBSEs in subs_include.txt or subs_exclude.txt.
+	'''
+	with open(fname, 'r', encoding='utf8') as infile:
+		return [sub.strip() for sub in infile]
+
+# reference tables: name -> (file, reader, required)
+reference_files = {
+	'zfr1e':        ('input_zfr1e.txt', read_zfr1e, True),
+	'countries':    ('input_subs_countries.txt', read_countries, True),
+	'budget_diffs': ('input_budget_diffs.txt', read_budget_diffs, True),
+	'subs_include': ('subs_include.txt', read_subs_list, False),
+	'subs_exclude': ('subs_exclude.txt', read_subs_list, False)
+}
+
+missing_inputs = ('Missing one or more of these input files:\n'
+	'input_subs.txt (or input_subs.xlsx), input_invs.txt, input_zfr1e.txt, input_subs_countries.txt, or input_budget_diffs.txt')
+
+def load_reference_tables(ref_dir='.', cache=None):
+	'''
+	Reads the reference tables (see reference_files) from the files in
+	ref_dir, and returns a tuple of a dictionary of name -> table (None
+	for an optional file that doesn't exist) and the list of names of
+	the tables read.
+
+	A cache is a dictionary kept between calls by a program that converts
+	more than once (see conversion_service.py): a table is then read again
+	only when the size or modification time of its file changed.
+	'''
+	if cache is None:
+		cache = {}
+	tables = {}
+	reloaded = []
+	for name, (fname, reader, required) in reference_files.items():
+		path = os.path.join(ref_dir, fname)
+		try:
+			stat = os.stat(path)
+			stamp = (stat.st_size, stat.st_mtime_ns)
+		except OSError:
+			if required:
+				raise ConversionError(missing_inputs)
+			stamp = None
+		if name not in cache or cache[name][0] != stamp:
+			cache[name] = (stamp, reader(path) if stamp else None)
+			reloaded.append(name)
+		tables[name] = cache[name][1]
+	return tables, reloaded
+
+# names of the lookups databases in memory (see open_lookups())
+lookups_numbers = itertools.count()
+
+def open_lookups(tables):
+	'''
+	Loads the zfr1e and countries reference tables into a new SQLite
+	database in memory, keyed (and so indexed) by wbse and subtor id,
+	and returns a tuple of the connection and the name to attach the
+	database by. The database lasts as long as the connection is open,
+	so a program that converts more than once (see conversion_service.py)
+	can keep it between conversions.
+	'''
+	name = 'file:lookups' + str(next(lookups_numbers)) + '?mode=memory&cache=shared'
+	lookups = sqlite3.connect(name, uri=True)
+	lookups.executescript('''
+		CREATE TABLE zfr1e (wbse TEXT PRIMARY KEY);
+		CREATE TABLE countries (subtor_id INTEGER PRIMARY KEY, country TEXT);
+	''')
+	lookups.executemany('INSERT OR IGNORE INTO zfr1e VALUES (?)', [(wbse,) for wbse in tables['zfr1e']])
+	lookups.executemany('INSERT OR REPLACE INTO countries VALUES (?, ?)', tables['countries'].items())
+	lookups.commit()
+	return lookups, name
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(
+		prog='conversion.py',
+		description='Converts subawards and invoices from the OSP database dumps for upload into SAP.')
+	parser.add_argument('--columnar', choices=['parquet', 'arrow'],
+		help='also write the outputs as Parquet or Arrow IPC files with typed columns')
+	parser.add_argument('--wbse', nargs='+', metavar='WBSE',
+		help='convert only the subs with these WBSEs, reading them and their invoices '
+			'straight from their places in the dumps')
+	parser.add_argument('--fiscal-year', type=int, default=2017,
+		help='fiscal year of the budget periods in the outputs (default 2017)')
+	parser.add_argument('--diagnostics', choices=['row', 'bulk', 'off'], default='row',
+		help='check dates and ignored periods for log.txt on every row (default), '
+			'in one pass after converting, or not at all')
+	return parser.parse_args(argv)
+
 def get_gl_bucket(gl_break, prior_exp, this_amt):
 	'''
 	Determines which GL bucket this_amt belongs to:
@@ -269,689 +1143,655 @@ def get_gl_bucket(gl_break, prior_exp, this_amt):
 		gl_bucket = 3
 	return gl_bucket
 
-to_print = 'Reading subaward records...'
-print(to_print, end='')
-raw_subs = input_subs.readlines()
-count = len(raw_subs)
-print(padded_text(count, len(to_print)))
-
-to_print = 'Reading invoice records...'
-print(to_print, end='')
-raw_invs = input_invs.readlines()
-count = len(raw_invs)
-print(padded_text(count, len(to_print)))
-
-to_print = 'Reading zfr1e records...'
-print(to_print, end='')
-raw_zfr1e_recs = input_zfr1e.readlines()
-zfr1e_recs = []
-for rec in raw_zfr1e_recs:
-	rec = rec.strip()
-	zfr1e_recs.append(rec)
-count = len(zfr1e_recs)
-print(padded_text(count, len(to_print)))
-# cleanup
-del raw_zfr1e_recs
-
-to_print = 'Reading subaward country data...'
-print(to_print, end='')
-raw_lines = input_subs_countries.readlines()
-subs_countries = {}
-for line in raw_lines:
-	line = line.strip()
-	line = line.split()
-	subs_countries[int(line[0])] = line[1]
-count = len(subs_countries)
-print(padded_text(count, len(to_print)))
-# cleanup
-del raw_lines
-
-to_print = 'Reading budget diffs data...'
-print(to_print, end='')
-raw_lines = input_budget_diffs.readlines()
-budget_diffs = {}
-for line in raw_lines:
-	line = line.strip()
-	line = line.split()
-	wbse_data = line[0].strip()
-	db_amt = text_to_float(line[1])
-	sap_amt = text_to_float(line[2])
-	diff_amt = str(round((sap_amt - db_amt), 2))
-	budget_diffs[wbse_data] = diff_amt
-count = len(budget_diffs)
-print(padded_text(count, len(to_print)))
-# cleanup
-del raw_lines
-
-# check that sub records have correct number of fields (96)
-to_print = 'Checking subawards...'
-print(to_print, end='')
-for sub in raw_subs:
-	sub = sub.strip()
-	sub = sub.split('|')
-	if len(sub) != 96:
-		print(padded_text('Errors found', len(to_print)))
-		print('Sub id', sub[0], 'has odd number of fields:', len(sub))
-		print('-' * 51); print('Program terminated early'); print('-' * 51)
-		exit()
-print(padded_text('OK', len(to_print)))
+def convert(tables, columnar=None, diagnostics='row', work_dir='.', wbses=None, fiscal_year=2017, lookups=None):
+	'''
+	Converts the dumps in work_dir (input_subs.txt or input_subs.xlsx,
+	and input_invs.txt) with the given reference tables (see
+	load_reference_tables()) and writes the outputs, log.txt and
+	staging.db there. columnar, diagnostics and fiscal_year are the
+	command line options of the same names. With a list of wbses, only those subs
+	are converted (after the include/exclude lists). lookups is the
+	database of zfr1e and countries made from the same tables by
+	open_lookups(); without it, one is made for this conversion.
+
+	Returns a dictionary of the counts of records written, or raises
+	ConversionError if the inputs can't be converted.
+	'''
+	def path(fname):
+		return os.path.join(work_dir, fname)
 
-# check that inv records have correct number of fields (35)
-to_print = 'Checking invoices...'
-print(to_print, end='')
-for inv in raw_invs:
-	inv = inv.strip()
-	inv = inv.split('|')
-	if len(inv) != 35:
-		print(padded_text('Errors found', len(to_print)))
-		print('Invoice id', inv[0], 'has odd number of fields: ', len(inv))
-		print('-' * 51); print('Program terminated early'); print('-' * 51)
-		exit()
-print(padded_text('OK', len(to_print)))
-
-# cleanup subs that are outside the 2000000-3999999 range
-to_print = 'Removing unneeded subs...'
-print(to_print, end='')
-i = 0
-cleaner_subs = []
-remaining_sub_ids = []
-for sub in raw_subs:
-	raw_sub = sub # remember the raw version
-	sub = sub.strip()
-	sub = sub.split('|')
-	wbse_first_char = int(sub[1][0:1])
-	if wbse_first_char < 2 or wbse_first_char > 3:
-		i += 1
-	else:
-		remaining_sub_ids.append(sub[0])
-		cleaner_subs.append(raw_sub)
-print(padded_text(i, len(to_print)))
-# cleanup
-subs = cleaner_subs
-del cleaner_subs
-del raw_subs
-
-to_print = 'Removing unneeded invoices...'
-print(to_print, end='')
-i = 0
-clean_invs = []
-for inv in raw_invs:
-	raw_inv = inv.strip()
-	inv = inv.strip()
-	inv = inv.split('|')
-	sub_id = inv[1]
-	if sub_id in remaining_sub_ids:
-		clean_invs.append(raw_inv)
-	else:
-		i += 1
-print(padded_text(i, len(to_print)))
-# cleanup
-invs = clean_invs
-del clean_invs
-del raw_invs
-del remaining_sub_ids
-
-# check for include/exclude list:
-#   if include list exists, only include those subs in the output
-#   if exclude list exists, exclude those subs
-if subs_include:
-
-	subs_include = subs_include.readlines()
-	clean_subs_include = []
-	for sub in subs_include:
-		sub = sub.strip()
-		clean_subs_include.append(sub)
-	# cleanup
-	subs_include = clean_subs_include
-	del clean_subs_include
-
-	to_print = 'Subs to include exclusively...'
-	print(to_print, end='')
-	print(padded_text(len(subs_include), len(to_print)))
-
-	clean_subs = []
-	sub_ids = []
-	for sub in subs:
-		sub = sub.split('|')
-		if sub[1] in subs_include:
-			sub_ids.append(sub[0])
-			sub = '|'.join(sub)
-			clean_subs.append(sub)
-	# cleanup
-	subs = clean_subs
-	del clean_subs
-
-	clean_invs = []
-	for inv in invs:
-		inv = inv.split('|')
-		if inv[1] in sub_ids:
-			inv = '|'.join(inv)
-			clean_invs.append(inv)
-	# cleanup
-	invs = clean_invs
-	del clean_invs
-
-elif subs_exclude:
-
-	subs_exclude = subs_exclude.readlines()
-	clean_subs_exclude = []
-	for sub in subs_exclude:
-		sub = sub.strip()
-		clean_subs_exclude.append(sub)
-	# cleanup
-	subs_exclude = clean_subs_exclude
-	del clean_subs_exclude
-
-	to_print = 'Subs to exclude...'
-	print(to_print, end='')
-	print(padded_text(len(subs_exclude), len(to_print)))
-
-	clean_subs = []
-	sub_ids = []
-	for sub in subs:
-		sub = sub.split('|')
-		if not sub[1] in subs_exclude:
-			sub_ids.append(sub[0])
-			sub = '|'.join(sub)
-			clean_subs.append(sub)
-	# cleanup
-	subs = clean_subs
-	del clean_subs
-
-	clean_invs = []
-	for inv in invs:
-		inv = inv.split('|')
-		if inv[1] in sub_ids:
-			inv = '|'.join(inv)
-			clean_invs.append(inv)
-	# cleanup
-	invs = clean_invs
-	del clean_invs
-
-to_print = 'Fixing period start dates...'
-print(to_print, end='')
-i = 0
-num_periods = 0
-clean_subs = []
-dropped_subs = []
-for sub in subs:
-	wbse, valid_periods, updated_sub = check_budget_periods(sub)
-	if valid_periods:
-		clean_subs.append(updated_sub)
-		i += 1
-	else:
-		dropped_subs.append(sub)
-		log_file.write('Sub wbse=' + wbse + ' dropped for not having any valid periods\n')
-print(padded_text(i, len(to_print	)))
-to_print = 'Subs dropped for not having valid periods...'
-print(to_print, end='')
-print(padded_text(len(dropped_subs), len(to_print)))
-# cleanup
-subs = clean_subs
-del clean_subs
-del dropped_subs
-
-# remove inactive subs (end date < 7/1/2015)
-to_print = 'Removing inactive subs...'
-print(to_print, end='')
-i = 0
-clean_subs = []
-remaining_sub_ids = []
-for sub in subs:
-	raw_sub = sub # remember the raw version
-	sub = sub.strip()
-	sub = sub.split('|')
-	index = 29 + int(sub[96])
-	last_per_end = sub[index][0:10]
-	last_per_end = datetime.strptime(last_per_end, '%m/%d/%Y')
-	if last_per_end < datetime(year=2015, month=7, day=1):
-		i += 1
-	else:
-		remaining_sub_ids.append(sub[0])
-		clean_subs.append(raw_sub)
-print(padded_text(i, len(to_print)))
-# cleanup
-subs = clean_subs
-del clean_subs
-
-to_print = 'Removing inactive invoices...'
-print(to_print, end='')
-i = 0
-clean_invs = []
-for inv in invs:
-	raw_inv = inv.strip()
-	inv = inv.strip()
-	inv = inv.split('|')
-	sub_id = inv[1]
-	if sub_id in remaining_sub_ids:
-		clean_invs.append(raw_inv)
-	else:
-		i += 1
-print(padded_text(i, len(to_print)))
-# cleanup
-invs = clean_invs
-del clean_invs
-del remaining_sub_ids
-
-to_print = 'Updating subs with zfr1e data...'
-print(to_print, end='')
-upd_subs = []
-for sub in subs:
-	raw_sub = sub.strip()
-	sub = raw_sub.split('|')
-	if sub[1] in zfr1e_recs:
-		upd_subs.append(raw_sub + '|ADJ')
-	else:
-		upd_subs.append(raw_sub + '|DB')
-print(padded_text('OK', len(to_print)))
-# cleanup
-subs = upd_subs
-del upd_subs
-del zfr1e_recs
-
-to_print = 'Updating subs with correct country codes...'
-print(to_print, end='')
-upd_subs = []
-for sub in subs:
-	raw_sub = sub.strip()
-	sub = raw_sub.split('|')
-	subtor_id = int(sub[2])
-	country_code = subs_countries.get(subtor_id, 'US') # default is US
-	sub[21] = country_code
-	sub = '|'.join(sub)
-	upd_subs.append(sub)
-print(padded_text('OK', len(to_print)))
-# cleanup
-subs = upd_subs
-del upd_subs
-
-to_print ='Sorting subs by wbse value...'
-print(to_print, end='')
-temp_subs = []
-for sub in subs:
-	sub = sub.split('|')
-	temp_subs.append(sub)
-temp_subs.sort(key=itemgetter(1))  # sort by wbse/fund code
-subs = []
-for sub in temp_subs:
-	sub = '|'.join(sub)
-	subs.append(sub)
-print(padded_text('OK', len(to_print)))
-
-to_print = 'Number of subs to convert:'; print(to_print, end='')
-print(padded_text(len(subs), len(to_print)))
-to_print = 'Number of invoices to convert:'; print(to_print, end='')
-print(padded_text(len(invs), len(to_print)))
-
-output1_count = 0
-output2_count = 0
-output3_count = 0
-output4_count = 0
-subs_dropped_for_zero_budgets = 0
-subs_fixed_with_dollar_adds = 0
-invs_with_zero_total = 0
-
-# write file headers
-header_subs = 'WBSE|State|Country|Subaward Number|FFATA|Final Invoice Due|G/L Break|Prior Year WBSE|OSP Notes|IDC Default|Received Date|Subrecipient PI Name|Manual Prior Exp|Type of Subaward|Type of Payment|Invoice Requirements|Equipment|Budgetary Changes|Budget Restrictions|Special T&C'
-header_subs_details = 'WBSE|Fiscal Period|Fiscal Year|Budget Period Start|Budget Period End|Amount|Category|IDC Rate'
-header_invs = 'WBSE|Invoice #|AP Check Request #|Received Date|Final|Treat as Final|Initially Accurate|Vendor|Wire or Draft|Notes|Start Date|End Date|OSP Invoice Type|IDC Rate'
-header_invs_details = 'WBSE|Invoice Number|Amount|Cost Element'
-outfile_subs.write(header_subs + '\n')
-outfile_subs_details.write(header_subs_details + '\n')
-outfile_invs.write(header_invs + '\n')
-outfile_invs_details.write(header_invs_details + '\n')
-
-for sub in subs:
-
-	out_subs = []
-	sub = sub.strip()
-	sub = sub.split('|')
+	# clean out any old files
+	try: os.remove(path('log.txt'))
+	except OSError: pass
 
-	out_subs.append(sub[1].strip())      # wbse
-	out_subs.append('') 						     # skip row (used to be state)
-	# out_subs.append(sub[20].strip())   # state
-	out_subs.append(sub[21].strip())     # country
-	out_subs.append(sub[5].strip())      # subaward number
-	out_subs.append(sub[6].strip())      # ffata
-	out_subs.append(sub[9].strip())      # final invoice due
-	gl_break = text_to_float(sub[14])
-	out_subs.append(str(gl_break))       # gl break
-	out_subs.append('') 						     # skip row (used to be prior year wbse)
-	# out_subs.append(sub[11].strip())   # prior year wbse
-	out_subs.append(sub[10].strip())     # osp notes
-	out_subs.append('X') 						     # idc default (always X)
-	current_date = datetime.now()
-	current_date = current_date.strftime('%m/%d/%Y')
-	out_subs.append(current_date) 	     # received date (use current date)
-	out_subs.append('') 						     # skip row
-	prior_exp = text_to_float(sub[13])
-	out_subs.append(str(prior_exp))      # manual prior exp
-
-	out_sub = '|'.join(out_subs)
-	# actual write to output happens after looping through budget periods. 
-
-	# the most recent budget period should be 9, one prior to it - 8, etc.
-	num_periods = int(sub[96])
-	first_period = 10 - num_periods
-
-	# go through each valid budget period and collect line items for each. 
-	# if line items have values - write the period to the output file, 
-	# and conversely, if no values in any line items - skip that period.
-	non_zero_periods_exist = 0
-
-	used_budget_categories = set() # to keep track of which categories are used
-
-	for i in range(0, num_periods):
-
-		wbse = sub[1].strip()
-		fisc_per = str(first_period + i)
-		fisc_yr = str(2017)
-		start = sub[24 + i].strip()[0:10]
-		if not is_date_reasonable(text_to_date(start)):
-			log_file.write('Sub wbse=' + wbse + ' has an unreasonable Start date: ' + start + '\n')
-		end = sub[30 + i].strip()[0:10]
-		if not is_date_reasonable(text_to_date(end)):
-			log_file.write('Sub wbse=' + wbse + ' has an unreasonable End date: ' + end + '\n')
-		idc_rate = sub[72 + i]
-		idc_rate = text_to_float(idc_rate)
-		idc_adj_amt = sub[78 + i]
-		idc_adj_amt = text_to_float(idc_adj_amt)
-		idc_rate_reformatted = str(round((idc_rate * 100), 2))
+	try: os.remove(path('output_subs.txt'))
+	except OSError: pass
 
-		# check if end date is greater than start date; make a log entry if true
-		dates_diff = text_to_date(end) - text_to_date(start)
-		if dates_diff <= timedelta(days = 0):
-			log_file.write('Sub wbse=' + wbse + ' has start date >= end date in period ' + str(i+1) + ' but will still be migrated\n')
-
-		line_items = []
-
-		# salary
-		salary = sub[36 + i]
-		salary = text_to_float(salary)
-		if salary:
-			category_amt = str(salary)
-			category_gl = budget_categories['salary']
-			line_items.append((category_amt, category_gl))
-			used_budget_categories.add(category_gl)
-		
-		# fringe
-		fringe = sub[42 + i]
-		fringe = text_to_float(fringe)
-		if fringe:
-			category_amt = str(fringe)
-			category_gl = budget_categories['fringe']
-			line_items.append((category_amt, category_gl))
-			used_budget_categories.add(category_gl)
-
-		# supplies
-		supplies = sub[48 + i]
-		supplies = text_to_float(supplies)
-		if supplies:
-			category_amt = str(supplies)
-			category_gl = budget_categories['supplies']
-			line_items.append((category_amt, category_gl))
-			used_budget_categories.add(category_gl)
-
-		# travel
-		travel = sub[54 + i]
-		travel = text_to_float(travel)
-		if travel:
-			category_amt = str(travel)
-			category_gl = budget_categories['travel']
-			line_items.append((category_amt, category_gl))
-			used_budget_categories.add(category_gl)
-
-		# consulting
-		consulting = sub[60 + i]
-		consulting = text_to_float(consulting)
-		if consulting:
-			category_amt = str(consulting)
-			category_gl = budget_categories['consulting']
-			line_items.append((category_amt, category_gl))
-			used_budget_categories.add(category_gl)
-
-		# odc (other direct cost)
-		odc = sub[66 + i]
-		odc = text_to_float(odc)
-		if odc:
-			category_amt = str(odc)
-			category_gl = budget_categories['odc']
-			line_items.append((category_amt, category_gl))
-			used_budget_categories.add(category_gl)
-
-		# idc (indirect cost)
-		if idc_rate or idc_adj_amt:
-			direct_cost =  sum([float(item[0]) for item in line_items])
-			idc = direct_cost * idc_rate + idc_adj_amt
-			idc = str(round(idc, 2))
-			category_gl = budget_categories['idc']
-			line_items.append((idc, category_gl))
-
-		# equipment
-		equipment = sub[84 + i]
-		equipment = text_to_float(equipment)
-		if equipment:
-			category_amt = str(equipment)
-			category_gl = budget_categories['equipment']
-			line_items.append((category_amt, category_gl))
-			used_budget_categories.add(category_gl)
-
-		# misc
-		misc = sub[90 + i]
-		misc = text_to_float(misc)
-		if misc:
-			category_amt = str(misc)
-			category_gl = budget_categories['misc']
-			line_items.append((category_amt, category_gl))
-			used_budget_categories.add(category_gl)
-
-		# write to file
-		for amount, category_gl in line_items:
-			non_zero_periods_exist += 1
-			sub_detail = [wbse, fisc_per, fisc_yr, start, end, amount, category_gl, idc_rate_reformatted]
-			sub_detail = '|'.join(sub_detail)
-			outfile_subs_details.write(sub_detail + '\n')
-			output2_count += 1
+	try: os.remove(path('output_subs_details.txt'))
+	except OSError: pass
+
+	try: os.remove(path('output_invs.txt'))
+	except OSError: pass
+
+	try: os.remove(path('output_invs_details.txt'))
+	except OSError: pass
+
+	try: os.remove(path('output_subs.xlsx'))
+	except OSError: pass
+
+	try: os.remove(path('staging.db'))
+	except OSError: pass
+
+	try: os.remove(path('reconciliation.txt'))
+	except OSError: pass
+
+	for name in ['output_subs', 'output_subs_details', 'output_invs', 'output_invs_details']:
+		for ext in ['.parquet', '.arrow']:
+			try: os.remove(path(name + ext))
+			except OSError: pass
+
+	# pyarrow is only needed for the columnar outputs (see write_columnar())
+	if columnar and importlib.util.find_spec('pyarrow') is None:
+		raise ConversionError('Option --columnar needs the pyarrow package')
+
+	# the Excel workbook, if there is one, takes the place of the text dump
+	if os.path.exists(path('input_subs.xlsx')):
+		input_subs_fname = path('input_subs.xlsx')
+		try:
+			import openpyxl # only needed for the Excel workbooks
+		except ImportError:
+			raise ConversionError('Reading input_subs.xlsx needs the openpyxl package')
+	else:
+		input_subs_fname = path('input_subs.txt')
+
+	for input_fname in [input_subs_fname, path('input_invs.txt')]:
+		if not os.path.exists(input_fname):
+			raise ConversionError(missing_inputs)
+
+	# open needed files; all of them are closed in the end, also when the
+	# conversion fails (a job of conversion_service.py may be followed by others)
+	opened = []
+	try:
+		if input_subs_fname.endswith('.xlsx'):
+			input_subs = openpyxl.load_workbook(input_subs_fname, read_only=True, data_only=True)
+			opened.append(input_subs)
+
+		if lookups is None:
+			lookups = open_lookups(tables)
+			opened.append(lookups[0])
+
+		# the staging database is thrown away after each run, so skip the rollback journal;
+		# zfr1e and countries are in the lookups database attached to it
+		staging = sqlite3.connect(path('staging.db'), uri=True)
+		opened.append(staging)
+		staging.executescript('''
+			PRAGMA journal_mode = OFF;
+			PRAGMA synchronous = OFF;
+			CREATE TABLE subs (line INTEGER PRIMARY KEY, id TEXT, wbse TEXT, subtor_id TEXT,
+				num_fields INTEGER, record TEXT, num_periods INTEGER, last_end TEXT);
+			CREATE TABLE invs (line INTEGER PRIMARY KEY, id TEXT, sub_id TEXT, end_date TEXT,
+				num_fields INTEGER, record TEXT);
+			CREATE TABLE subs_list (wbse TEXT PRIMARY KEY);
+			CREATE TABLE wbse_subset (wbse TEXT PRIMARY KEY);
+		''')
+		staging.execute('ATTACH DATABASE ? AS lookups', (lookups[1],))
+
+		log_file = open(path('log.txt'), 'a', encoding='utf8')
+		opened.append(log_file)
+		log_file.write('----- Start: ' + str(datetime.now()) + ' -----\n')
+
+		# diagnostic checks (see diagnose()) are either done right away, kept
+		# for the bulk validation pass at the end, or skipped; their dates are
+		# checked right away in any case, before the record is written
+		checks = []
+		to_date = date_reader()
+		def report(check):
+			check_dates(check, to_date)
+			if diagnostics == 'row':
+				log_file.write(''.join(diagnose(check, to_date)))
+			elif diagnostics == 'bulk':
+				checks.append(check)
+
+		outfile_subs = open(path('output_subs.txt'), 'a', encoding='utf8')
+		outfile_subs_details = open(path('output_subs_details.txt'), 'a', encoding='utf8')
+		outfile_invs = open(path('output_invs.txt'), 'a', encoding='utf8')
+		outfile_invs_details = open(path('output_invs_details.txt'), 'a', encoding='utf8')
+		opened.extend([outfile_subs, outfile_subs_details, outfile_invs, outfile_invs_details])
+		subs_include = tables['subs_include']
+		subs_exclude = tables['subs_exclude']
+
+		# for a list of wbses, only those subs and their invoices are read,
+		# using the byte offsets in the indexes of the dumps
+		if wbses and not input_subs_fname.endswith('.xlsx'):
+			to_print = 'Reading indexes of the dumps...'
+			print(to_print, end='')
+			subs_index, subs_built = load_dump_index(input_subs_fname, sub_num_fields, 1)
+			invs_index, invs_built = load_dump_index(path('input_invs.txt'), 35, 1)
+			print(padded_text('Built' if subs_built or invs_built else 'OK', len(to_print)))
 		else:
-			# add one last record in period 9 if budget diff exists
-			# also, store some values for a later use (to add/subtract $1) 
-			if fisc_per == '9':
-				last_wbse = wbse
-				last_fisc_per = fisc_per
-				last_fisc_yr = fisc_yr
-				last_start = start
-				last_end = end
-				last_idc_rate_reformatted = idc_rate_reformatted
-				if wbse in budget_diffs:
-					amount = budget_diffs[wbse]
-					category_gl = '099650'
-					sub_detail = [wbse, fisc_per, fisc_yr, start, end, amount, category_gl, idc_rate_reformatted]
+			subs_index = None
+
+		to_print = 'Reading subaward records...'
+		print(to_print, end='')
+		if input_subs_fname.endswith('.xlsx'):
+			try:
+				raw_subs = list(read_source_sheet(input_subs))
+			except (KeyError, ValueError) as error:
+				print(padded_text('Errors found', len(to_print)))
+				raise ConversionError('input_subs.xlsx: ' + str(error))
+			input_subs.close()
+			raw_subs = [staging_sub(line_num, sub) for line_num, sub in enumerate(raw_subs)]
+		elif subs_index is not None:
+			spans = [span for wbse in wbses for span in subs_index.get(wbse.strip(), [])]
+			raw_subs = read_records(input_subs_fname, sub_num_fields, staging_sub, spans)
+		else:
+			raw_subs = read_dump(input_subs_fname, sub_num_fields, staging_sub)
+		staging.executemany('INSERT INTO subs VALUES (?, ?, ?, ?, ?, ?, NULL, NULL)', raw_subs)
+		count = staging.execute('SELECT COUNT(*) FROM subs').fetchone()[0]
+		print(padded_text(count, len(to_print)))
+		# cleanup
+		del raw_subs
+
+		to_print = 'Reading invoice records...'
+		print(to_print, end='')
+		if subs_index is not None:
+			spans = [span for sub_id, in staging.execute('SELECT id FROM subs') for span in invs_index.get(sub_id, [])]
+			raw_invs = read_records(path('input_invs.txt'), 35, staging_inv, spans)
+		else:
+			raw_invs = read_dump(path('input_invs.txt'), 35, staging_inv)
+		staging.executemany('INSERT INTO invs VALUES (?, ?, ?, ?, ?, ?)', raw_invs)
+		count = staging.execute('SELECT COUNT(*) FROM invs').fetchone()[0]
+		print(padded_text(count, len(to_print)))
+		# cleanup
+		del raw_invs
+
+		# the reference tables are already read (see load_reference_tables()),
+		# and zfr1e and countries are loaded into the lookups database
+		to_print = 'Reading zfr1e records...'
+		print(to_print, end='')
+		print(padded_text(len(tables['zfr1e']), len(to_print)))
+
+		to_print = 'Reading subaward country data...'
+		print(to_print, end='')
+		count = staging.execute('SELECT COUNT(*) FROM lookups.countries').fetchone()[0]
+		print(padded_text(count, len(to_print)))
+
+		to_print = 'Reading budget diffs data...'
+		print(to_print, end='')
+		budget_diffs = tables['budget_diffs']
+		print(padded_text(len(budget_diffs), len(to_print)))
+
+		# indexes are built after loading, which is faster than keeping them up to date
+		staging.executescript('''
+			CREATE INDEX subs_id ON subs (id);
+			CREATE INDEX subs_wbse ON subs (wbse);
+			CREATE INDEX invs_sub_id ON invs (sub_id, end_date);
+		''')
+
+		# check that sub records have correct number of fields (96)
+		to_print = 'Checking subawards...'
+		print(to_print, end='')
+		for sub_id, num_fields in staging.execute('SELECT id, num_fields FROM subs WHERE num_fields != ? ORDER BY line LIMIT 1', (sub_num_fields,)):
+			print(padded_text('Errors found', len(to_print)))
+			raise ConversionError('Sub id ' + str(sub_id) + ' has odd number of fields: ' + str(num_fields))
+		print(padded_text('OK', len(to_print)))
+
+		# check that inv records have correct number of fields (35)
+		to_print = 'Checking invoices...'
+		print(to_print, end='')
+		for inv_id, num_fields in staging.execute('SELECT id, num_fields FROM invs WHERE num_fields != 35 ORDER BY line LIMIT 1'):
+			print(padded_text('Errors found', len(to_print)))
+			raise ConversionError('Invoice id ' + str(inv_id) + ' has odd number of fields:  ' + str(num_fields))
+		print(padded_text('OK', len(to_print)))
+
+		# cleanup subs that are outside the 2000000-3999999 range
+		to_print = 'Removing unneeded subs...'
+		print(to_print, end='')
+		i = staging.execute('DELETE FROM subs WHERE substr(wbse, 1, 1) NOT IN (\'2\', \'3\')').rowcount
+		print(padded_text(i, len(to_print)))
+
+		to_print = 'Removing unneeded invoices...'
+		print(to_print, end='')
+		i = staging.execute('DELETE FROM invs WHERE sub_id NOT IN (SELECT id FROM subs)').rowcount
+		print(padded_text(i, len(to_print)))
+
+		# check for include/exclude list:
+		#   if include list exists, only include those subs in the output
+		#   if exclude list exists, exclude those subs
+		if subs_include is not None or subs_exclude is not None:
+
+			subs_list = subs_include if subs_include is not None else subs_exclude
+			staging.executemany('INSERT OR IGNORE INTO subs_list VALUES (?)', [(sub,) for sub in subs_list])
+			count = len(subs_list)
+
+			if subs_include is not None:
+				to_print = 'Subs to include exclusively...'
+				staging.execute('DELETE FROM subs WHERE wbse NOT IN (SELECT wbse FROM subs_list)')
+			else:
+				to_print = 'Subs to exclude...'
+				staging.execute('DELETE FROM subs WHERE wbse IN (SELECT wbse FROM subs_list)')
+			print(to_print, end='')
+			print(padded_text(count, len(to_print)))
+
+			staging.execute('DELETE FROM invs WHERE sub_id NOT IN (SELECT id FROM subs)')
+
+		# only the requested subs (option --wbse, or a job of conversion_service.py)
+		if wbses:
+			staging.executemany('INSERT OR IGNORE INTO wbse_subset VALUES (?)', [(wbse.strip(),) for wbse in wbses])
+			staging.execute('DELETE FROM subs WHERE wbse NOT IN (SELECT wbse FROM wbse_subset)')
+			staging.execute('DELETE FROM invs WHERE sub_id NOT IN (SELECT id FROM subs)')
+			to_print = 'Subs requested...'; print(to_print, end='')
+			print(padded_text(len(wbses), len(to_print)))
+
+		to_print = 'Fixing period start dates...'
+		print(to_print, end='')
+		i = 0
+		dropped_subs = 0
+		for line_num, sub in staging.execute('SELECT line, record FROM subs ORDER BY line').fetchall():
+			wbse, valid_periods, updated_sub = check_budget_periods(sub, report)
+			if valid_periods:
+				# remember the last period end date (as yyyy-mm-dd) for the next step
+				last_per_end = updated_sub.split('|')[budget_columns['end'] - 1 + valid_periods][0:10]
+				last_per_end = datetime.strptime(last_per_end, '%m/%d/%Y').strftime('%Y-%m-%d')
+				staging.execute('UPDATE subs SET record = ?, num_periods = ?, last_end = ? WHERE line = ?',
+					(updated_sub, valid_periods, last_per_end, line_num))
+				i += 1
+			else:
+				staging.execute('DELETE FROM subs WHERE line = ?', (line_num,))
+				dropped_subs += 1
+				log_file.write('Sub wbse=' + wbse + ' dropped for not having any valid periods\n')
+		print(padded_text(i, len(to_print	)))
+		to_print = 'Subs dropped for not having valid periods...'
+		print(to_print, end='')
+		print(padded_text(dropped_subs, len(to_print)))
+
+		# remove inactive subs (end date < 7/1/2015)
+		to_print = 'Removing inactive subs...'
+		print(to_print, end='')
+		i = staging.execute('DELETE FROM subs WHERE last_end < \'2015-07-01\'').rowcount
+		print(padded_text(i, len(to_print)))
+
+		to_print = 'Removing inactive invoices...'
+		print(to_print, end='')
+		i = staging.execute('DELETE FROM invs WHERE sub_id NOT IN (SELECT id FROM subs)').rowcount
+		print(padded_text(i, len(to_print)))
+		staging.commit()
+
+		# zfr1e data drives the invoice type (DB or ADJ), and subs without
+		# a known country get US; the sort is by wbse, then by the order in the dump
+		to_print = 'Joining zfr1e and country data, sorting...'
+		print(to_print, end='')
+		subs = []
+		for sub, in_zfr1e, country_code in staging.execute('''
+				SELECT subs.record, zfr1e.wbse IS NOT NULL, coalesce(countries.country, 'US')
+				FROM subs
+				LEFT JOIN zfr1e ON zfr1e.wbse = subs.wbse
+				LEFT JOIN countries ON countries.subtor_id = CAST(subs.subtor_id AS INTEGER)
+				ORDER BY subs.wbse, subs.line'''):
+			sub = sub.split('|')
+			sub[21] = country_code
+			sub.append('ADJ' if in_zfr1e else 'DB')
+			sub = '|'.join(sub)
+			subs.append(sub)
+		print(padded_text('OK', len(to_print)))
+
+		layout = period_layout(fiscal_year)
+
+		to_print = 'Number of subs to convert:'; print(to_print, end='')
+		print(padded_text(len(subs), len(to_print)))
+		to_print = 'Number of invoices to convert:'; print(to_print, end='')
+		print(padded_text(staging.execute('SELECT COUNT(*) FROM invs').fetchone()[0], len(to_print)))
+
+		output1_count = 0
+		output2_count = 0
+		output3_count = 0
+		output4_count = 0
+		subs_dropped_for_zero_budgets = 0
+		subs_fixed_with_dollar_adds = 0
+		invs_with_zero_total = 0
+		reconciliation = {}
+
+		# write file headers
+		header_subs = 'WBSE|State|Country|Subaward Number|FFATA|Final Invoice Due|G/L Break|Prior Year WBSE|OSP Notes|IDC Default|Received Date|Subrecipient PI Name|Manual Prior Exp|Type of Subaward|Type of Payment|Invoice Requirements|Equipment|Budgetary Changes|Budget Restrictions|Special T&C'
+		header_subs_details = 'WBSE|Fiscal Period|Fiscal Year|Budget Period Start|Budget Period End|Amount|Category|IDC Rate'
+		header_invs = 'WBSE|Invoice #|AP Check Request #|Received Date|Final|Treat as Final|Initially Accurate|Vendor|Wire or Draft|Notes|Start Date|End Date|OSP Invoice Type|IDC Rate'
+		header_invs_details = 'WBSE|Invoice Number|Amount|Cost Element'
+		outfile_subs.write(header_subs + '\n')
+		outfile_subs_details.write(header_subs_details + '\n')
+		outfile_invs.write(header_invs + '\n')
+		outfile_invs_details.write(header_invs_details + '\n')
+
+		for sub in subs:
+
+			out_subs = []
+			sub = sub.strip()
+			sub = sub.split('|')
+
+			out_subs.append(sub[1].strip())      # wbse
+			out_subs.append('') 						     # skip row (used to be state)
+			# out_subs.append(sub[20].strip())   # state
+			out_subs.append(sub[21].strip())     # country
+			out_subs.append(sub[5].strip())      # subaward number
+			out_subs.append(sub[6].strip())      # ffata
+			out_subs.append(sub[9].strip())      # final invoice due
+			gl_break = text_to_cents(sub[14])
+			out_subs.append(amount_to_text(sub[14])) # gl break
+			out_subs.append('') 						     # skip row (used to be prior year wbse)
+			# out_subs.append(sub[11].strip())   # prior year wbse
+			out_subs.append(sub[10].strip())     # osp notes
+			out_subs.append('X') 						     # idc default (always X)
+			current_date = datetime.now()
+			current_date = current_date.strftime('%m/%d/%Y')
+			out_subs.append(current_date) 	     # received date (use current date)
+			out_subs.append('') 						     # skip row
+			prior_exp = text_to_cents(sub[13])
+			out_subs.append(amount_to_text(sub[13])) # manual prior exp
+
+			out_sub = '|'.join(out_subs)
+			# actual write to output happens after looping through budget periods. 
+
+			# the most recent budget period should be 9, one prior to it - 8, etc.
+			# (see period_layout())
+			num_periods = int(sub[sub_num_fields])
+			periods = layout[num_periods]
+
+			for category_gl, amount in source_budget_totals(sub, num_periods).items():
+				add_to_reconciliation(reconciliation, sub[1].strip(), 'Budget', category_gl, input_amt=amount)
+
+			# go through each valid budget period and collect line items for each. 
+			# if line items have values - write the period to the output file, 
+			# and conversely, if no values in any line items - skip that period.
+			non_zero_periods_exist = 0
+
+			used_budget_categories = set() # to keep track of which categories are used
+
+			wbse = sub[1].strip()
+			for period_num, fisc_per, fisc_yr, latest, gather in periods:
+
+				texts = gather(sub)
+				start = texts[0].strip()[0:10]
+				end = texts[1].strip()[0:10]
+				# unreasonable dates, and start date >= end date
+				report(('period', wbse, period_num, start, end))
+				idc_rate = text_to_rate(texts[2])
+				idc_adj_amt = text_to_cents(texts[3])
+				idc_rate_reformatted = rate_to_text(idc_rate, is_blank(texts[2]))
+
+				# line items in categories_list order: direct costs (salary to
+				# odc), idc (indirect cost), then equipment and misc; amounts
+				# other than idc are written as they are (see amount_to_text()),
+				# so one of less than a cent is still written
+				amounts = [text_to_cents(text) for text in texts[4:]]
+				line_items = [(amount_to_text(text), category_gl)
+					for text, amount, category_gl in zip(texts[4:10], amounts, direct_gls) if amount or text_to_float(text)]
+				others = [(amount_to_text(text), category_gl)
+					for text, amount, category_gl in zip(texts[10:], amounts[6:], other_gls) if amount or text_to_float(text)]
+				used_budget_categories.update([category_gl for amount_text, category_gl in line_items + others])
+				if idc_rate or idc_adj_amt:
+					idc = scale_down(sum(amounts[0:6]) * idc_rate, rate_scale) + idc_adj_amt
+					line_items.append((cents_to_text(idc), idc_gl))
+				line_items.extend(others)
+
+				# write to file
+				for amount_text, category_gl in line_items:
+					non_zero_periods_exist += 1
+					sub_detail = [wbse, fisc_per, fisc_yr, start, end, amount_text, category_gl, idc_rate_reformatted]
 					sub_detail = '|'.join(sub_detail)
 					outfile_subs_details.write(sub_detail + '\n')
 					output2_count += 1
+					add_to_reconciliation(reconciliation, wbse, 'Budget', category_gl, output_amt=text_to_cents(amount_text))
+				else:
+					# add one last record in period 9 if budget diff exists
+					# also, store some values for a later use (to add/subtract $1) 
+					if latest:
+						last_wbse = wbse
+						last_fisc_per = fisc_per
+						last_fisc_yr = fisc_yr
+						last_start = start
+						last_end = end
+						last_idc_rate_reformatted = idc_rate_reformatted
+						if wbse in budget_diffs:
+							amount, db_amt, sap_amt = budget_diffs[wbse]
+							category_gl = '099650'
+							sub_detail = [wbse, fisc_per, fisc_yr, start, end, amount, category_gl, idc_rate_reformatted]
+							sub_detail = '|'.join(sub_detail)
+							outfile_subs_details.write(sub_detail + '\n')
+							output2_count += 1
+							add_to_reconciliation(reconciliation, wbse, 'Budget', category_gl,
+								input_amt=decimal_to_cents(source_decimal(sap_amt)) - decimal_to_cents(source_decimal(db_amt)),
+								output_amt=text_to_cents(amount))
+
+			if non_zero_periods_exist:
+				# write the sub record to output
+				outfile_subs.write(out_sub + '\n')
+				output1_count += 1
+			else:
+				# the sub doesn't have any non-zero budgets; skip to next sub.
+				log_file.write('Sub wbse=' + wbse + ' dropped for not having any non-zero budgets\n')
+				subs_dropped_for_zero_budgets += 1
+				continue
+
+			# collect invoices for the given sub
+			# (sorted by end date, then by ID)
+			sub_id = sub[0]
+			sub_invs = [inv for inv, in staging.execute('''
+				SELECT record FROM invs WHERE sub_id = ?
+				ORDER BY end_date, CAST(id AS REAL), line''', (sub_id,))]
+
+			if sub_invs:
+
+				# convert a couple elements to float/date
+				new_sub_invs = []
+				for inv in sub_invs:
+					inv = inv.split('|')
+					inv[0] = text_to_float(inv[0])   # id
+					inv[24] = text_to_date(inv[24])  # end date
+					new_sub_invs.append(inv)
+				# cleanup
+				sub_invs = new_sub_invs
+				del new_sub_invs
+
+				used_exp_categories = set() # to keep track of non-zero exp categories
+
+				for inv in sub_invs:
+					for category_gl, amount in source_expense_totals(inv).items():
+						add_to_reconciliation(reconciliation, sub[1].strip(), 'Expense', category_gl, input_amt=amount)
+
+					# collect all line items (salary - misc, with idc as an amount)
+					line_items, idcr, idcr_text = invoice_line_items(inv)
+					total_inv_amount = sum(line_items)
+
+					if not total_inv_amount:
+						log_file.write('Inv id=' + str(round(inv[0])) + ' has total amt = 0 but will still be migrated\n')
+						invs_with_zero_total += 1
+						# We used to drop invoices with 0 totals.
+						# As of July 2017, we keep them but still log them for information.
+						#continue
+
+					out_invs = []
+
+					out_invs.append(sub[1].strip())         # wbse
+					inv_num = inv[2].strip()
+					out_invs.append(inv_num)                # invoice number
+					out_invs.append(inv[3].strip())         # ap check req number
+					rec_date = inv[6].strip()[0:10]
+					out_invs.append(rec_date)               # received date
+					out_invs.append(inv[10].strip())        # final
+					out_invs.append('')                     # skip row (treat as final)
+					out_invs.append(inv[11].strip())        # initially accurate
+					out_invs.append('')                     # skip row (vendor)
+					out_invs.append('')                     # skip row (wire draft)
+					out_invs.append(inv[9].strip())         # notes
+					start_date = inv[23].strip()[0:10]
+					out_invs.append(start_date)             # start date
+					end_date = inv[24].strftime('%m/%d/%Y')
+					out_invs.append(end_date)               # end date
+					out_invs.append(sub[sub_num_fields + 1].strip()) # osp invoice type - DB or ADJ
+					out_invs.append(rate_to_text(idcr, is_blank(idcr_text))) # idc rate
+
+					# unreasonable dates, and start date >= end date
+					report(('inv', inv[0], rec_date, start_date, end_date))
+
+					out_inv = '|'.join(out_invs)
+					outfile_invs.write(out_inv + '\n')
+					output3_count += 1
+
+					wbse = sub[1].strip()
+					inv_num = inv[2].strip()
+
+					# gl_bucket: 1 = 6916xx, 2 = 6971xx, or 3=both
+					for (category_gl, cost_elems, spent), amount in zip(expense_items, line_items):
+						if amount:
+							if spent:    # we don't care about IDC
+								used_exp_categories.add(category_gl)
+
+							gl_bucket = get_gl_bucket(gl_break, prior_exp, amount)
+
+							if gl_bucket == 1 or gl_bucket == 2:
+								cost_elem = cost_elems[gl_bucket - 1]
+								amount_text = cents_to_text(amount)
+								inv_detail = [wbse, inv_num, amount_text, cost_elem]
+								inv_detail = '|'.join(inv_detail)
+								outfile_invs_details.write(inv_detail + '\n')
+								output4_count += 1
+								add_to_reconciliation(reconciliation, wbse, 'Expense', category_gl,
+									output_amt=text_to_cents(amount_text))
+							else:
+								amount_1 = gl_break - prior_exp
+								amount_2 = amount - amount_1
+								# gl bucket 1
+								cost_elem = cost_elems[0]
+								amount_text = cents_to_text(amount_1)
+								inv_detail = [wbse, inv_num, amount_text, cost_elem]
+								inv_detail = '|'.join(inv_detail)
+								outfile_invs_details.write(inv_detail + '\n')						
+								add_to_reconciliation(reconciliation, wbse, 'Expense', category_gl,
+									output_amt=text_to_cents(amount_text))
+								# gl bucket 2
+								cost_elem = cost_elems[1]
+								amount_text = cents_to_text(amount_2)
+								inv_detail = [wbse, inv_num, amount_text, cost_elem]
+								inv_detail = '|'.join(inv_detail)
+								outfile_invs_details.write(inv_detail + '\n')
+								add_to_reconciliation(reconciliation, wbse, 'Expense', category_gl,
+									output_amt=text_to_cents(amount_text))
+								output4_count += 2
+
+							prior_exp += amount
+
+			# At this point, we have passed through one sub and all its invoices.
+			# Now, check for existance of zero budget categories that had expenses:
+			# if found, add $1 in each of those budget categories; then add the sum
+			# of those $1s to GL 693558(F&A) so the net change equals 0.
+			spent_but_unbudgeted = used_exp_categories.difference(used_budget_categories)
+			count_spent_but_unbudgeted = len(spent_but_unbudgeted)
+			if count_spent_but_unbudgeted:
+				# the additions expected, apart from the rows written for them
+				for gl in spent_but_unbudgeted:
+					add_to_reconciliation(reconciliation, wbse, 'Budget', gl, adjustment_amt=100)
+				add_to_reconciliation(reconciliation, wbse, 'Budget', '693558', adjustment_amt=-100 * count_spent_but_unbudgeted)
+				for gl in spent_but_unbudgeted:
+					amount = '1'
+					category_gl = gl
+					last_wbse = wbse
+					sub_detail = [last_wbse, last_fisc_per, last_fisc_yr, last_start, last_end, amount, category_gl, last_idc_rate_reformatted]
+					sub_detail = '|'.join(sub_detail)
+					# print(sub_detail)
+					outfile_subs_details.write(sub_detail + '\n')
+					output2_count += 1
+					add_to_reconciliation(reconciliation, wbse, 'Budget', category_gl, output_amt=text_to_cents(amount))
+				# add the negative amount so the net change equals 0
+				amount = '-' + str(count_spent_but_unbudgeted)
+				category_gl = '693558'  # the F&A gl, per Mary's email from 7/20/2017
+				last_wbse = wbse
+				sub_detail = [last_wbse, last_fisc_per, last_fisc_yr, last_start, last_end, amount, category_gl, last_idc_rate_reformatted]
+				sub_detail = '|'.join(sub_detail)
+				# print(sub_detail)
+				outfile_subs_details.write(sub_detail + '\n')
+				output2_count += 1
+				add_to_reconciliation(reconciliation, wbse, 'Budget', category_gl, output_amt=text_to_cents(amount))
+				subs_fixed_with_dollar_adds += 1
+				affected_gls = ', '.join(spent_but_unbudgeted)
+				log_file.write('Sub wbse=' + last_wbse + ' edited with one-dollar addition(s) to budget account(s) ' + affected_gls + '\n')
+
+		to_print = 'Subs dropped for having empty budgets...'; print(to_print, end='')
+		print(padded_text(subs_dropped_for_zero_budgets, len(to_print)))
+		to_print = 'Subs fixed with $1 additions to plan...'; print(to_print, end='')
+		print(padded_text(subs_fixed_with_dollar_adds, len(to_print)))
+		to_print = 'Invs with $0 total but still migrated...'; print(to_print, end='')
+		print(padded_text(invs_with_zero_total, len(to_print)))
+
+		to_print = 'Output records created - subs:'; print(to_print, end='')
+		print(padded_text(output1_count, len(to_print)))
+		to_print = 'Output records created - subs_details:'; print(to_print, end='')
+		print(padded_text(output2_count, len(to_print)))
+		to_print = 'Output records created - invs:'; print(to_print, end='')
+		print(padded_text(output3_count, len(to_print)))
+		to_print = 'Output records created - invs_details:'; print(to_print, end='')
+		print(padded_text(output4_count, len(to_print)))
+		to_print = 'Reconciliation mismatches...'; print(to_print, end='')
+		mismatches = write_reconciliation(reconciliation, path('reconciliation.txt'))
+		print(padded_text(mismatches, len(to_print)))
+		if diagnostics == 'bulk':
+			to_print = 'Validation entries written to log...'; print(to_print, end='')
+			print(padded_text(validate(checks, log_file, to_date), len(to_print)))
+
+		outfile_subs.close()
+		outfile_subs_details.close()
+		outfile_invs.close()
+		outfile_invs_details.close()
+
+		if input_subs_fname.endswith('.xlsx'):
+			to_print = 'Writing output_subs.xlsx...'; print(to_print, end='')
+			workbook = openpyxl.Workbook(write_only=True)
+			write_target_sheet(workbook, 'Target1', path('output_subs.txt'), [6, 12])
+			write_target_sheet(workbook, 'Target2', path('output_subs_details.txt'), [1, 2, 5, 7])
+			workbook.save(path('output_subs.xlsx'))
+			print(padded_text('OK', len(to_print)))
+
+		if columnar:
+			to_print = 'Writing ' + columnar + ' outputs...'; print(to_print, end='')
+			for name in ['output_subs', 'output_subs_details', 'output_invs', 'output_invs_details']:
+				write_columnar(path(name), columnar)
+			print(padded_text('OK', len(to_print)))
+
+		staging.close()
+		log_file.write('----- End:   ' + str(datetime.now()) + ' -----\n')
+		log_file.close()
+
+		return {
+			'subs': output1_count,
+			'subs_details': output2_count,
+			'invs': output3_count,
+			'invs_details': output4_count,
+			'reconciliation_mismatches': mismatches
+		}
+	finally:
+		for item in opened:
+			item.close()
+
+def main(argv):
+
+	args = parse_args(argv)
+
+	print('-' * 51)
+	print('Program started', ' '*14, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+	print('-' * 51)
+
+	try:
+		tables = load_reference_tables()[0]
+		if not args.wbse:
+			sleep(1) # a quick look up of a few subs shouldn't wait
+		convert(tables, args.columnar, args.diagnostics, wbses=args.wbse, fiscal_year=args.fiscal_year)
+	except ConversionError as error:
+		print(error)
+		print('-' * 51); print('Program terminated early'); print('-' * 51)
+		exit()
 
-	if non_zero_periods_exist:
-		# write the sub record to output
-		outfile_subs.write(out_sub + '\n')
-		output1_count += 1
-	else:
-		# the sub doesn't have any non-zero budgets; skip to next sub.
-		log_file.write('Sub wbse=' + wbse + ' dropped for not having any non-zero budgets\n')
-		subs_dropped_for_zero_budgets += 1
-		continue
-
-	# collect invoices for the given sub
-	sub_invs = []
-	sub_id = sub[0]
-	for inv in invs:
-		inv = inv.strip()
-		inv = inv.split('|')
-		if inv[1] == sub_id:
-			inv = '|'.join(inv)
-			sub_invs.append(inv)
-
-	if sub_invs:
-
-		# convert a couple elements to float/date for sorting on them later
-		new_sub_invs = []
-		for inv in sub_invs:
-			inv = inv.split('|')
-			inv[0] = text_to_float(inv[0])   # id
-			inv[24] = text_to_date(inv[24])  # end date
-			new_sub_invs.append(inv)
-		# cleanup
-		sub_invs = new_sub_invs
-		del new_sub_invs
-
-		# sort invoices by end date, then by ID
-		sub_invs.sort(key=itemgetter(0))   # secondary sort (by ID)
-		sub_invs.sort(key=itemgetter(24))  # primary sort (by end date)
-
-		used_exp_categories = set() # to keep track of non-zero exp categories
-		
-		for inv in sub_invs:
-			# collect all line items (salary - misc)
-			line_items = []
-			for i in range(25,35):
-				item = inv[i]
-				item = text_to_float(item)
-				line_items.append(item if item else 0)
-
-			direct_cost = sum(line_items[0:6])
-			idc = direct_cost * line_items[6] + line_items[7]
-			total_inv_amount = direct_cost + idc + sum(line_items[8:])
-
-			if not total_inv_amount:
-				log_file.write('Inv id=' + str(round(inv[0])) + ' has total amt = 0 but will still be migrated\n')
-				invs_with_zero_total += 1
-				# We used to drop invoices with 0 totals.
-				# As of July 2017, we keep them but still log them for information.
-				#continue
-
-			line_items[6] = idc # replace idc_rate with idc amount
-			line_items.pop(7)   # remove adj item
-
-			out_invs = []
-
-			out_invs.append(sub[1].strip())         # wbse
-			inv_num = inv[2].strip()
-			out_invs.append(inv_num)                # invoice number
-			out_invs.append(inv[3].strip())         # ap check req number
-			rec_date = inv[6].strip()[0:10]
-			out_invs.append(rec_date)               # received date
-			if rec_date:
-				if not is_date_reasonable(text_to_date(rec_date)):
-					log_file.write('Inv id=' + str(round(inv[0])) + ' has an unreasonable received date: ' + rec_date + '\n')
-			out_invs.append(inv[10].strip())        # final
-			out_invs.append('')                     # skip row (treat as final)
-			out_invs.append(inv[11].strip())        # initially accurate
-			out_invs.append('')                     # skip row (vendor)
-			out_invs.append('')                     # skip row (wire draft)
-			out_invs.append(inv[9].strip())         # notes
-			start_date = inv[23].strip()[0:10]
-			out_invs.append(start_date)             # start date
-			if not is_date_reasonable(text_to_date(start_date)):
-				log_file.write('Inv id=' + str(round(inv[0])) + ' has an unreasonable start date: ' + start_date + '\n')
-			end_date = inv[24].strftime('%m/%d/%Y')
-			out_invs.append(end_date)               # end date
-			if not is_date_reasonable(text_to_date(end_date)):
-				log_file.write('Inv id=' + str(round(inv[0])) + ' has an unreasonable end date: ' + end_date + '\n')
-			out_invs.append(sub[97].strip()) 	      # osp invoice type - DB or ADJ
-			idcr = text_to_float(inv[31])
-			idcr_reformatted = round((idcr * 100), 2)
-			out_invs.append(str(idcr_reformatted))  # idc rate
-
-			# check if end date is greater than start date; make a log entry if not true
-			dates_diff = text_to_date(end_date) - text_to_date(start_date)
-			if dates_diff <= timedelta(days = 0):
-				log_file.write('Inv id=' + str(round(inv[0])) + ' has start date >= end date but will still be migrated\n')
-
-			out_inv = '|'.join(out_invs)
-			outfile_invs.write(out_inv + '\n')
-			output3_count += 1
+	print('-' * 51)
+	print('Program completed', ' '*12, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+	print('-' * 51)
 
-			wbse = sub[1].strip()
-			inv_num = inv[2].strip()
-
-			# gl_bucket: 1 = 6916xx, 2 = 6971xx, or 3=both
-			for index, amount in enumerate(line_items):
-				if amount:
-					if index != 6:    # we don't care about IDC
-						used_exp_categories.add(budget_categories[categories_list[index]])
-
-					amount = round(amount, 2)
-					gl_bucket = get_gl_bucket(gl_break, prior_exp, amount)
-
-					if gl_bucket == 1 or gl_bucket == 2:
-						cost_elem = exp_categories[index][gl_bucket - 1]
-						inv_detail = [wbse, inv_num, str(amount), cost_elem]
-						inv_detail = '|'.join(inv_detail)
-						outfile_invs_details.write(inv_detail + '\n')
-						output4_count += 1
-					else:
-						amount_1 = round((gl_break - prior_exp), 2)
-						amount_2 = round((amount - amount_1), 2)
-						# gl bucket 1
-						cost_elem = exp_categories[index][0]  
-						inv_detail = [wbse, inv_num, str(amount_1), cost_elem]
-						inv_detail = '|'.join(inv_detail)
-						outfile_invs_details.write(inv_detail + '\n')						
-						# gl bucket 2
-						cost_elem = exp_categories[index][1]
-						inv_detail = [wbse, inv_num, str(amount_2), cost_elem]
-						inv_detail = '|'.join(inv_detail)
-						outfile_invs_details.write(inv_detail + '\n')
-						output4_count += 2
-
-					prior_exp += amount
-
-	# At this point, we have passed through one sub and all its invoices.
-	# Now, check for existance of zero budget categories that had expenses:
-	# if found, add $1 in each of those budget categories; then add the sum
-	# of those $1s to GL 693558(F&A) so the net change equals 0.
-	spent_but_unbudgeted = used_exp_categories.difference(used_budget_categories)
-	count_spent_but_unbudgeted = len(spent_but_unbudgeted)
-	if count_spent_but_unbudgeted:
-		for gl in spent_but_unbudgeted:
-			amount = '1'
-			category_gl = gl
-			last_wbse = wbse
-			sub_detail = [last_wbse, last_fisc_per, last_fisc_yr, last_start, last_end, amount, category_gl, last_idc_rate_reformatted]
-			sub_detail = '|'.join(sub_detail)
-			# print(sub_detail)
-			outfile_subs_details.write(sub_detail + '\n')
-			output2_count += 1
-		# add the negative amount so the net change equals 0
-		amount = '-' + str(count_spent_but_unbudgeted)
-		category_gl = '693558'  # the F&A gl, per Mary's email from 7/20/2017
-		last_wbse = wbse
-		sub_detail = [last_wbse, last_fisc_per, last_fisc_yr, last_start, last_end, amount, category_gl, last_idc_rate_reformatted]
-		sub_detail = '|'.join(sub_detail)
-		# print(sub_detail)
-		outfile_subs_details.write(sub_detail + '\n')
-		output2_count += 1
-		subs_fixed_with_dollar_adds += 1
-		affected_gls = ', '.join(spent_but_unbudgeted)
-		log_file.write('Sub wbse=' + last_wbse + ' edited with one-dollar addition(s) to budget account(s) ' + affected_gls + '\n')
-
-to_print = 'Subs dropped for having empty budgets...'; print(to_print, end='')
-print(padded_text(subs_dropped_for_zero_budgets, len(to_print)))
-to_print = 'Subs fixed with $1 additions to plan...'; print(to_print, end='')
-print(padded_text(subs_fixed_with_dollar_adds, len(to_print)))
-to_print = 'Invs with $0 total but still migrated...'; print(to_print, end='')
-print(padded_text(invs_with_zero_total, len(to_print)))
-
-to_print = 'Output records created - subs:'; print(to_print, end='')
-print(padded_text(output1_count, len(to_print)))
-to_print = 'Output records created - subs_details:'; print(to_print, end='')
-print(padded_text(output2_count, len(to_print)))
-to_print = 'Output records created - invs:'; print(to_print, end='')
-print(padded_text(output3_count, len(to_print)))
-to_print = 'Output records created - invs_details:'; print(to_print, end='')
-print(padded_text(output4_count, len(to_print)))
-
-log_file.write('----- End:   ' + str(datetime.now()) + ' -----\n')
-
-print('-' * 51)
-print('Program completed', ' '*12, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-print('-' * 51)
+if __name__ == '__main__':
+
+	main(sys.argv[1:])
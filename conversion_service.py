@@ -0,0 +1,242 @@
+# = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+# RESIDENT CONVERSION SERVICE. KEEPS CONVERSION.PY LOADED, WITH ITS
+# REFERENCE TABLES IN MEMORY, AND CONVERTS DUMPS ON REQUEST.
+# = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
+# For the many small reruns of a rehearsal: instead of starting Python,
+# importing conversion.py and reading the reference files every time,
+# start this once in the folder with the reference files:
+#   input_zfr1e.txt, input_subs_countries.txt, input_budget_diffs.txt,
+#   and subs_include.txt or subs_exclude.txt if used
+# A reference table is read again only when the size or modification time
+# of its file changed (or the file appeared or went away), so a table can
+# be edited while the service runs. zfr1e and countries are kept indexed
+# in an SQLite database in memory as well (see open_lookups() in
+# conversion.py), made again only when one of them is read again; each
+# job's staging.db is joined to it instead of loading them.
+
+# The service listens on localhost only (port 8017 by default, see
+# --port) and takes one job at a time:
+#
+# POST /convert with a JSON object:
+#   dir         - folder with input_subs.txt (or input_subs.xlsx) and
+#                 input_invs.txt; the outputs, log.txt and staging.db are
+#                 written there (default: the folder of the service). It
+#                 must be inside the folder of the service
+#   wbse        - list of WBSEs to convert (default: all); like option
+#                 --wbse, these subs and their invoices are read straight
+#                 from their places in the dumps, see input_subs.idx
+#   columnar    - "parquet" or "arrow", same as option --columnar
+#   diagnostics - "row", "bulk" or "off", same as option --diagnostics
+#   fiscal_year - fiscal year of the budget periods, same as option
+#                 --fiscal-year (default 2017)
+#   inline      - true to get the text of the four outputs in the reply
+# The reply is a JSON object with status "ok" (and the counts of records
+# written, the output files, the reference tables read again and the
+# seconds taken) or status "error" and a message.
+#
+# GET /status lists the reference tables in memory.
+
+# Example (from another console):
+#   curl -d '{"dir": "rehearsal3", "wbse": ["3012345"], "inline": true}' http://localhost:8017/convert
+
+import os
+import sys
+import json
+import argparse
+import traceback
+from datetime import datetime
+from time import perf_counter
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import conversion
+
+output_names = ['output_subs.txt', 'output_subs_details.txt', 'output_invs.txt', 'output_invs_details.txt']
+
+class ConversionService(HTTPServer):
+	'''
+	HTTP server that keeps the reference tables of conversion.py (see
+	load_reference_tables() there), and the lookups database made from
+	them (see open_lookups() there), between jobs. Requests are handled
+	one at a time, so jobs never run side by side.
+	'''
+	def __init__(self, port, ref_dir):
+		HTTPServer.__init__(self, ('127.0.0.1', port), ConversionHandler)
+		self.ref_dir = ref_dir
+		self.cache = {}
+		self.loaded = {}
+		self.lookups = None
+		self.lookups_key = None
+
+	def refresh(self):
+		'''
+		Reads the reference tables whose files changed since the last job,
+		makes the lookups database again if the zfr1e or countries table
+		in the cache isn't the one it was made from, and returns the
+		tables and the names of those read.
+		'''
+		tables, reloaded = conversion.load_reference_tables(self.ref_dir, self.cache)
+		for name in reloaded:
+			self.loaded[name] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+		key = (self.cache['zfr1e'][0], self.cache['countries'][0])
+		if key != self.lookups_key:
+			if self.lookups is not None:
+				self.lookups[0].close()
+			self.lookups = conversion.open_lookups(tables)
+			self.lookups_key = key
+		return tables, reloaded
+
+	def job_dir(self, job):
+		'''
+		Returns the full path of the folder of a job, or raises ValueError
+		if it isn't a folder inside the folder of the service.
+		'''
+		if not isinstance(job.get('dir', '.'), str):
+			raise ValueError('dir must be a folder name')
+		ref_dir = os.path.realpath(self.ref_dir)
+		work_dir = os.path.realpath(os.path.join(ref_dir, job.get('dir', '.')))
+		inside = os.path.normcase(os.path.join(ref_dir, ''))
+		if work_dir != ref_dir and not os.path.normcase(work_dir).startswith(inside):
+			raise ValueError('dir must be inside ' + ref_dir)
+		if not os.path.isdir(work_dir):
+			raise ValueError('no folder ' + job.get('dir', '.'))
+		return work_dir
+
+	def check_job(self, job):
+		'''
+		Raises ValueError if a job (see the notes at the top) isn't valid.
+		'''
+		if not isinstance(job, dict):
+			raise ValueError('a job is a JSON object')
+		wbses = job.get('wbse')
+		if wbses is not None and (not isinstance(wbses, list) or not wbses):
+			raise ValueError('wbse must be a list of WBSEs')
+		if job.get('columnar') not in (None, 'parquet', 'arrow'):
+			raise ValueError('columnar must be parquet or arrow')
+		if job.get('diagnostics', 'row') not in ('row', 'bulk', 'off'):
+			raise ValueError('diagnostics must be row, bulk or off')
+		fiscal_year = job.get('fiscal_year', 2017)
+		if not isinstance(fiscal_year, int) or isinstance(fiscal_year, bool):
+			raise ValueError('fiscal_year must be a number')
+		self.job_dir(job)
+
+	def run_job(self, job):
+		'''
+		Converts the dumps of a job and returns the reply.
+		'''
+		work_dir = self.job_dir(job)
+		wbses = job.get('wbse')
+		started = perf_counter()
+		tables, reloaded = self.refresh()
+		counts = conversion.convert(tables, job.get('columnar'), job.get('diagnostics', 'row'),
+			work_dir, [str(wbse) for wbse in wbses] if wbses else None, job.get('fiscal_year', 2017), self.lookups)
+		reply = {
+			'status': 'ok',
+			'counts': counts,
+			'outputs': [os.path.join(work_dir, fname) for fname in output_names],
+			'reloaded': reloaded,
+			'seconds': round(perf_counter() - started, 3)
+		}
+		if job.get('inline'):
+			reply['texts'] = {}
+			for fname in output_names:
+				with open(os.path.join(work_dir, fname), encoding='utf8') as outfile:
+					reply['texts'][fname] = outfile.read()
+		return reply
+
+	def status(self):
+		'''
+		Returns the reply for GET /status: the size and load time of each
+		reference table in memory (refreshed first).
+		'''
+		tables, reloaded = self.refresh()
+		reply = {'status': 'ok', 'dir': os.path.abspath(self.ref_dir), 'tables': {}}
+		for name, table in tables.items():
+			fname = conversion.reference_files[name][0]
+			if table is None:
+				reply['tables'][name] = {'file': fname, 'rows': None}
+			else:
+				reply['tables'][name] = {'file': fname, 'rows': len(table), 'loaded': self.loaded[name]}
+		return reply
+
+class ConversionHandler(BaseHTTPRequestHandler):
+
+	def send_reply(self, code, reply):
+		body = json.dumps(reply).encode('utf8')
+		self.send_response(code)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		if self.path != '/status':
+			self.send_reply(404, {'status': 'error', 'message': 'Unknown path ' + self.path})
+			return
+		try:
+			self.send_reply(200, self.server.status())
+		except Exception as error:
+			self.send_reply(500, {'status': 'error', 'message': str(error)})
+
+	def do_POST(self):
+		if self.path != '/convert':
+			self.send_reply(404, {'status': 'error', 'message': 'Unknown path ' + self.path})
+			return
+		try:
+			length = int(self.headers.get('Content-Length', 0))
+			job = json.loads(self.rfile.read(length).decode('utf8') or '{}')
+			self.server.check_job(job)
+		except ValueError as error:
+			self.send_reply(400, {'status': 'error', 'message': 'Bad job: ' + str(error)})
+			return
+
+		print('-' * 51)
+		print('Job started', ' '*18, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+		print('-' * 51)
+		try:
+			reply = self.server.run_job(job)
+		except conversion.ConversionError as error:
+			print(error)
+			print('-' * 51); print('Job terminated early'); print('-' * 51)
+			self.send_reply(422, {'status': 'error', 'message': str(error)})
+			return
+		except Exception as error:
+			# a bug or bad data the checks don't catch; the client still gets a reply
+			traceback.print_exc()
+			print('-' * 51); print('Job terminated early'); print('-' * 51)
+			self.send_reply(500, {'status': 'error', 'message': type(error).__name__ + ': ' + str(error)})
+			return
+		print('-' * 51)
+		print('Job completed', ' '*16, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+		print('-' * 51)
+		self.send_reply(200, reply)
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(
+		prog='conversion_service.py',
+		description='Keeps conversion.py and its reference tables loaded, and converts dumps on request.')
+	parser.add_argument('--port', type=int, default=8017,
+		help='port on localhost to listen on (default 8017)')
+	parser.add_argument('--dir', default='.',
+		help='folder with the reference files (default: the current folder)')
+	return parser.parse_args(argv)
+
+def main(argv):
+
+	args = parse_args(argv)
+	service = ConversionService(args.port, args.dir)
+	try:
+		tables, reloaded = service.refresh()
+	except conversion.ConversionError as error:
+		print(error)
+		exit()
+	print('Reference tables loaded:', ', '.join(reloaded))
+	print('Listening on http://localhost:' + str(args.port))
+	try:
+		service.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	service.server_close()
+
+if __name__ == '__main__':
+
+	main(sys.argv[1:])